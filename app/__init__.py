@@ -19,6 +19,7 @@ def create_app():
     with app.app_context():
         # 导入并创建模型表
         from . import models
+        from . import attack_rollups  # 注册统计预聚合的 before_flush 钩子
         db.create_all()
         # 创建默认用户（仅用于测试 — 使用哈希密码）
         if not models.User.query.filter_by(username='admin').first():
@@ -3,8 +3,19 @@
 支持 XSS, SQL注入, 命令注入, 目录遍历等多种攻击检测
 """
 import re
-from typing import Tuple, Optional, Dict
-from datetime import datetime, timedelta
+import sys
+import html
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from urllib.parse import unquote
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import FrozenSet, Tuple, Optional, Dict, List, NamedTuple
+
+logger = logging.getLogger(__name__)
 
 class AttackDetector:
     """攻击检测基类"""
@@ -13,13 +24,43 @@ class AttackDetector:
         self.attack_type = "unknown"
         self.attack_category = "unknown"
         self.severity = "medium"
+        self.flags = re.IGNORECASE
+        self.patterns = []
+        # 匹配解码前原始输入的规则（忽略大小写），用于只有以编码形式出现才可疑的写法
+        self.encoded_patterns = []
+        self._compiled = None
+        self._compiled_encoded = None
+    
+    @property
+    def compiled_patterns(self) -> List[Tuple[re.Pattern, str]]:
+        """预编译后的 (正则, 描述) 列表，首次使用时编译"""
+        if self._compiled is None:
+            self._compiled = [(re.compile(p, self.flags), d) for p, d in self.patterns]
+        return self._compiled
+
+    @property
+    def compiled_encoded_patterns(self) -> List[Tuple[re.Pattern, str]]:
+        if self._compiled_encoded is None:
+            self._compiled_encoded = [(re.compile(p, re.IGNORECASE), d) for p, d in self.encoded_patterns]
+        return self._compiled_encoded
     
     def detect(self, content: str) -> Tuple[bool, Optional[str]]:
         """
-        检测是否存在攻击
+        检测是否存在攻击（对规范化后的内容匹配）
         返回: (是否检测到攻击, 匹配的模式描述)
         """
-        raise NotImplementedError
+        if not content:
+            return False, None
+        
+        text = _default_canonicalizer.normalize(content).text
+        for regex, description in self.compiled_patterns:
+            if regex.search(text):
+                return True, description
+        for regex, description in self.compiled_encoded_patterns:
+            if regex.search(content):
+                return True, description
+        
+        return False, None
 
 
 class XSSDetector(AttackDetector):
@@ -30,11 +71,12 @@ class XSSDetector(AttackDetector):
         self.attack_type = "xss"
         self.attack_category = "injection"
         self.severity = "high"
+        self.flags = re.IGNORECASE | re.DOTALL
         
         self.patterns = [
             (r'<script[^>]*>.*?</script>', 'Script标签注入'),
             (r'javascript\s*:', 'JavaScript伪协议'),
-            (r'on\w+\s*=', '事件处理器注入'),
+            (r'<[^>]*\bon[a-z]+\s*=', '事件处理器注入'),
             (r'<iframe[^>]*>', 'iframe注入'),
             (r'<embed[^>]*>', 'embed标签注入'),
             (r'<object[^>]*>', 'object标签注入'),
@@ -43,16 +85,6 @@ class XSSDetector(AttackDetector):
             (r'document\.cookie', 'Cookie窃取尝试'),
             (r'document\.write', 'document.write注入'),
         ]
-    
-    def detect(self, content: str) -> Tuple[bool, Optional[str]]:
-        if not content:
-            return False, None
-        
-        for pattern, description in self.patterns:
-            if re.search(pattern, content, re.IGNORECASE | re.DOTALL):
-                return True, description
-        
-        return False, None
 
 
 class SQLInjectionDetector(AttackDetector):
@@ -88,16 +120,6 @@ class SQLInjectionDetector(AttackDetector):
             (r"0x[0-9a-fA-F]+", '十六进制编码注入'),
             (r"CHAR\s*\(\d+", 'CHAR编码注入'),
         ]
-    
-    def detect(self, content: str) -> Tuple[bool, Optional[str]]:
-        if not content:
-            return False, None
-        
-        for pattern, description in self.patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True, description
-        
-        return False, None
 
 
 class CommandInjectionDetector(AttackDetector):
@@ -144,16 +166,6 @@ class CommandInjectionDetector(AttackDetector):
             (r'>\s*/dev/null', '输出重定向'),
             (r'<\s*/etc/', '输入重定向敏感文件'),
         ]
-    
-    def detect(self, content: str) -> Tuple[bool, Optional[str]]:
-        if not content:
-            return False, None
-        
-        for pattern, description in self.patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True, description
-        
-        return False, None
 
 
 class PathTraversalDetector(AttackDetector):
@@ -169,11 +181,8 @@ class PathTraversalDetector(AttackDetector):
             (r'\.\./\.\./\.\./etc/passwd', '../../../etc/passwd'),
             (r'\.\./\.\./etc/shadow', '../../etc/shadow'),
             (r'\.\./\.\./windows/system32', '../../windows/system32'),
+            # 输入已经过 URL/HTML 实体解码，编码的 ../../ 同样归一后命中
             (r'\.\.[\\/]\.\.[\\/]', '../.. 路径遍历'),
-            (r'%2e%2e[/\\]', 'URL编码 ../ 遍历'),
-            (r'%252e%252e[/\\]', '双重URL编码遍历'),
-            (r'\.\.%2f', '混合编码遍历'),
-            (r'\.\.%5c', '反斜杠编码遍历'),
             (r'/etc/passwd', '直接访问 /etc/passwd'),
             (r'/etc/shadow', '直接访问 /etc/shadow'),
             (r'C:\\Windows\\System32', 'Windows系统目录'),
@@ -183,74 +192,1010 @@ class PathTraversalDetector(AttackDetector):
             (r'\.\.\\\.\.\\', 'Windows路径遍历'),
             (r'file:///', 'file协议访问'),
         ]
-    
-    def detect(self, content: str) -> Tuple[bool, Optional[str]]:
+        # 单个 ../ 在正常文本中很常见，只有以 URL 编码形式出现（%2e%2e/、%252e%252e%252f、..%5c 等）才视为遍历
+        self.encoded_patterns = [
+            (r'%(?:25)*2e(?:\.|%(?:25)*2e)(?:[\\/]|%(?:25)*(?:2f|5c))', 'URL编码 ../ 遍历'),
+            (r'\.(?:%(?:25)*2e(?:[\\/]|%(?:25)*(?:2f|5c))|\.%(?:25)*(?:2f|5c))', 'URL编码 ../ 遍历'),
+        ]
+
+# ---------------------------------------------------------------------------
+# 规则集编译：启动时把全部检测器的规则预编译为一个规则集
+# ---------------------------------------------------------------------------
+
+# re.IGNORECASE 下与 ASCII 字母等价的非 ASCII 字符（İ ı ſ K）
+_FOLD_TABLE = {**{c: chr(c + 32) for c in range(ord('A'), ord('Z') + 1)},
+               0x130: 'i', 0x131: 'i', 0x17F: 's', 0x212A: 'k'}
+
+_CATEGORY_ESCAPES = frozenset('dDsSwWbBAZ')
+_CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+_GROUP_OPEN_RE = re.compile(r'\((?:\?(?::|=|!|>|<=|<!|P<\w+>))?')
+_BRACE_QUANT_RE = re.compile(r'\{(?!\})(\d*)(?:,(\d*))?\}')
+
+
+def fold_case(content: str) -> str:
+    """按 re.IGNORECASE 的等价规则把文本折叠为小写"""
+    if content.isascii():
+        return content.lower()
+    return content.translate(_FOLD_TABLE)
+
+
+class CanonicalForm(NamedTuple):
+    text: str    # 解码、NFKC 归一化、去除空字节后的文本
+    folded: str  # text 经 fold_case 折叠后的文本
+
+
+class Canonicalizer:
+    """
+    负载规范化流水线，对每个输入只执行一次并记忆化：
+    迭代 URL 解码与 HTML 实体解码（最多 max_depth 轮，结果不再变化即停止）
+    → Unicode NFKC（全角等兼容字符折叠）→ 去除空字节 → 大小写折叠。
+    检测规则只需面向规范形式编写，不必为每种编码变体单独写正则。
+    URL 解码使用 unquote 而非 unquote_plus，'+' 保持原样，避免改变 SQL/命令中的运算符。
+    """
+
+    def __init__(self, max_depth: int = 3, max_entries: int = 1024, max_memo_chars: int = 4096,
+                 max_memo_bytes: int = 4 * 1024 * 1024):
+        self.max_depth = max(1, int(max_depth))
+        self.max_entries = max(1, int(max_entries))
+        self.max_memo_chars = int(max_memo_chars)
+        self.max_memo_bytes = max(1, int(max_memo_bytes))
+        self._memo: 'OrderedDict[str, Tuple[CanonicalForm, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'decoded': 0, 'depth_exhausted': 0, 'evictions': 0}
+
+    @staticmethod
+    def estimate_size(content: str, form: CanonicalForm) -> int:
+        """记忆表一条记录占用的字节数（键 + 规范文本 + 折叠文本，共享的字符串对象只计一次）"""
+        size = sys.getsizeof(content)
+        if form.text is not content:
+            size += sys.getsizeof(form.text)
+        if form.folded is not form.text and form.folded is not content:
+            size += sys.getsizeof(form.folded)
+        return size
+
+    def normalize(self, content: str) -> CanonicalForm:
+        """
+        返回内容的规范形式。只记忆不超过 max_memo_chars 的短输入（重复出现的多是短参数），
+        记忆表按条目数和总字节数（max_memo_bytes）双重限制，长请求体不会把大文本钉在内存里
+        """
+        memoize = len(content) <= self.max_memo_chars
+        if memoize:
+            with self._lock:
+                item = self._memo.get(content)
+                if item is not None:
+                    self._memo.move_to_end(content)
+                    self._stats['hits'] += 1
+                    return item[0]
+        form = self._canonicalize(content)
+        size = self.estimate_size(content, form) if memoize else 0
+        with self._lock:
+            self._stats['misses'] += 1
+            if form.text != content:
+                self._stats['decoded'] += 1
+            if memoize and size <= self.max_memo_bytes:
+                old = self._memo.pop(content, None)
+                if old is not None:
+                    self._bytes -= old[1]
+                self._memo[content] = (form, size)
+                self._bytes += size
+                while len(self._memo) > self.max_entries or self._bytes > self.max_memo_bytes:
+                    _, (_, evicted_size) = self._memo.popitem(last=False)
+                    self._bytes -= evicted_size
+                    self._stats['evictions'] += 1
+        return form
+
+    def _canonicalize(self, content: str) -> CanonicalForm:
+        text = content
+        for _ in range(self.max_depth):
+            decoded = unquote(text) if '%' in text else text
+            if '&' in decoded:
+                decoded = html.unescape(decoded)
+            if decoded == text:
+                break
+            text = decoded
+        else:
+            if ('%' in text and unquote(text) != text) or ('&' in text and html.unescape(text) != text):
+                with self._lock:
+                    self._stats['depth_exhausted'] += 1
+        if not text.isascii():
+            text = unicodedata.normalize('NFKC', text)
+        if '\x00' in text:
+            text = text.replace('\x00', '')
+        return CanonicalForm(text, fold_case(text))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._memo)
+            stats['bytes'] = self._bytes
+        stats['max_depth'] = self.max_depth
+        stats['max_memo_bytes'] = self.max_memo_bytes
+        return stats
+
+
+# 单独调用 AttackDetector.detect() 时使用的默认规范化器
+_default_canonicalizer = Canonicalizer()
+
+
+class _Token(NamedTuple):
+    kind: str  # lit / esc / class / any / open / close / alt / anchor / quant / raw
+    text: str  # 原始片段
+    char: str = ''  # kind == 'lit' 时对应的字面字符
+
+
+def _tokenize(pattern: str) -> List[_Token]:
+    """把规则拆成词法单元；不支持改写的语法（反向引用、数值转义、内联标志等）记为 raw"""
+    tokens = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            nxt = pattern[i + 1:i + 2]
+            text = pattern[i:i + 2]
+            if nxt and nxt in _CATEGORY_ESCAPES:
+                tokens.append(_Token('esc', text))
+            elif nxt in _CHAR_ESCAPES:
+                tokens.append(_Token('lit', text, _CHAR_ESCAPES[nxt]))
+            elif nxt and not nxt.isalnum():
+                tokens.append(_Token('lit', text, nxt))
+            else:
+                tokens.append(_Token('raw', text))
+            i += 2
+        elif c == '[':
+            j = i + 1
+            if pattern[j:j + 1] == '^':
+                j += 1
+            if pattern[j:j + 1] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 2 if pattern[j] == '\\' else 1
+            tokens.append(_Token('class', pattern[i:j + 1]))
+            i = j + 1
+        elif c == '(':
+            text = _GROUP_OPEN_RE.match(pattern, i).group()
+            if text == '(' and pattern[i + 1:i + 2] == '?':
+                tokens.append(_Token('raw', '(?'))
+                i += 2
+            else:
+                tokens.append(_Token('open', text))
+                i += len(text)
+        elif c == ')':
+            tokens.append(_Token('close', c))
+            i += 1
+        elif c == '|':
+            tokens.append(_Token('alt', c))
+            i += 1
+        elif c == '.':
+            tokens.append(_Token('any', c))
+            i += 1
+        elif c in '^$':
+            tokens.append(_Token('anchor', c))
+            i += 1
+        elif c in '*+?' or (c == '{' and _BRACE_QUANT_RE.match(pattern, i)):
+            text = c if c != '{' else _BRACE_QUANT_RE.match(pattern, i).group()
+            if pattern[i + len(text):i + len(text) + 1] in ('?', '+'):
+                text += pattern[i + len(text)]
+            tokens.append(_Token('quant', text))
+            i += len(text)
+        else:
+            tokens.append(_Token('lit', c, c))
+            i += 1
+    return tokens
+
+
+def _fold_class(text: str) -> Optional[str]:
+    """把字符类改写为小写形式；范围跨越大小写时返回 None"""
+    head = 2 if text.startswith('[^') else 1
+    atoms = []  # (字符或 None, 原始片段)
+    i, end = head, len(text) - 1
+    while i < end:
+        if text[i] == '\\':
+            nxt = text[i + 1]
+            if nxt in 'dDsSwW':
+                atoms.append((None, text[i:i + 2]))
+            elif nxt in _CHAR_ESCAPES:
+                atoms.append((_CHAR_ESCAPES[nxt], text[i:i + 2]))
+            elif not nxt.isalnum():
+                atoms.append((nxt, text[i:i + 2]))
+            else:
+                return None
+            i += 2
+        else:
+            atoms.append((text[i], text[i]))
+            i += 1
+
+    out = [text[:head]]
+    k = 0
+    while k < len(atoms):
+        char, src = atoms[k]
+        if char is not None and not char.isascii():
+            return None
+        if k + 2 < len(atoms) and atoms[k + 1][1] == '-':
+            lo, hi = char, atoms[k + 2][0]
+            if lo is None or hi is None or not hi.isascii():
+                return None
+            if lo.isalpha() and hi.isalpha() and lo.isupper() == hi.isupper():
+                out.append(f'{src.lower()}-{atoms[k + 2][1].lower()}')
+            elif not any(chr(c).isalpha() for c in range(ord(lo), ord(hi) + 1)):
+                out.append(f'{src}-{atoms[k + 2][1]}')
+            else:
+                return None
+            k += 3
+            continue
+        out.append(src.lower() if char and char.isalpha() else src)
+        k += 1
+    out.append(']')
+    return ''.join(out)
+
+
+def _fold_pattern(pattern: str) -> Optional[str]:
+    """把忽略大小写的规则改写为等价的小写规则；无法安全改写时返回 None"""
+    out = []
+    for tok in _tokenize(pattern):
+        if tok.kind == 'raw':
+            return None
+        if tok.kind == 'lit':
+            if not tok.char.isascii():
+                return None
+            out.append(tok.text.lower() if tok.char.isalpha() else tok.text)
+        elif tok.kind == 'class':
+            folded = _fold_class(tok.text)
+            if folded is None:
+                return None
+            out.append(folded)
+        else:
+            out.append(tok.text)
+    return ''.join(out)
+
+
+def _split_groups(tokens: List[_Token]) -> Optional[List[Tuple[List[_Token], Optional[str]]]]:
+    """
+    把顶层词法单元按分支拆开
+    返回: [(单元列表, 量词)] 的分支列表；括号不配对时返回 None
+    每个单元是单个原子 [token] 或完整分组 [open, ..., close]
+    """
+    branches = [[]]
+    i, n = 0, len(tokens)
+    while i < n:
+        tok = tokens[i]
+        if tok.kind == 'alt':
+            branches.append([])
+            i += 1
+            continue
+        if tok.kind == 'close':
+            return None
+        if tok.kind == 'open':
+            depth, j = 1, i + 1
+            while j < n and depth:
+                if tokens[j].kind == 'open':
+                    depth += 1
+                elif tokens[j].kind == 'close':
+                    depth -= 1
+                j += 1
+            if depth:
+                return None
+            unit = tokens[i:j]
+        else:
+            unit, j = [tok], i + 1
+        quant = tokens[j].text if j < n and tokens[j].kind == 'quant' else None
+        branches[-1].append((unit, quant))
+        i = j + (1 if quant is not None else 0)
+    return branches
+
+
+def _is_optional(quant: Optional[str]) -> bool:
+    return quant is not None and _parse_quant(quant)[0] == 0
+
+
+def _required_literals(tokens: List[_Token]) -> Optional[Tuple[str, ...]]:
+    """
+    提取规则的必需字面量：返回若干候选字面量（文本中至少出现其一规则才可能命中）
+    无法确定时返回 None（规则总是需要执行）
+    """
+    branches = _split_groups(tokens)
+    if branches is None:
+        return None
+    result = []
+    for branch in branches:
+        candidates = []  # 每项为一组候选字面量
+        run = []
+        for unit, quant in branch:
+            tok = unit[0]
+            if tok.kind == 'lit' and len(unit) == 1 and not _is_optional(quant):
+                run.append(tok.char)
+                if quant is None:
+                    continue
+            if run:
+                candidates.append((''.join(run),))
+                run = []
+            if tok.kind == 'open' and tok.text in ('(', '(?:', '(?>') or tok.text.startswith('(?P<'):
+                if not _is_optional(quant):
+                    inner = _required_literals(unit[1:-1])
+                    if inner:
+                        candidates.append(inner)
+        if run:
+            candidates.append((''.join(run),))
+        if not candidates:
+            return None
+        # 选择最短候选最长的一组，区分度最高
+        best = max(candidates, key=lambda c: (min(len(s) for s in c), -len(c)))
+        result.extend(best)
+    return tuple(dict.fromkeys(result))
+
+
+def _parse_quant(quant: str) -> Tuple[int, Optional[int], str]:
+    """解析量词，返回 (最少次数, 最多次数或 None 表示无界, 惰性/占有后缀)"""
+    suffix = ''
+    if len(quant) > 1 and quant[-1] in '?+' and not (quant[0] == '{' and quant[-1] == '}'):
+        quant, suffix = quant[:-1], quant[-1]
+    if quant == '*':
+        return 0, None, suffix
+    if quant == '+':
+        return 1, None, suffix
+    if quant == '?':
+        return 0, 1, suffix
+    m = _BRACE_QUANT_RE.match(quant)
+    lo = int(m.group(1)) if m.group(1) else 0
+    if m.group(2) is None:
+        hi = lo
+    else:
+        hi = int(m.group(2)) if m.group(2) else None
+    return lo, hi, suffix
+
+
+def _trim_trailing_repeats(pattern: str) -> str:
+    """
+    去掉规则末尾多余的重复（X+ -> X，X* / X? -> 省略），对 search 语义完全等价，
+    但避免正则在末尾贪婪吞掉整段输入
+    """
+    tokens = _tokenize(pattern)
+    if any(t.kind == 'raw' for t in tokens):
+        return pattern
+    branches = _split_groups(tokens)
+    if branches is None or len(branches) != 1:
+        return pattern
+    units = list(branches[0])
+    while units and units[-1][1] is not None:
+        unit, quant = units[-1]
+        lo = _parse_quant(quant)[0]
+        if lo == 0:
+            units.pop()
+            continue
+        units[-1] = (unit, None if lo == 1 else '{%d}' % lo)
+        break
+    if not units:
+        return pattern
+    return ''.join(''.join(t.text for t in unit) + (quant or '') for unit, quant in units)
+
+
+def _hoist_word_boundary(pattern: str) -> str:
+    r"""
+    把开头的 \b 移到字面量之后改写为后行断言：\bexec -> exec(?<!\wexec)
+    二者完全等价，但规则恢复了字面量前缀，re 可以快速定位起点，
+    且同一个单词内部不会反复作为匹配起点
+    """
+    m = re.match(r'\\b(\w+)', pattern)
+    if not m or not m.group(1).isascii() or pattern[m.end():m.end() + 1] in ('*', '+', '?', '{'):
+        return pattern
+    literal = m.group(1)
+    return f'{literal}(?<!\\w{literal}){pattern[m.end():]}'
+
+
+def optimize_pattern(pattern: str, safe_mode: bool = False, max_repeat: int = 128,
+                     flags: int = 0) -> Tuple[Optional[str], str]:
+    """
+    编译前的规则改写：总是执行等价改写（去掉末尾多余重复、前置单词边界后移）；
+    安全模式下再改写会灾难性回溯的量词，并让 "字面量.*其余" 形式的规则只从首个字面量处尝试
+    返回 (改写后的规则或 None, 状态)；状态为 unchecked / linear / bounded / rejected
+    """
+    pattern = _hoist_word_boundary(_trim_trailing_repeats(pattern))
+    if not safe_mode:
+        return pattern, 'unchecked'
+    pattern, status = _linearize(pattern, max_repeat)
+    if pattern is not None:
+        pattern = _first_occurrence_only(pattern, flags)
+    return pattern, status
+
+
+def _has_top_level_alt(tokens: List[_Token]) -> bool:
+    depth = 0
+    for tok in tokens:
+        depth += (tok.kind == 'open') - (tok.kind == 'close')
+        if tok.kind == 'alt' and depth == 0 or tok.kind == 'raw':
+            return True
+    return False
+
+
+def _monotone_head(tokens: List[_Token], k: int) -> Optional[int]:
+    """
+    tokens 以 P[^D]*L 开头（P、L 为字面量且 L 的首字符属于 D）并紧跟无界的 . 时，返回 . 的下标：
+    这种头部从起点 s 匹配时结束于 s 之后第一个 D，起点越靠后结束位置越靠后
+    """
+    unit = tokens[k]
+    if unit.kind != 'class' or not unit.text.startswith('[^') or len(unit.text) <= 3:
+        return None
+    j = k + 2
+    while j < len(tokens) and tokens[j].kind == 'lit':
+        j += 1
+    if j == k + 2 or j + 1 >= len(tokens) or tokens[j].kind != 'any' or tokens[j + 1].kind != 'quant' \
+            or _parse_quant(tokens[j + 1].text)[1] is not None:
+        return None
+    try:
+        if not re.fullmatch(f'[{unit.text[2:-1]}]', tokens[k + 2].char):
+            return None
+    except re.error:
+        return None
+    return j
+
+
+def _first_occurrence_only(pattern: str, flags: int) -> str:
+    r"""
+    P.*R / P[^D]*R（P 为字面量）在大量 P、没有后续部分的输入上每个起点都扫描到末尾，总耗时为平方级。
+    重复单元能匹配 P 中的所有字符时，同一段（不含重复单元无法匹配的字符 D）中较后的 P 能匹配，
+    从该段第一个 P 开始也一定能匹配，因此改写为只尝试每段第一个 P：
+    (?<![^D])(?>[^D]*?P)... ；DOTALL 下的 . 没有分段字符，改写为 \A(?>.*?P)...，结果不变且为线性。
+    DOTALL 下 P[^D]*L.*R（如 <script[^>]*>.*?</script>，L 的首字符属于 D）的头部结束位置随起点单调不减，
+    只需尝试整个输入中第一个头部匹配：\A(?>.*?(?<![^D])(?>[^D]*?P)[^D]*L).*R。
+    依赖原子分组（Python 3.11+），更早的版本保持原样
+    """
+    if not _ATOMIC_GROUPS:
+        return pattern
+    tokens = _tokenize(pattern)
+    k = 0
+    while k < len(tokens) and tokens[k].kind == 'lit':
+        k += 1
+    if not k or len(tokens) < k + 2 or tokens[k + 1].kind != 'quant' or _parse_quant(tokens[k + 1].text)[1] is not None:
+        return pattern
+    head = _monotone_head(tokens, k) if flags & re.DOTALL else None
+    unit = tokens[k]
+    if unit.kind == 'any':
+        delimiters = None if flags & re.DOTALL else r'\n'
+    elif unit.kind == 'class' and unit.text.startswith('[^') and len(unit.text) > 3:
+        delimiters = unit.text[2:-1]
+    else:
+        return pattern
+    if _has_top_level_alt(tokens):
+        return pattern
+    prefix = ''.join(t.text for t in tokens[:k])
+    rest = ''.join(t.text for t in tokens[k:])
+    if delimiters is None:
+        return f'\\A(?>.*?{prefix}){rest}'
+    try:
+        delimiter_re = re.compile(f'[{delimiters}]', flags & re.IGNORECASE)
+    except re.error:
+        return pattern
+    if any(delimiter_re.match(t.char) for t in tokens[:k]):
+        return pattern
+    segment_start = f'(?<![^{delimiters}])(?>[^{delimiters}]*?{prefix})'
+    if head is not None:
+        # P[^D]*L.*R：头部的结束位置随起点单调不减，整个输入中第一个头部匹配即可代表所有起点；
+        # 查找头部时同样只尝试每段第一个 P
+        head_rest = ''.join(t.text for t in tokens[k:head])
+        return '\\A(?>.*?%s%s)%s' % (segment_start, head_rest, ''.join(t.text for t in tokens[head:]))
+    return segment_start + rest
+
+
+# 判断两个重复单元字符集是否相交时使用的样本字符
+_ATOMIC_GROUPS = sys.version_info >= (3, 11)
+_OVERLAP_SAMPLE = ''.join(map(chr, range(256))) + '\u00a0\u2028\u3000\uff41\u4e2d'
+
+
+def _unit_chars(tok: Optional[_Token]) -> Optional[FrozenSet[str]]:
+    """单个原子能匹配的样本字符集合；分组等无法判断时返回 None（按相交处理）"""
+    if tok is None:
+        return None
+    try:
+        regex = re.compile(tok.text, re.IGNORECASE | re.DOTALL)
+    except re.error:
+        return None
+    return frozenset(c for c in _OVERLAP_SAMPLE if regex.fullmatch(c))
+
+
+def _overlaps(a: Optional[FrozenSet[str]], b: Optional[FrozenSet[str]]) -> bool:
+    return a is None or b is None or bool(a & b)
+
+
+def _linearize(pattern: str, max_repeat: int) -> Tuple[Optional[str], str]:
+    r"""
+    安全模式改写：只处理会灾难性回溯的结构，其余量词保持原样（填充字符不能绕过检测）
+    - 带多次重复量词的分组内部还含量词或分支（嵌套量词会指数回溯）：无法安全改写，拒绝；
+    - 同一序列中相邻（中间只有可为空的部分）且字符集相交的无界重复，如 \s*\s*、\w+\d+：
+      二者都改为最多 max_repeat 次；
+    反向引用等无法解析的语法同样拒绝。
+    返回 (改写后的规则或 None, 状态)；状态为 linear / bounded / rejected
+    """
+    tokens = _tokenize(pattern)
+    if any(t.kind == 'raw' for t in tokens):
+        return None, 'rejected'
+    out = []
+    stack = [[False, False]]  # 每层分组：[含量词, 含分支]
+    closed = None
+    unit = None  # 紧邻下一个量词之前的单个原子；分组为 None
+    consumed = False  # 上一个原子没有量词，必须消耗字符
+    pending = None  # 同一序列中上一个无界重复：(out 下标, 字符集, 最少次数, 后缀)
+    bounded = False
+    for tok in tokens:
+        if tok.kind != 'quant' and consumed:
+            pending = None
+        consumed = False
+        if tok.kind == 'open':
+            stack.append([False, False])
+            closed = unit = pending = None
+        elif tok.kind == 'close':
+            if len(stack) == 1:
+                return None, 'rejected'
+            closed = stack.pop()
+            stack[-1][0] = stack[-1][0] or closed[0]
+            unit = pending = None
+        elif tok.kind == 'alt':
+            stack[-1][1] = True
+            closed = unit = pending = None
+        elif tok.kind == 'quant':
+            lo, hi, suffix = _parse_quant(tok.text)
+            if closed is not None and (hi is None or hi > 1) and (closed[0] or closed[1]):
+                return None, 'rejected'
+            stack[-1][0] = True
+            chars = _unit_chars(unit)
+            closed = unit = None
+            if hi is None:
+                if pending is not None and _overlaps(pending[1], chars):
+                    idx, _, plo, psuffix = pending
+                    out[idx] = '{%d,%d}%s' % (plo, max(plo, max_repeat), psuffix)
+                    out.append('{%d,%d}%s' % (lo, max(lo, max_repeat), suffix))
+                    bounded = True
+                else:
+                    out.append(tok.text)
+                pending = (len(out) - 1, chars, lo, suffix)
+                continue
+            if lo > 0:
+                pending = None
+        else:
+            closed = None
+            consuming = tok.kind in ('lit', 'class', 'any') or (tok.kind == 'esc' and tok.text[1] in 'dDsSwW')
+            unit = tok if consuming else None
+            consumed = consuming
+        out.append(tok.text)
+    if len(stack) != 1:
+        return None, 'rejected'
+    return ''.join(out), 'bounded' if bounded else 'linear'
+
+
+@dataclass(frozen=True)
+class DetectionRule:
+    """规则集中的单条规则"""
+    rule_id: int
+    detector: str
+    attack_type: str
+    category: str
+    severity: str
+    description: str
+    pattern: str
+    flags: int
+    encoded: bool = False  # True 时匹配解码前的原始输入
+
+    def to_dict(self) -> Dict:
+        return {
+            'detector': self.detector,
+            'type': self.attack_type,
+            'category': self.category,
+            'severity': self.severity,
+            'description': self.description,
+        }
+
+
+class CompiledRuleSet:
+    """
+    检测规则集
+    构造时一次性编译所有检测器的规则；忽略大小写的规则改写为小写规则，
+    输入只做一次大小写折叠，使 re 能利用字面量前缀快速定位，避免逐条 IGNORECASE 扫描。
+    scan() 一次调用返回全部命中的规则（按检测器、规则顺序排列）。
+
+    字面量预过滤：编译时为每条规则提取必需字面量，扫描时先检查这些字面量是否出现，
+    缺失则整条正则跳过；提取不到字面量的规则总是执行。
+
+    安全模式（safe_mode）：只改写会灾难性回溯的结构（相邻且字符集相交的无界重复改为最多 max_repeat 次，
+    "字面量.*其余" 形式只从首个字面量处尝试，见 optimize_pattern），其余量词保持无界，填充字符无法绕过；
+    无法改写的规则在加载时被拒绝（记录告警并不参与扫描）；单个输入最多扫描 max_scan_chars 个字符。
+
+    规范化：提供 canonicalizer 时，所有规则匹配的是 Canonicalizer 产出的规范形式，
+    解码与大小写折叠每个输入只做一次。
+    """
+
+    def __init__(self, detectors: Dict[str, AttackDetector], safe_mode: bool = False,
+                 max_repeat: int = 128, max_scan_chars: int = 512 * 1024,
+                 canonicalizer: Optional[Canonicalizer] = None):
+        self.canonicalizer = canonicalizer
+        self.safe_mode = bool(safe_mode)
+        self.max_repeat = int(max_repeat)
+        self.max_scan_chars = int(max_scan_chars)
+        self.rejected: List[DetectionRule] = []
+        self.bounded_rules = 0
+        self.rules: List[DetectionRule] = []
+        for name, detector in detectors.items():
+            patterns = [(p, d, int(detector.flags), False) for p, d in detector.patterns]
+            patterns += [(p, d, int(re.IGNORECASE), True) for p, d in detector.encoded_patterns]
+            for pattern, description, flags, encoded in patterns:
+                self.rules.append(DetectionRule(
+                    rule_id=len(self.rules),
+                    detector=name,
+                    attack_type=detector.attack_type,
+                    category=detector.attack_category,
+                    severity=detector.severity,
+                    description=description,
+                    pattern=pattern,
+                    flags=flags,
+                    encoded=encoded,
+                ))
+
+        # 按 (改写后规则, 标志位) 去重编译；folded 组匹配折叠后的文本，raw 组匹配原文，
+        # encoded 组匹配解码前原始输入折叠后的文本；每项为 (正则, 规则, 必需字面量)
+        cache = {}
+        self._folded: List[Tuple[re.Pattern, DetectionRule, Optional[Tuple[str, ...]]]] = []
+        self._raw: List[Tuple[re.Pattern, DetectionRule, Optional[Tuple[str, ...]]]] = []
+        self._encoded: List[Tuple[re.Pattern, DetectionRule, Optional[Tuple[str, ...]]]] = []
+        for rule in self.rules:
+            pattern, status = optimize_pattern(rule.pattern, self.safe_mode, self.max_repeat, rule.flags)
+            if pattern is None:
+                logger.warning('安全模式拒绝规则 %s/%s：无法保证线性匹配 %r', rule.detector, rule.description, rule.pattern)
+                self.rejected.append(rule)
+                continue
+            if status == 'bounded':
+                self.bounded_rules += 1
+            folded = _fold_pattern(pattern) if rule.flags & re.IGNORECASE else None
+            if rule.encoded and folded is not None:
+                key = (folded, rule.flags & ~re.IGNORECASE)
+                group = self._encoded
+            elif folded is not None:
+                key = (folded, rule.flags & ~re.IGNORECASE)
+                group = self._folded
+            else:
+                key = (pattern, rule.flags)
+                group = self._raw
+            if key not in cache:
+                cache[key] = re.compile(*key)
+            literals = None
+            if not key[1] & re.IGNORECASE:
+                literals = _required_literals(_tokenize(key[0]))
+            group.append((cache[key], rule, literals))
+        # (字面量, 字面量字符集)：文本缺少任一字符时无需做子串查找
+        self._folded_literals = tuple((l, frozenset(l)) for l in {l for _, _, lits in self._folded if lits for l in lits})
+        self._raw_literals = tuple((l, frozenset(l)) for l in {l for _, _, lits in self._raw if lits for l in lits})
+        self._encoded_literals = tuple((l, frozenset(l)) for l in {l for _, _, lits in self._encoded if lits for l in lits})
+        self.fallback_rules = sum(1 for group in (self._folded, self._raw, self._encoded)
+                                  for _, _, lits in group if not lits)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'scans': 0,              # 扫描的输入数
+            'prefilter_rejects': 0,  # 预过滤后无需执行任何正则的输入数
+            'rules_skipped': 0,      # 因必需字面量缺失而跳过的正则
+            'rules_evaluated': 0,    # 实际执行的正则（含无字面量的兜底规则）
+            'fallback_evaluated': 0,  # 其中无字面量兜底规则的执行次数
+            'rules_matched': 0,      # 命中的规则
+            'truncated_scans': 0,    # 安全模式下超长被截断的输入
+        }
+
+        digest = hashlib.sha1()
+        for rule in self.rules:
+            digest.update(repr((rule.detector, rule.pattern, rule.flags, rule.description, rule.severity,
+                                rule.encoded)).encode('utf-8'))
+        depth = canonicalizer.max_depth if canonicalizer else None
+        digest.update(repr((self.safe_mode, self.max_repeat, self.max_scan_chars, depth)).encode('utf-8'))
+        self.version = digest.hexdigest()[:16]
+
+    def scan(self, content: str) -> List[DetectionRule]:
+        """返回命中的全部规则"""
         if not content:
-            return False, None
-        
-        for pattern, description in self.patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True, description
-        
-        return False, None
+            return []
+        truncated = self.safe_mode and len(content) > self.max_scan_chars
+        if truncated:
+            content = content[:self.max_scan_chars]
+        raw = content
+        folded = None
+        if self.canonicalizer is not None:
+            content, folded = self.canonicalizer.normalize(content)
+        hits = []
+        counts = [0, 0, 0]  # skipped, evaluated, fallback
+        if self._folded:
+            if folded is None:
+                folded = fold_case(content)
+            self._scan_group(self._folded, self._folded_literals, folded, hits, counts)
+        if self._raw:
+            self._scan_group(self._raw, self._raw_literals, content, hits, counts)
+        if self._encoded:
+            self._scan_group(self._encoded, self._encoded_literals,
+                             folded if raw is content and folded is not None else fold_case(raw), hits, counts)
+        if self._raw or self._encoded:
+            hits.sort(key=lambda r: r.rule_id)
+
+        with self._stats_lock:
+            s = self._stats
+            s['scans'] += 1
+            s['rules_skipped'] += counts[0]
+            s['rules_evaluated'] += counts[1]
+            s['fallback_evaluated'] += counts[2]
+            s['rules_matched'] += len(hits)
+            s['truncated_scans'] += int(truncated)
+            if not counts[1]:
+                s['prefilter_rejects'] += 1
+        return hits
+
+    @staticmethod
+    def _scan_group(group, literals, text, hits, counts):
+        chars = set(text)
+        present = {l for l, need in literals if need <= chars and l in text}
+        for regex, rule, lits in group:
+            if lits is None:
+                counts[2] += 1
+            elif not any(l in present for l in lits):
+                counts[0] += 1
+                continue
+            counts[1] += 1
+            if regex.search(text):
+                hits.append(rule)
+
+    def get_stats(self) -> Dict:
+        """预过滤与正则执行计数"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        considered = stats['rules_skipped'] + stats['rules_evaluated']
+        stats['skip_rate'] = round(stats['rules_skipped'] / considered, 4) if considered else 0.0
+        stats['rules'] = len(self.rules)
+        stats['fallback_rules'] = self.fallback_rules
+        stats['safe_mode'] = self.safe_mode
+        stats['bounded_rules'] = self.bounded_rules
+        stats['rejected_rules'] = [f'{r.detector}: {r.description}' for r in self.rejected]
+        return stats
+
+
+class DetectionCache:
+    """
+    检测结果缓存（线程安全、按条目数和字节数双重限制的 LRU）
+    键为负载文本的 blake2b 摘要，并以规则集版本作为个性化参数，规则变更后旧条目自然失效
+    """
+
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 8 * 1024 * 1024):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self._data: 'OrderedDict[bytes, Tuple[Dict, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(content: str, version: str) -> bytes:
+        h = hashlib.blake2b(digest_size=16, person=version.encode('ascii')[:16])
+        h.update(content.encode('utf-8', 'surrogatepass'))
+        return h.digest()
+
+    @staticmethod
+    def estimate_size(result: Dict) -> int:
+        """粗略估算一条结果占用的字节数（键 + 结果字典）"""
+        return 256 + 160 * (len(result.get('attacks', ())) + len(result.get('matches', ())))
+
+    def get(self, key: bytes) -> Optional[Dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return item[0]
+
+    def put(self, key: bytes, value: Dict, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats['evictions'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self._stats['invalidations'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._data)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+@dataclass(frozen=True)
+class DetectionPolicy:
+    """
+    单个端点的检测策略（声明式，在 init_routes 时编译）
+    detectors: 参与检测的检测器名称，空元组表示不检测
+    fields: 需要检测的字段（"来源:字段名"，如 json:query、query:q），None 表示全部字段
+    max_chars: 单个字段最多检测的字符数
+    max_body_bytes: 请求体最多扫描的字节数，None 表示使用全局配置
+    mode: block —— 中间件命中即拦截；log —— 只记录结论，由路由自行处理
+    """
+    detectors: Tuple[str, ...] = ('xss', 'sqli', 'cmdi', 'path_traversal')
+    fields: Optional[Tuple[str, ...]] = None
+    max_chars: int = 8192
+    max_body_bytes: Optional[int] = None
+    mode: str = 'block'
+
+    def __post_init__(self):
+        if self.mode not in ('block', 'log'):
+            raise ValueError(f'未知的检测模式: {self.mode}')
+
+
+class CompiledPolicy:
+    """编译后的端点策略：持有只包含所需检测器的规则集，字段过滤为 O(1) 集合查找"""
+
+    def __init__(self, endpoint: str, policy: DetectionPolicy, ruleset: 'CompiledRuleSet'):
+        self.endpoint = endpoint
+        self.policy = policy
+        self.ruleset = ruleset
+        self._fields = frozenset(policy.fields) if policy.fields is not None else None
+
+    @property
+    def blocking(self) -> bool:
+        return self.policy.mode == 'block'
+
+    def wants(self, source: str, name: str) -> bool:
+        return self._fields is None or f'{source}:{name}' in self._fields
+
+
+class RateLimitDecision(NamedTuple):
+    exceeded: bool
+    attack_type: str
+    count: int
+    retry_after: int
+    # 本窗口内该键的第一次超限（只有这一次需要记录日志）
+    first_violation: bool = False
 
 
 class RateLimitDetector:
-    """频率限制检测器（用于检测暴力破解和DoS）"""
-    
-    def __init__(self, flask_app, db_instance):
+    """
+    频率限制检测器（用于检测暴力破解和DoS）
+    内存中的滑动窗口计数：每个 (ip, 端点类别) 只保存当前与上一个固定窗口的计数，
+    估算值 = 上一窗口计数 × 上一窗口仍在滑动窗口内的比例 + 当前窗口计数，每次检查 O(1)、不访问数据库。
+    键按最近使用顺序保存在 OrderedDict 中，检查时顺带淘汰空闲超过两个窗口的键，
+    总数超过 RATE_LIMIT_MAX_KEYS 时淘汰最久未使用的键，内存有上限。
+    超限只在每个键每个窗口的第一次交给攻击日志写入器记录（RATE_LIMIT_PERSIST_VIOLATIONS），
+    持续洪泛不会放大为数据库写入。
+    """
+
+    DEFAULT_THRESHOLDS = {
+        'login': {'requests': 5, 'window': 60, 'severity': 'high'},  # 1分钟5次
+        'api': {'requests': 30, 'window': 60, 'severity': 'medium'},  # 1分钟30次
+        'general': {'requests': 100, 'window': 60, 'severity': 'low'},  # 1分钟100次
+    }
+    # 每次检查最多顺带淘汰的空闲键数
+    EVICT_PER_CHECK = 8
+
+    def __init__(self, flask_app, db_instance, clock=time.monotonic):
         self.app = flask_app
         self.db = db_instance
-        self.thresholds = {
-            'login': {'requests': 5, 'window': 60, 'severity': 'high'},  # 1分钟5次
-            'api': {'requests': 30, 'window': 60, 'severity': 'medium'},  # 1分钟30次
-            'general': {'requests': 100, 'window': 60, 'severity': 'low'},  # 1分钟100次
-        }
-    
+        config = flask_app.config
+        self.thresholds = {k: dict(v) for k, v in self.DEFAULT_THRESHOLDS.items()}
+        for endpoint_type, overrides in (config.get('RATE_LIMIT_THRESHOLDS') or {}).items():
+            self.thresholds.setdefault(endpoint_type, {}).update(overrides)
+        self.max_keys = max(1, int(config.get('RATE_LIMIT_MAX_KEYS', 50000)))
+        self.persist_violations = bool(config.get('RATE_LIMIT_PERSIST_VIOLATIONS', True))
+        self._idle = 2 * max(t['window'] for t in self.thresholds.values())
+        self._clock = clock
+        # (ip, 端点类别) -> [当前窗口起点, 当前窗口计数, 上一窗口计数, 已记录超限的窗口起点]
+        self._counters: 'OrderedDict[Tuple[str, str], list]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'checks': 0, 'exceeded': 0, 'violations_logged': 0, 'evicted_idle': 0, 'evicted_lru': 0}
+        self._log_writer = None
+
+    @staticmethod
+    def endpoint_type(endpoint: str, method: str = 'POST') -> str:
+        # 只有提交登录（非 GET）按暴力破解阈值计数，打开登录页按普通请求
+        if 'login' in endpoint.lower() and method not in ('GET', 'HEAD'):
+            return 'login'
+        if '/api/' in endpoint:
+            return 'api'
+        return 'general'
+
+    def check(self, ip: str, endpoint: str, method: str = 'POST') -> RateLimitDecision:
+        """计入本次请求并判断是否超限（被拒绝的请求同样计数，持续洪泛的客户端保持超限）"""
+        endpoint_type = self.endpoint_type(endpoint, method)
+        threshold = self.thresholds[endpoint_type]
+        window = threshold['window']
+        now = self._clock()
+        key = (ip, endpoint_type)
+        with self._lock:
+            self._stats['checks'] += 1
+            self._evict(now)
+            counter = self._counters.get(key)
+            start = now - now % window
+            if counter is None:
+                if len(self._counters) >= self.max_keys:
+                    self._counters.popitem(last=False)
+                    self._stats['evicted_lru'] += 1
+                counter = self._counters[key] = [start, 0, 0, None]
+            else:
+                self._counters.move_to_end(key)
+                if counter[0] != start:
+                    # 进入新窗口：相邻窗口的计数成为上一窗口，更早的清零
+                    counter[2] = counter[1] if start - counter[0] == window else 0
+                    counter[0], counter[1] = start, 0
+            counter[1] += 1
+            weight = 1.0 - (now - start) / window
+            count = int(counter[2] * weight + counter[1])
+            exceeded = count > threshold['requests']
+            first = exceeded and counter[3] != start
+            if exceeded:
+                self._stats['exceeded'] += 1
+                counter[3] = start
+        attack_type = ('brute_force' if endpoint_type == 'login' else 'dos') if exceeded else ''
+        retry_after = max(1, int(start + window - now + 0.999)) if exceeded else 0
+        return RateLimitDecision(exceeded, attack_type, count, retry_after, first)
+
     def check_rate_limit(self, ip: str, endpoint: str) -> Tuple[bool, str, int]:
         """
         检查频率限制
         返回: (是否超限, 攻击类型, 当前请求数)
         """
-        from .models import RateLimitLog
-        
-        # 确定端点类型
-        endpoint_type = 'general'
-        if 'login' in endpoint.lower():
-            endpoint_type = 'login'
-        elif '/api/' in endpoint:
-            endpoint_type = 'api'
-        
-        threshold_config = self.thresholds[endpoint_type]
-        window_seconds = threshold_config['window']
-        max_requests = threshold_config['requests']
-        
-        with self.app.app_context():
-            # 清理过期记录
-            cutoff_time = datetime.utcnow() - timedelta(seconds=window_seconds)
-            RateLimitLog.query.filter(
-                RateLimitLog.timestamp < cutoff_time
-            ).delete()
-            
-            # 统计当前时间窗口内的请求数
-            recent_count = RateLimitLog.query.filter(
-                RateLimitLog.ip == ip,
-                RateLimitLog.endpoint == endpoint,
-                RateLimitLog.timestamp >= cutoff_time
-            ).count()
-            
-            # 记录本次请求
-            log = RateLimitLog(ip=ip, endpoint=endpoint)
-            self.db.session.add(log)
-            self.db.session.commit()
-            
-            recent_count += 1
-            
-            if recent_count > max_requests:
-                attack_type = 'brute_force' if endpoint_type == 'login' else 'dos'
-                return True, attack_type, recent_count
-            
-            return False, '', recent_count
+        decision = self.check(ip, endpoint)
+        if decision.first_violation:
+            self.record_violation(ip, endpoint, decision)
+        return decision.exceeded, decision.attack_type, decision.count
+
+    def record_violation(self, ip: str, endpoint: str, decision: RateLimitDecision, blocked: bool = True,
+                         method: str = 'POST') -> None:
+        if not self.persist_violations:
+            return
+        if self._log_writer is None:
+            from .attack_log_writer import get_attack_log_writer
+            self._log_writer = get_attack_log_writer(self.app)
+        threshold = self.thresholds[self.endpoint_type(endpoint, method)]
+        self._log_writer.submit(
+            ip=ip,
+            payload=f"rate limit exceeded: more than {threshold['requests']} requests in {threshold['window']}s",
+            attack_type=decision.attack_type,
+            attack_category='behavioral',
+            severity=threshold.get('severity', 'medium'),
+            blocked=blocked,
+            target_url=endpoint[:500],
+        )
+        with self._lock:
+            self._stats['violations_logged'] += 1
+
+    def _evict(self, now: float) -> None:
+        """调用方持有锁：从最久未使用的一端淘汰少量空闲键（均摊 O(1)）"""
+        for _ in range(self.EVICT_PER_CHECK):
+            if not self._counters:
+                return
+            key, counter = next(iter(self._counters.items()))
+            if now - counter[0] < self._idle:
+                return
+            del self._counters[key]
+            self._stats['evicted_idle'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['keys'] = len(self._counters)
+        stats['max_keys'] = self.max_keys
+        stats['thresholds'] = self.thresholds
+        return stats
 
 
 class AttackDetectorManager:
@@ -263,38 +1208,155 @@ class AttackDetectorManager:
             'cmdi': CommandInjectionDetector(),
             'path_traversal': PathTraversalDetector(),
         }
+        config = flask_app.config if flask_app else {}
+        self.canonicalizer = Canonicalizer(
+            max_depth=config.get('DETECTION_URL_DECODE_DEPTH', 3),
+            max_entries=config.get('DETECTION_CANONICAL_MEMO_ENTRIES', 1024),
+            max_memo_chars=config.get('DETECTION_CANONICAL_MEMO_MAX_CHARS', 4096),
+            max_memo_bytes=config.get('DETECTION_CANONICAL_MEMO_MAX_BYTES', 4 * 1024 * 1024),
+        )
+        self._ruleset_options = {
+            'safe_mode': config.get('DETECTION_SAFE_MODE', False),
+            'max_repeat': config.get('DETECTION_SAFE_MAX_REPEAT', 128),
+            'max_scan_chars': config.get('DETECTION_MAX_SCAN_CHARS', 512 * 1024),
+            'canonicalizer': self.canonicalizer,
+        }
+        self.ruleset = CompiledRuleSet(self.detectors, **self._ruleset_options)
+        # 按检测器子集编译的规则集，以及各端点编译后的检测策略
+        self._subsets: Dict[Tuple[str, ...], CompiledRuleSet] = {}
+        self.policies: Dict[str, CompiledPolicy] = {}
+        self.default_policy = self.compile_policy(DetectionPolicy())
+        
+        self.cache = DetectionCache(
+            max_entries=config.get('DETECTION_CACHE_MAX_ENTRIES', 4096),
+            max_bytes=config.get('DETECTION_CACHE_MAX_BYTES', 8 * 1024 * 1024),
+        )
+        
+        # 复用请求级检测结论（见 xss_security.RequestVerdicts）而省去的扫描次数
+        self._reuse_lock = threading.Lock()
+        self._reuse_stats = {'scans_avoided': 0, 'scans_performed': 0}
         
         if flask_app and db_instance:
             self.rate_limiter = RateLimitDetector(flask_app, db_instance)
         else:
             self.rate_limiter = None
     
-    def detect_all(self, content: str) -> Dict:
+    def reload_rules(self) -> None:
+        """检测器规则变更后重新编译规则集，并清空结果缓存"""
+        for detector in self.detectors.values():
+            detector._compiled = None
+        self.ruleset = CompiledRuleSet(self.detectors, **self._ruleset_options)
+        self._subsets.clear()
+        for compiled in [self.default_policy, *self.policies.values()]:
+            compiled.ruleset = self.ruleset_for(compiled.policy.detectors)
+        self.cache.clear()
+    
+    def ruleset_for(self, detectors: Tuple[str, ...]) -> CompiledRuleSet:
+        """返回只包含指定检测器的规则集（相同子集共用一份）"""
+        key = tuple(name for name in self.detectors if name in detectors)
+        if len(key) == len(self.detectors):
+            return self.ruleset
+        if key not in self._subsets:
+            self._subsets[key] = CompiledRuleSet({name: self.detectors[name] for name in key}, **self._ruleset_options)
+        return self._subsets[key]
+    
+    def compile_policy(self, policy: DetectionPolicy, endpoint: str = '') -> CompiledPolicy:
+        unknown = set(policy.detectors) - set(self.detectors)
+        if unknown:
+            raise ValueError(f'端点 {endpoint or "<default>"} 的检测策略引用了未知检测器: {sorted(unknown)}')
+        return CompiledPolicy(endpoint, policy, self.ruleset_for(policy.detectors))
+    
+    def compile_policies(self, url_map, policies: Dict[str, DetectionPolicy],
+                         default: Optional[DetectionPolicy] = None) -> None:
+        """
+        编译端点检测策略并挂到 URL 规则上（rule.detection_policy），
+        请求匹配到路由规则后即可直接取得策略，无需再查表
         """
-        对内容进行全面检测
+        if default is not None:
+            self.default_policy = self.compile_policy(default)
+        self.policies = {endpoint: self.compile_policy(policy, endpoint) for endpoint, policy in policies.items()}
+        for rule in url_map.iter_rules():
+            rule.detection_policy = self.policies.get(rule.endpoint, self.default_policy)
+    
+    def detect_all(self, content: str, ruleset: Optional[CompiledRuleSet] = None) -> Dict:
+        """
+        对内容进行全面检测（相同负载命中缓存时直接返回）
         返回: {
             'detected': bool,
-            'attacks': [{'type': str, 'category': str, 'severity': str, 'description': str}]
+            'attacks': [{'type': str, 'category': str, 'severity': str, 'description': str}],  # 每个检测器最靠前的命中
+            'matches': [{'detector': str, 'type': str, 'category': str, 'severity': str, 'description': str}]  # 全部命中规则
+        }
+        """
+        if not content:
+            return self._detect(content)
+        ruleset = ruleset or self.ruleset
+        key = self.cache.make_key(content, ruleset.version)
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self._detect(content, ruleset)
+            self.cache.put(key, cached, DetectionCache.estimate_size(cached))
+        return {
+            'detected': cached['detected'],
+            'attacks': list(cached['attacks']),
+            'matches': list(cached['matches']),
         }
+    
+    def detect_or_reuse(self, content: str, verdict: Optional[Dict],
+                        ruleset: Optional[CompiledRuleSet] = None) -> Dict:
+        """
+        已有同一内容的检测结论（由中间件写入请求 environ）时直接复用，否则执行 detect_all
         """
+        with self._reuse_lock:
+            self._reuse_stats['scans_avoided' if verdict is not None else 'scans_performed'] += 1
+        if verdict is None:
+            return self.detect_all(content, ruleset)
+        return {
+            'detected': verdict['detected'],
+            'attacks': list(verdict['attacks']),
+            'matches': list(verdict['matches']),
+        }
+    
+    def _detect(self, content: str, ruleset: Optional[CompiledRuleSet] = None) -> Dict:
+        matches = (ruleset or self.ruleset).scan(content)
         result = {
-            'detected': False,
-            'attacks': []
+            'detected': bool(matches),
+            'attacks': [],
+            'matches': [rule.to_dict() for rule in matches]
         }
         
-        for detector_name, detector in self.detectors.items():
-            is_attack, description = detector.detect(content)
-            if is_attack:
-                result['detected'] = True
-                result['attacks'].append({
-                    'type': detector.attack_type,
-                    'category': detector.attack_category,
-                    'severity': detector.severity,
-                    'description': description or f'{detector_name} 攻击'
-                })
+        seen = set()
+        for rule in matches:
+            if rule.detector in seen:
+                continue
+            seen.add(rule.detector)
+            result['attacks'].append({
+                'type': rule.attack_type,
+                'category': rule.category,
+                'severity': rule.severity,
+                'description': rule.description or f'{rule.detector} 攻击'
+            })
         
         return result
     
+    def get_stats(self) -> Dict:
+        """检测引擎各阶段计数"""
+        return {
+            'ruleset_version': self.ruleset.version,
+            'ruleset': self.ruleset.get_stats(),
+            'canonicalizer': self.canonicalizer.get_stats(),
+            'cache': self.cache.get_stats(),
+            'verdict_reuse': self._reuse_stats_snapshot(),
+            'rate_limiter': self.rate_limiter.get_stats() if self.rate_limiter else None,
+            'policies': {
+                endpoint: {'detectors': list(c.policy.detectors), 'mode': c.policy.mode, 'ruleset_scans': c.ruleset.get_stats()['scans']}
+                for endpoint, c in self.policies.items()
+            },
+        }
+    
+    def _reuse_stats_snapshot(self) -> Dict:
+        with self._reuse_lock:
+            return dict(self._reuse_stats)
+    
     def get_attack_categories(self) -> Dict:
         """获取攻击分类信息"""
         return {
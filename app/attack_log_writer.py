@@ -0,0 +1,331 @@
+"""
+攻击日志异步批量写入
+请求线程只把日志行放进有界队列，由后台线程按 ATTACK_LOG_BATCH_SIZE 行或 ATTACK_LOG_FLUSH_MS 毫秒
+（先到者为准）批量插入，拦截请求不再等待 SQLite 提交。
+
+队列满时的处理策略（ATTACK_LOG_OVERFLOW）：
+- drop：直接丢弃并计数；
+- aggregate：按 (ip, 攻击类型, 目标 URL, 载荷, 是否拦截) 合并，相同事件只保留一行；
+- block：最多等待 ATTACK_LOG_BLOCK_TIMEOUT_MS 毫秒，仍无空间则丢弃。
+进程退出时（atexit）把队列中剩余的日志写完。
+数据库被其他事务锁定（如 rollup 重算持有写锁）时，同一批按退避重试最多 ATTACK_LOG_LOCK_RETRY_S 秒，
+期间新日志继续进入队列，不因锁等待超时丢弃整批。
+
+洪泛聚合（ATTACK_LOG_AGGREGATE_WINDOW_S > 0）：写入时把相同 (ip, 攻击类型, 载荷摘要, 目标 URL, 是否拦截) 的事件
+合并为一行，count 记录事件数，first_seen / last_seen 记录时间范围。窗口内第一次出现时插入新行，
+之后的批次只对该行执行 count = count + n 的 UPDATE，窗口结束后再出现则另起一行。
+同一事务内还会累加统计预聚合表（见 attack_rollups）。
+统计接口按 count 求和（AttackLog.events()），因此合并不会丢失事件数。
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy.exc import OperationalError
+
+from . import db
+from .models import AttackLog, payload_hash
+from .attack_rollups import apply_deltas, deltas_for_rows
+from .conditional import bump_log_version
+from .event_bus import get_event_bus
+
+logger = logging.getLogger(__name__)
+
+_BLOCKED_DEFAULT = AttackLog.column_default('blocked')
+
+OVERFLOW_POLICIES = ('drop', 'aggregate', 'block')
+
+
+class AttackLogWriter:
+
+    def __init__(self, flask_app, batch_size: int = 200, flush_ms: int = 250, max_queue: int = 10000,
+                 overflow: str = 'aggregate', block_timeout_ms: int = 50, async_mode: bool = True,
+                 aggregate_window_s: int = 60, event_bus=None, lock_retry_s: float = 300):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'未知的溢出策略: {overflow}')
+        self.flask_app = flask_app
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(1, int(flush_ms)) / 1000.0
+        self.max_queue = max(1, int(max_queue))
+        self.overflow = overflow
+        self.block_timeout = max(0, int(block_timeout_ms)) / 1000.0
+        self.async_mode = bool(async_mode)
+        self.aggregate_window = timedelta(seconds=max(0, int(aggregate_window_s)))
+        self.lock_retry = max(0.0, float(lock_retry_s))
+        # 实时事件推送（/api/events/stream），日志被队列接收时发布（不等待落库），被丢弃的日志不发布
+        self.event_bus = event_bus
+
+        self._queue: deque = deque()
+        # 溢出时合并的事件：键 -> 日志行（count 累加）
+        self._aggregated: Dict[tuple, dict] = {}
+        # 已写入数据库、聚合窗口尚未结束的行：聚合键 -> (行 id, 窗口结束时间)；由 _write_lock 保护
+        self._open_windows: Dict[tuple, tuple] = {}
+        # 同步模式与关闭后的直接写入在请求线程上执行，与后台线程一起串行化，同一时刻只有一个写入者
+        self._write_lock = threading.Lock()
+        self._inflight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self._cond = threading.Condition()
+        self._stats = {
+            'enqueued': 0,     # 进入队列的日志
+            'written': 0,      # 已写入数据库的行
+            'flushes': 0,      # 批量写入次数
+            'dropped': 0,      # 因队列已满被丢弃
+            'aggregated': 0,   # 因队列已满被合并到已有行
+            'block_waits': 0,  # block 策略下等待过的提交
+            'errors': 0,       # 写入失败的批次
+            'lock_retries': 0,  # 数据库被锁定后重试的次数
+            'rows_inserted': 0,  # 实际插入的行
+            'rows_updated': 0,   # 合并到已有行的 UPDATE 次数
+            'last_flush_ms': 0.0,
+        }
+
+    def submit(self, **row) -> bool:
+        """提交一条日志（字段同 AttackLog），返回是否被接收"""
+        row.setdefault('timestamp', datetime.utcnow())
+        if self.async_mode:
+            with self._cond:
+                if not self._closed:
+                    self._ensure_thread()
+                    accepted = self._enqueue(row)
+                    # 持锁发布：写入线程取走该行（并可能合并计数）之前取快照
+                    if accepted:
+                        self._publish(row)
+                    return accepted
+        # 同步模式，或已关闭（进程退出阶段）时直接写入
+        written = self._write([row])
+        if written:
+            self._publish(row)
+        return written
+
+    def _publish(self, row) -> None:
+        if self.event_bus is not None:
+            self.event_bus.publish(row)
+
+    def _enqueue(self, row) -> bool:
+        """调用方持有锁"""
+        if len(self._queue) >= self.max_queue:
+            if self.overflow == 'aggregate':
+                return self._aggregate(row)
+            if self.overflow == 'drop' or not self._wait_for_room():
+                self._stats['dropped'] += 1
+                return False
+        self._queue.append(row)
+        self._stats['enqueued'] += 1
+        if len(self._queue) >= self.batch_size:
+            self._cond.notify_all()
+        return True
+
+    def _aggregate(self, row) -> bool:
+        key = (row.get('ip'), row.get('attack_type'), row.get('target_url'), row.get('payload'), row.get('blocked'))
+        pending = self._aggregated.get(key)
+        if pending is not None:
+            pending['count'] = pending.get('count', 1) + row.get('count', 1)
+            pending['last_seen'] = row['timestamp']
+            self._stats['aggregated'] += 1
+            return True
+        if len(self._aggregated) >= self.max_queue:
+            self._stats['dropped'] += 1
+            return False
+        self._aggregated[key] = row
+        self._stats['enqueued'] += 1
+        return True
+
+    def _wait_for_room(self) -> bool:
+        self._stats['block_waits'] += 1
+        self._cond.notify_all()
+        return self._cond.wait_for(lambda: len(self._queue) < self.max_queue, timeout=self.block_timeout)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='attack-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._queue) >= self.batch_size or self._flush_requested or self._closed,
+                    timeout=self.flush_interval,
+                )
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                if len(batch) < self.batch_size and self._aggregated:
+                    batch.extend(self._aggregated.values())
+                    self._aggregated.clear()
+                if not self._queue and not self._aggregated:
+                    self._flush_requested = False
+                self._inflight = len(batch)
+                done = self._closed and not batch
+                self._cond.notify_all()
+            if done:
+                return
+            if batch:
+                self._write(batch)
+            with self._cond:
+                self._inflight = 0
+                self._cond.notify_all()
+
+    def _write(self, rows: List[Dict]) -> bool:
+        with self._write_lock:
+            return self._write_batch(rows)
+
+    def _write_batch(self, rows: List[Dict]) -> bool:
+        """调用方持有 _write_lock"""
+        start = time.perf_counter()
+        events = sum(row.get('count', 1) for row in rows)
+        # 统计增量按合并前的事件计算，每个事件计入各自的时间桶
+        deltas = deltas_for_rows(rows)
+        rows = self._coalesce(rows)
+        deadline = time.monotonic() + self.lock_retry
+        backoff = 0.05
+        while True:
+            with self.flask_app.app_context():
+                try:
+                    apply_deltas(db.session.connection(), deltas)
+                    bump_log_version()
+                    if self.aggregate_window:
+                        inserted, updated = self._merge(rows)
+                    else:
+                        db.session.bulk_insert_mappings(AttackLog, rows)
+                        inserted, updated = len(rows), 0
+                    db.session.commit()
+                    break
+                except Exception as exc:
+                    db.session.rollback()
+                    self._open_windows.clear()
+                    if _is_locked(exc) and time.monotonic() < deadline:
+                        for row in rows:
+                            row.pop('id', None)  # return_defaults 回填的 id 随回滚失效
+                        with self._cond:
+                            self._stats['lock_retries'] += 1
+                    else:
+                        logger.exception('攻击日志批量写入失败（%d 行）', len(rows))
+                        with self._cond:
+                            self._stats['errors'] += 1
+                        return False
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 1.0)
+        with self._cond:
+            self._stats['written'] += events
+            self._stats['rows_inserted'] += inserted
+            self._stats['rows_updated'] += updated
+            self._stats['flushes'] += 1
+            self._stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        return True
+
+    def _coalesce(self, rows: List[Dict]) -> List[Dict]:
+        """补全聚合列；开启聚合窗口时把本批中相同聚合键的行合并为一行"""
+        merged: Dict[tuple, Dict] = {}
+        out = []
+        for row in rows:
+            row.setdefault('count', 1)
+            row.setdefault('first_seen', row['timestamp'])
+            row.setdefault('last_seen', row['timestamp'])
+            row.setdefault('payload_hash', payload_hash(row.get('payload')))
+            row.setdefault('blocked', _BLOCKED_DEFAULT)
+            if not self.aggregate_window:
+                out.append(row)
+                continue
+            key = _aggregate_key(row)
+            head = merged.get(key)
+            if head is None:
+                merged[key] = row
+                out.append(row)
+                continue
+            head['count'] += row['count']
+            head['first_seen'] = min(head['first_seen'], row['first_seen'])
+            head['last_seen'] = max(head['last_seen'], row['last_seen'])
+        return out
+
+    def _merge(self, rows: List[Dict]):
+        """窗口内已有行的事件累加到该行，其余插入新行并登记窗口；调用方负责提交"""
+        inserts = []
+        updated = 0
+        for row in rows:
+            key = _aggregate_key(row)
+            window = self._open_windows.get(key)
+            if window is not None and row['first_seen'] < window[1]:
+                matched = AttackLog.query.filter_by(id=window[0]).update({
+                    AttackLog.count: AttackLog.count + row['count'],
+                    AttackLog.last_seen: row['last_seen'],
+                }, synchronize_session=False)
+                if matched:
+                    updated += 1
+                    continue
+            inserts.append(row)
+        if inserts:
+            # return_defaults 取回新行 id，后续批次据此累加
+            db.session.bulk_insert_mappings(AttackLog, inserts, return_defaults=True)
+            now = datetime.utcnow()
+            if len(self._open_windows) >= self.max_queue:
+                self._open_windows = {k: v for k, v in self._open_windows.items() if v[1] > now}
+            for row in inserts:
+                self._open_windows[_aggregate_key(row)] = (row['id'], row['first_seen'] + self.aggregate_window)
+        return len(inserts), updated
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待队列中已提交的日志全部写入，返回是否在超时前完成"""
+        with self._cond:
+            if self._thread is None:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._aggregated and not self._inflight, timeout=timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """停止后台线程并写完剩余日志（进程退出时调用）"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._queue) + len(self._aggregated) + self._inflight
+        stats['overflow_policy'] = self.overflow
+        stats['max_queue'] = self.max_queue
+        return stats
+
+
+def get_attack_log_writer(flask_app) -> AttackLogWriter:
+    """每个应用一个写入器，保存在 app.extensions['attack_log_writer']"""
+    writer = flask_app.extensions.get('attack_log_writer')
+    if writer is None:
+        config = flask_app.config
+        writer = AttackLogWriter(
+            flask_app,
+            batch_size=config.get('ATTACK_LOG_BATCH_SIZE', 200),
+            flush_ms=config.get('ATTACK_LOG_FLUSH_MS', 250),
+            max_queue=config.get('ATTACK_LOG_QUEUE_MAX', 10000),
+            overflow=config.get('ATTACK_LOG_OVERFLOW', 'aggregate'),
+            block_timeout_ms=config.get('ATTACK_LOG_BLOCK_TIMEOUT_MS', 50),
+            async_mode=config.get('ATTACK_LOG_ASYNC', True),
+            aggregate_window_s=config.get('ATTACK_LOG_AGGREGATE_WINDOW_S', 60),
+            event_bus=get_event_bus(flask_app),
+            lock_retry_s=config.get('ATTACK_LOG_LOCK_RETRY_S', 300),
+        )
+        flask_app.extensions['attack_log_writer'] = writer
+        atexit.register(writer.close)
+    return writer
+
+
+def _is_locked(exc: Exception) -> bool:
+    """SQLite 锁等待超时（database is locked / busy）"""
+    return isinstance(exc, OperationalError) and any(
+        m in str(exc.orig).lower() for m in ('locked', 'busy'))
+
+
+def _aggregate_key(row) -> tuple:
+    # 拦截与放行的事件分别成行，合并后 blocked 列仍准确
+    return (row.get('ip'), row.get('attack_type'), row['payload_hash'], row.get('target_url'), bool(row['blocked']))
@@ -0,0 +1,148 @@
+"""
+攻击统计预聚合（rollup）
+/api/stats/* 等统计接口不再对整张 AttackLog 做 GROUP BY / COUNT，而是读取 AttackRollup：
+每个 (粒度, 时间桶, 攻击类型, 严重级别, 是否拦截, IP) 一行，count 为事件数。
+统计接口只读取天粒度，因此只维护 'day' 一种粒度；旧版本写入的分钟/小时行在重算时清除。
+
+维护方式（与日志写入处于同一事务，提交或回滚一致）：
+- 批量写入器（attack_log_writer）写入一批日志时用 deltas_for_rows() / apply_deltas() 计入；
+- 直接通过 ORM 添加的 AttackLog 由 before_flush 钩子计入。
+两条路径都是 INSERT ... ON CONFLICT DO UPDATE SET count = count + n，每批只涉及变化的桶。
+
+日志被删除（保留期清理）时不回减，rollup 保留历史统计；需要按现有日志重算时运行
+rebuild_attack_rollups.py（调用 rebuild()）。重算在一个事务中完成并先取得写锁：
+读取方在提交前看到的仍是旧统计，写入器的增量在重算提交后才能写入（见 attack_log_writer 的锁重试），
+不会出现统计缺一半或重复计数。
+"""
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import AttackLog, AttackRollup
+
+GRANULARITIES = ('day',)
+
+_ZERO = {
+    'day': dict(hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    return ts.replace(**_ZERO[granularity])
+
+
+_DEFAULTS = {name: AttackLog.column_default(name) for name in ('attack_type', 'severity', 'blocked')}
+
+
+def _dimensions(ip, attack_type, severity, blocked) -> Tuple:
+    # 与 AttackLog 列默认值保持一致，未给出的维度按默认值计
+    return (
+        attack_type if attack_type is not None else _DEFAULTS['attack_type'],
+        severity if severity is not None else _DEFAULTS['severity'],
+        bool(blocked if blocked is not None else _DEFAULTS['blocked']),
+        ip or '',
+    )
+
+
+def deltas_for(events: Iterable[Tuple]) -> Counter:
+    """events 为 (timestamp, ip, attack_type, severity, blocked, count)，返回 桶键 -> 增量"""
+    deltas: Counter = Counter()
+    for ts, ip, attack_type, severity, blocked, count in events:
+        dims = _dimensions(ip, attack_type, severity, blocked)
+        for granularity in GRANULARITIES:
+            deltas[(granularity, bucket_start(ts, granularity)) + dims] += count or 1
+    return deltas
+
+
+def apply_deltas(connection, deltas: Dict) -> int:
+    """把增量累加到 AttackRollup；调用方负责提交"""
+    if not deltas:
+        return 0
+    insert = _dialect_insert(connection.dialect.name)
+    rows = [
+        dict(granularity=g, bucket=b, attack_type=t, severity=s, blocked=bl, ip=ip, count=n)
+        for (g, b, t, s, bl, ip), n in deltas.items()
+    ]
+    stmt = insert(AttackRollup.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['granularity', 'bucket', 'attack_type', 'severity', 'blocked', 'ip'],
+        set_={'count': AttackRollup.__table__.c.count + stmt.excluded['count']},
+    )
+    connection.execute(stmt, rows)
+    return len(rows)
+
+
+def _dialect_insert(name):
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def deltas_for_rows(rows: Iterable[Dict]) -> Counter:
+    """批量写入器路径：rows 为 AttackLog 字段字典（每行带 timestamp，count 缺省为 1）"""
+    return deltas_for(
+        (r['timestamp'], r.get('ip'), r.get('attack_type'), r.get('severity'), r.get('blocked'), r.get('count', 1))
+        for r in rows
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_new_logs(session, flush_context, instances):
+    logs = [obj for obj in session.new if isinstance(obj, AttackLog)]
+    if not logs:
+        return
+    now = datetime.utcnow()
+    for log in logs:
+        if log.timestamp is None:
+            log.timestamp = now  # 与 rollup 的时间桶保持一致
+    deltas = deltas_for((l.timestamp, l.ip, l.attack_type, l.severity, l.blocked, l.count) for l in logs)
+    apply_deltas(session.connection(), deltas)
+
+
+def rebuild(since: Optional[datetime] = None, batch_size: int = 5000) -> Dict:
+    """
+    按现有 AttackLog 重算 rollup（可只重算 since 之后的桶），按 id 分批读取（限制内存），整体一次提交
+    合并行（count > 1）整体计入 timestamp（即 first_seen）所在的桶
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # 阻止写入但允许读取，直到提交
+        db.session.execute(text(
+            f'LOCK TABLE {AttackLog.__table__.name}, {AttackRollup.__table__.name} IN SHARE ROW EXCLUSIVE MODE'))
+    delete = AttackRollup.query
+    query = db.session.query(
+        AttackLog.id, AttackLog.timestamp, AttackLog.ip, AttackLog.attack_type,
+        AttackLog.severity, AttackLog.blocked, AttackLog.count,
+    ).filter(AttackLog.timestamp.isnot(None))
+    if since is not None:
+        # 从 since 所在的天桶开始，保证重算的桶完整
+        since = bucket_start(since, 'day')
+        delete = delete.filter(AttackRollup.bucket >= since)
+        query = query.filter(AttackLog.timestamp >= since)
+    # SQLite 中第一条写语句即取得写锁，此后写入器等待本事务提交
+    deleted = delete.delete(synchronize_session=False)
+    # 不再维护的粒度（旧版本的分钟/小时桶）没有读取方，整体清除
+    deleted += AttackRollup.query.filter(AttackRollup.granularity.notin_(GRANULARITIES)).delete(
+        synchronize_session=False)
+
+    last_id = 0
+    scanned = upserts = 0
+    while True:
+        rows = query.filter(AttackLog.id > last_id).order_by(AttackLog.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        upserts += apply_deltas(db.session.connection(), deltas_for(tuple(r[1:]) for r in rows))
+    # 统计结果已变化，使条件 GET 的 ETag 失效
+    from .conditional import bump_log_version
+    bump_log_version()
+    db.session.commit()
+    return {'deleted': deleted, 'logs_scanned': scanned, 'bucket_upserts': upserts}
@@ -4,11 +4,13 @@ from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, List, Dict
 
-from flask import request, session
+from flask import current_app, request, session
 from flask_login import current_user, logout_user
 
 from . import db
-from .models import AttackLog, Setting, AuthLoginAttempt
+from .models import AttackLog, AuthLoginAttempt
+from .settings_service import get_settings
+from .attack_log_writer import get_attack_log_writer
 from sqlalchemy import func
 
 
@@ -33,20 +35,12 @@ def _get_user_agent(req) -> str:
 
 
 def _setting_bool(key: str, default: bool = True) -> bool:
-    s = Setting.query.filter_by(key=key).first()
-    if not s or s.value is None:
-        return default
-    return str(s.value).strip() in ('1', 'true', 'True', 'yes', 'on')
+    # 从设置快照读取，不访问数据库
+    return get_settings(current_app._get_current_object()).get_bool(key, default)
 
 
 def _set_setting_bool(key: str, enabled: bool) -> None:
-    s = Setting.query.filter_by(key=key).first()
-    if not s:
-        s = Setting(key=key, value='1' if enabled else '0')
-        db.session.add(s)
-    else:
-        s.value = '1' if enabled else '0'
-    db.session.commit()
+    get_settings(current_app._get_current_object()).set_bool(key, enabled)
 
 
 def is_auth_security_enabled() -> bool:
@@ -104,7 +98,7 @@ def record_login_attempt(ip: str, username: str, success: bool) -> None:
 
 
 def _log_auth_attack(ip: str, attack_type: str, severity: str, message: str, blocked: bool = True) -> None:
-    log = AttackLog(
+    get_attack_log_writer(current_app._get_current_object()).submit(
         ip=ip,
         payload=(message or '')[:500],
         blocked=blocked,
@@ -114,8 +108,6 @@ def _log_auth_attack(ip: str, attack_type: str, severity: str, message: str, blo
         target_url=(request.path or '')[:500],
         user_agent=_get_user_agent(request),
     )
-    db.session.add(log)
-    db.session.commit()
 
 
 def check_bruteforce_allowed(ip: str, username: str) -> Tuple[bool, Optional[str], int]:
@@ -333,5 +325,6 @@ def get_recent_events(limit: int = 50) -> List[Dict]:
             'target_url': r.target_url,
             'user_agent': r.user_agent,
             'payload': r.payload,
+            'count': int(r.count or 1),
         })
     return out
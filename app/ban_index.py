@@ -0,0 +1,225 @@
+"""
+内存封禁索引
+中间件每个请求都要判断来源 IP 是否被封禁，这里把 BannedIP 表加载到内存字典中，
+查询为 O(1) 且过期时间在内存中判断，不再每个请求都访问数据库。
+
+一致性：
+- /ban_ip、/unban_ip 写库时递增 Setting 中的版本号（bump_version），提交后调用 invalidate()，
+  本进程立即重新加载；
+- 其他进程（多 worker）每隔 BAN_INDEX_POLL_MS 毫秒检查一次版本号与行数/最大 id，变化时重新加载；
+- 已过期的临时封禁在内存中直接判定为未封禁，对应的行在下一次轮询时批量删除。
+
+网段封禁：BannedIP.ip 既可以是单个地址也可以是 CIDR 网段（如 10.0.0.0/16、2001:db8::/32），
+地址区间（a-b）在写入时拆成最少数量的 CIDR 行。单个地址走字典精确匹配，
+网段编入按位前缀树（IPv4 / IPv6 各一棵），查询沿地址位向下走，代价为 O(前缀长度)。
+"""
+from __future__ import annotations
+
+import ipaddress
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from . import db
+from .models import BannedIP, Setting
+from .settings_service import bump_version
+
+BAN_VERSION_KEY = 'ban_index_version'
+
+
+def parse_ban_target(value: str) -> List[str]:
+    """
+    把封禁目标规范化为要写入 BannedIP.ip 的字符串列表
+    支持单个地址、CIDR 网段（主机位非零时按所在网段处理）和 "起始地址-结束地址" 区间，格式错误抛出 ValueError
+    """
+    value = (value or '').strip()
+    if '-' in value:
+        first, last = (ipaddress.ip_address(part.strip()) for part in value.split('-', 1))
+        if first.version != last.version or first > last:
+            raise ValueError(f'invalid range: {value}')
+        return [_network_key(n) for n in ipaddress.summarize_address_range(first, last)]
+    if '/' in value:
+        return [_network_key(ipaddress.ip_network(value, strict=False))]
+    return [str(ipaddress.ip_address(value))]
+
+
+def _network_key(network) -> str:
+    # 单地址网段（/32、/128）按普通地址存储
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+class PrefixTrie:
+    """按位前缀树：节点为 [0 分支, 1 分支, 封禁条目]"""
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = [None, None, None]
+        self.size = 0
+
+    def insert(self, network, entry) -> None:
+        node = self.root
+        value = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (value >> (self.bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        node[2] = entry
+        self.size += 1
+
+    def matches(self, value: int):
+        """依次产出覆盖该地址（整数形式）的各网段的封禁条目（由短前缀到长前缀）"""
+        node = self.root
+        shift = self.bits - 1
+        while node is not None:
+            if node[2] is not None:
+                yield node[2]
+            if shift < 0:
+                return
+            node = node[(value >> shift) & 1]
+            shift -= 1
+
+
+class BanIndex:
+
+    def __init__(self, flask_app, poll_ms: int = 2000):
+        self.flask_app = flask_app
+        self.poll_interval = max(0, int(poll_ms)) / 1000.0
+        # ip -> (permanent, expires_at)；网段在前缀树中；重新加载时整体替换，读取无需加锁
+        self._entries: Dict[str, Tuple[bool, Optional[datetime]]] = {}
+        self._tries: Dict[int, PrefixTrie] = {}
+        self._signature = None
+        self._next_poll = 0.0
+        self._dirty = True
+        self._expired_seen = False
+        self._lock = threading.Lock()
+        # 查询路径上的计数不加锁，仅作参考
+        self._stats = {'lookups': 0, 'banned': 0, 'polls': 0, 'reloads': 0, 'purged': 0}
+
+    def is_banned(self, ip: str) -> bool:
+        if self._dirty or time.monotonic() >= self._next_poll:
+            # 本进程刚写过封禁表时等待重新加载完成，否则由一个线程刷新、其余线程沿用旧索引
+            self.refresh(wait=self._dirty)
+        self._stats['lookups'] += 1
+        entry = self._entries.get(ip)
+        if entry is not None and self._active(entry):
+            self._stats['banned'] += 1
+            return True
+        tries = self._tries
+        if not tries:
+            return False
+        # inet_pton 比 ipaddress.ip_address 快一个数量级
+        try:
+            version, packed = 4, socket.inet_pton(socket.AF_INET, ip)
+        except OSError:
+            try:
+                version, packed = 6, socket.inet_pton(socket.AF_INET6, ip)
+            except OSError:
+                return False
+        trie = tries.get(version)
+        if trie is None:
+            return False
+        for entry in trie.matches(int.from_bytes(packed, 'big')):
+            if self._active(entry):
+                self._stats['banned'] += 1
+                return True
+        return False
+
+    def _active(self, entry) -> bool:
+        permanent, expires_at = entry
+        if permanent:
+            return True
+        if expires_at and expires_at > datetime.utcnow():
+            return True
+        if expires_at:
+            self._expired_seen = True
+        return False
+
+    def refresh(self, wait: bool = False) -> None:
+        """检查版本号，变化（或本进程已标记失效）时重新加载"""
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            if not self._dirty and time.monotonic() < self._next_poll:
+                return  # 等锁期间已由其他线程刷新
+            dirty, self._dirty = self._dirty, False
+            self._next_poll = time.monotonic() + self.poll_interval
+            with self.flask_app.app_context():
+                self._stats['polls'] += 1
+                if self._expired_seen:
+                    self._purge_expired()
+                signature = self._read_signature()
+                if dirty or signature != self._signature:
+                    self._reload()
+                    self._signature = signature
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        """本进程写入封禁表后调用：下一次查询前立即重新加载"""
+        self._dirty = True
+
+    @staticmethod
+    def bump_version() -> None:
+        """在当前会话中递增版本号，随调用方的事务一起提交，其他进程据此感知变化"""
+        bump_version(BAN_VERSION_KEY)
+
+    def _read_signature(self):
+        s = Setting.query.filter_by(key=BAN_VERSION_KEY).first()
+        count, max_id = db.session.query(func.count(BannedIP.id), func.max(BannedIP.id)).one()
+        return (s.value if s else None, count, max_id)
+
+    def _reload(self) -> None:
+        rows = db.session.query(BannedIP.ip, BannedIP.permanent, BannedIP.expires_at).all()
+        entries = {}
+        tries = {}
+        for ip, permanent, expires_at in rows:
+            entry = (bool(permanent), expires_at)
+            if '/' not in ip:
+                entries[ip] = entry
+                continue
+            try:
+                network = ipaddress.ip_network(ip, strict=False)
+            except ValueError:
+                continue
+            if network.version not in tries:
+                tries[network.version] = PrefixTrie(network.max_prefixlen)
+            tries[network.version].insert(network, entry)
+        self._entries, self._tries = entries, tries
+        self._stats['reloads'] += 1
+
+    def _purge_expired(self) -> None:
+        self._expired_seen = False
+        try:
+            deleted = BannedIP.query.filter(
+                BannedIP.permanent.is_(False),
+                BannedIP.expires_at.isnot(None),
+                BannedIP.expires_at <= datetime.utcnow(),
+            ).delete(synchronize_session=False)
+            if deleted:
+                self.bump_version()
+            db.session.commit()
+            self._stats['purged'] += deleted
+        except Exception:
+            db.session.rollback()
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['entries'] = len(self._entries)
+        stats['networks'] = sum(t.size for t in self._tries.values())
+        return stats
+
+
+def get_ban_index(flask_app) -> BanIndex:
+    """每个应用一个封禁索引，保存在 app.extensions['ban_index']"""
+    index = flask_app.extensions.get('ban_index')
+    if index is None:
+        index = BanIndex(flask_app, poll_ms=flask_app.config.get('BAN_INDEX_POLL_MS', 2000))
+        flask_app.extensions['ban_index'] = index
+    return index
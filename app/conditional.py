@@ -0,0 +1,96 @@
+"""
+条件 GET（ETag / If-None-Match）
+仪表盘定时轮询的 JSON 接口大多返回与上次相同的内容。这里用数据版本号而不是响应内容计算 ETag：
+- logs：攻击日志版本（attack_log_version），每次写入日志（批量写入器的一批、ORM 插入）时递增；
+- bans：封禁表版本（ban_index_version，见 ban_index）；
+- settings：设置版本（settings_version，见 settings_service）。
+这些版本号都保存在 Setting 表中，一次按主键取值的查询即可得到，
+If-None-Match 命中时直接返回 304，不执行统计查询也不序列化 JSON。
+"""
+from __future__ import annotations
+
+import hashlib
+from functools import wraps
+from typing import Callable, Dict, Optional, Sequence
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .models import AttackLog, Setting
+from .settings_service import SETTINGS_VERSION_KEY, bump_version
+
+LOG_VERSION_KEY = 'attack_log_version'
+
+VERSION_KEYS: Dict[str, str] = {
+    'logs': LOG_VERSION_KEY,
+    'bans': 'ban_index_version',
+    'settings': SETTINGS_VERSION_KEY,
+}
+
+_stats = {'checks': 0, 'not_modified': 0}
+
+
+def bump_log_version() -> None:
+    """在当前会话中递增攻击日志版本号，随调用方的事务一起提交"""
+    bump_version(LOG_VERSION_KEY)
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_on_new_logs(session, flush_context, instances):
+    if any(isinstance(obj, AttackLog) for obj in session.new):
+        bump_log_version()
+
+
+def data_versions(sources: Sequence[str]) -> Dict[str, Optional[str]]:
+    keys = [VERSION_KEYS[s] for s in sources]
+    rows = Setting.query.with_entities(Setting.key, Setting.value).filter(Setting.key.in_(keys)).all()
+    values = dict(rows)
+    return {s: values.get(VERSION_KEYS[s]) for s in sources}
+
+
+def compute_etag(sources: Sequence[str], extra: Optional[Callable[[], str]] = None) -> str:
+    parts = [f'{s}={v}' for s, v in data_versions(sources).items()]
+    if extra is not None:
+        parts.append(extra())
+    # 视图缓存结果时以同一版本为键（见 current_data_version）
+    g.data_version = '|'.join(parts)
+    return hashlib.sha1('|'.join([request.full_path] + parts).encode('utf-8')).hexdigest()[:20]
+
+
+def current_data_version() -> Optional[str]:
+    """本次请求 ETag 所依据的数据版本；不在 conditional 视图中时为 None"""
+    return g.get('data_version')
+
+
+def conditional(*sources: str, extra: Optional[Callable[[], str]] = None):
+    """
+    视图装饰器：按 sources 对应的数据版本生成 ETag，If-None-Match 命中时返回 304
+    extra 用于版本号之外还依赖时间等因素的接口（如按天滚动的趋势图）
+    """
+    unknown = set(sources) - set(VERSION_KEYS)
+    if unknown:
+        raise ValueError(f'未知的数据版本: {sorted(unknown)}')
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(sources, extra)
+            _stats['checks'] += 1
+            if request.if_none_match.contains(etag):
+                _stats['not_modified'] += 1
+                rv = Response(status=304)
+                rv.set_etag(etag)
+                return rv
+            rv = view(*args, **kwargs)
+            if isinstance(rv, Response) and rv.status_code == 200:
+                rv.set_etag(etag)
+                # 允许缓存但每次都需重新验证
+                rv.headers['Cache-Control'] = 'no-cache'
+            return rv
+        return wrapper
+    return decorator
+
+
+def get_stats() -> Dict:
+    return dict(_stats)
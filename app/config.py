@@ -3,4 +3,76 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///xss_defense.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     XSS_DEFENSE_ENABLED = True
+    # 检测结果缓存上限（条目数 / 估算字节数）
+    DETECTION_CACHE_MAX_ENTRIES = 4096
+    DETECTION_CACHE_MAX_BYTES = 8 * 1024 * 1024
+    # 安全模式：改写会灾难性回溯的量词（相邻且字符集相交的重复最多 DETECTION_SAFE_MAX_REPEAT 次），
+    # 其余量词保持无界，匹配时间与输入长度线性相关
+    DETECTION_SAFE_MODE = True
+    DETECTION_SAFE_MAX_REPEAT = 128
+    DETECTION_MAX_SCAN_CHARS = 512 * 1024
+    # 负载规范化：URL/HTML 实体迭代解码的最大轮数，规范形式记忆表条目数、可记忆的最长输入、总字节上限
+    DETECTION_URL_DECODE_DEPTH = 3
+    DETECTION_CANONICAL_MEMO_ENTRIES = 1024
+    DETECTION_CANONICAL_MEMO_MAX_CHARS = 4096
+    DETECTION_CANONICAL_MEMO_MAX_BYTES = 4 * 1024 * 1024
+    # 中间件流式检测请求体：分块大小、块间重叠字符数、最大扫描字节数、超过后落盘的缓冲大小
+    BODY_INSPECT_CHUNK_SIZE = 64 * 1024
+    BODY_INSPECT_OVERLAP = 4096
+    BODY_INSPECT_MAX_BYTES = 1024 * 1024
+    BODY_INSPECT_SPOOL_BYTES = 256 * 1024
+    # 中间件逐字段检测：额外检测的请求头（命中只记录不拦截）、单字段最大检测字符数、每个请求最多检测的字段数
+    INSPECT_HEADERS = ['User-Agent', 'Referer']
+    INSPECT_FIELD_MAX_CHARS = 8192
+    INSPECT_MAX_FIELDS = 64
+    # 内存封禁索引检查版本号的间隔（毫秒）；本进程的封禁/解封会立即生效
+    BAN_INDEX_POLL_MS = 2000
+    # 设置快照检查 settings_version 的间隔（毫秒）；本进程的写入会立即生效
+    SETTINGS_POLL_MS = 1000
+    # 攻击日志异步批量写入：每批行数、最长间隔（毫秒）、队列上限、溢出策略（drop / aggregate / block）
+    ATTACK_LOG_ASYNC = True
+    ATTACK_LOG_BATCH_SIZE = 200
+    ATTACK_LOG_FLUSH_MS = 250
+    ATTACK_LOG_QUEUE_MAX = 10000
+    ATTACK_LOG_OVERFLOW = 'aggregate'
+    ATTACK_LOG_BLOCK_TIMEOUT_MS = 50
+    # 洪泛聚合窗口（秒）：窗口内相同 (ip, 类型, 载荷摘要, URL) 的攻击合并为一行并累加 count；0 表示每个事件一行
+    ATTACK_LOG_AGGREGATE_WINDOW_S = 60
+    # 数据库被锁定（如 rollup 重算）时一批日志最长重试时间（秒），超过后丢弃该批并计入 errors
+    ATTACK_LOG_LOCK_RETRY_S = 300
+    # 仪表盘统计结果共享缓存的有效期（毫秒）；过期后只有一个请求重新计算
+    STATS_CACHE_TTL_MS = 2000
+    # 实时事件流（SSE）：断线续传缓冲条数、每个客户端的队列上限、心跳间隔（秒）、
+    # 单个连接的最长时间（秒，到期关闭，客户端按 Last-Event-ID 重连，长连接不会一直占用 worker 线程）
+    EVENT_STREAM_BUFFER = 1000
+    EVENT_STREAM_CLIENT_QUEUE = 256
+    EVENT_STREAM_HEARTBEAT_S = 15
+    EVENT_STREAM_MAX_LIFETIME_S = 300
+    # 攻击日志全文检索（SQLite FTS5 trigram，触发器同步）；关闭时删除索引，搜索退回 ILIKE
+    ATTACK_LOG_FTS = True
+    # 攻击日志流式导出每批读取的行数（按 id 键集分页）
+    ATTACK_LOG_EXPORT_BATCH_SIZE = 1000
+    # 日志保留期：攻击日志 / 登录尝试（天）、限流记录（分钟），0 表示不清理；
+    # 后台每 RETENTION_INTERVAL_S 秒清理一轮，每批删除的行数与批间暂停（毫秒）；
+    # 过期的攻击日志与登录尝试先归档到 RETENTION_ARCHIVE_DIR（相对 instance 目录，空表示不归档）
+    RETENTION_ENABLED = True
+    RETENTION_ATTACK_LOG_DAYS = 90
+    RETENTION_AUTH_LOGIN_DAYS = 30
+    RETENTION_RATE_LIMIT_MINUTES = 60
+    RETENTION_INTERVAL_S = 300
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_BATCH_PAUSE_MS = 50
+    RETENTION_ARCHIVE_DIR = 'archive'
+    # 每个归档段的最大行数；/api/attack/logs 与导出在时间范围早于热数据时是否同时查询归档段
+    RETENTION_SEGMENT_ROWS = 50000
+    ARCHIVE_QUERY_ENABLED = True
+    # /api/attack/logs 每个请求最多解压的归档段数，超过时返回 before_ts 续查游标
+    ARCHIVE_QUERY_MAX_SEGMENTS = 16
+    # 内存滑动窗口限流（中间件在内容检测之前检查，静态文件不计数）：
+    # 各端点类别阈值覆盖（默认见 RateLimitDetector.thresholds），最多跟踪的 (ip, 类别) 键数，是否把超限记入攻击日志
+    # 仪表盘每个标签页每分钟轮询约 40 次 /api/，api 类别放宽到 120 次/分钟
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_THRESHOLDS = {'api': {'requests': 120}}
+    RATE_LIMIT_MAX_KEYS = 50000
+    RATE_LIMIT_PERSIST_VIOLATIONS = True
     # 其他配置（比如日志、IP白名单等）
\ No newline at end of file
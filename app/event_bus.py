@@ -0,0 +1,145 @@
+"""
+进程内攻击事件发布/订阅
+攻击日志写入路径（AttackLogWriter.submit）在入队的同时把事件发布到这里，
+/api/events/stream 的每个 SSE 连接是一个订阅者，仪表盘不再需要轮询即可亚秒级看到新事件。
+
+- 事件 id 在进程内单调递增；最近 EVENT_STREAM_BUFFER 条事件保存在环形缓冲中，
+  客户端断线重连时按 Last-Event-ID 补发错过的事件；错过的事件已不在缓冲中（或 id 来自其他进程/重启前）
+  时通知客户端整体刷新（reset）。
+- 每个订阅者有独立的有界队列（EVENT_STREAM_CLIENT_QUEUE），慢客户端只丢弃自己最旧的事件，
+  不影响发布方和其他客户端；丢弃数量通过 gap 通知客户端。
+- 类型、严重级别过滤在服务端完成，只推送客户端关心的事件。
+多 worker 部署时每个进程各有一份，客户端只收到所连接 worker 记录的事件。
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+from collections import deque
+from typing import Dict, FrozenSet, List, Optional
+
+from .models import AttackLog
+
+# 推送给客户端的字段，载荷只保留前缀
+EVENT_FIELDS = ('ip', 'attack_type', 'attack_category', 'severity', 'blocked', 'target_url')
+PAYLOAD_PREVIEW_CHARS = 200
+_DEFAULTS = {k: AttackLog.column_default(k) for k in EVENT_FIELDS if k != 'ip'}
+
+
+class Subscription:
+
+    def __init__(self, bus: 'EventBus', max_queue: int, types: Optional[FrozenSet[str]],
+                 severities: Optional[FrozenSet[str]]):
+        self.bus = bus
+        self.types = types
+        self.severities = severities
+        self._queue: deque = deque(maxlen=max_queue)
+        self.dropped = 0
+        self.reset = False
+
+    def wants(self, event: Dict) -> bool:
+        if self.types and event.get('attack_type') not in self.types:
+            return False
+        if self.severities and event.get('severity') not in self.severities:
+            return False
+        return True
+
+    def _push(self, event: Dict) -> None:
+        """调用方持有总线锁"""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(event)
+
+    def get(self, timeout: float):
+        """
+        等待新事件，返回 (事件列表, 丢弃数, 是否需要整体刷新)；超时返回空列表（调用方发送心跳）
+        """
+        with self.bus._cond:
+            self.bus._cond.wait_for(lambda: self._queue or self.reset, timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            dropped, self.dropped = self.dropped, 0
+            reset, self.reset = self.reset, False
+        return events, dropped, reset
+
+
+class EventBus:
+
+    def __init__(self, buffer_size: int = 1000, client_queue: int = 256):
+        self.client_queue = max(1, int(client_queue))
+        self._history: deque = deque(maxlen=max(1, int(buffer_size)))
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._subscribers: List[Subscription] = []
+        self._cond = threading.Condition()
+        self._stats = {'published': 0, 'delivered': 0, 'dropped': 0, 'replayed': 0, 'resets': 0}
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, row: Dict) -> int:
+        # 未给出的字段按 AttackLog 列默认值补全，与落库后的取值一致
+        event = {k: row[k] if row.get(k) is not None else _DEFAULTS.get(k) for k in EVENT_FIELDS}
+        event['payload'] = (row.get('payload') or '')[:PAYLOAD_PREVIEW_CHARS]
+        timestamp = row.get('timestamp')
+        event['time'] = timestamp.isoformat() if timestamp is not None else None
+        with self._cond:
+            event['id'] = self._last_id = next(self._ids)
+            self._history.append(event)
+            self._stats['published'] += 1
+            for sub in self._subscribers:
+                if sub.wants(event):
+                    before = sub.dropped
+                    sub._push(event)
+                    self._stats['delivered'] += 1
+                    self._stats['dropped'] += sub.dropped - before
+            if self._subscribers:
+                self._cond.notify_all()
+        return event['id']
+
+    def subscribe(self, last_event_id: Optional[int] = None, types=None, severities=None) -> Subscription:
+        """注册订阅者；给出 last_event_id 时把缓冲中之后的事件先放入其队列"""
+        sub = Subscription(self, self.client_queue,
+                           frozenset(types) if types else None,
+                           frozenset(severities) if severities else None)
+        with self._cond:
+            if last_event_id is not None:
+                oldest = self._history[0]['id'] if self._history else self._last_id + 1
+                if last_event_id > self._last_id or last_event_id < oldest - 1:
+                    # 来自重启前/其他进程的 id，或错过的事件已被环形缓冲淘汰
+                    sub.reset = True
+                    self._stats['resets'] += 1
+                else:
+                    for event in self._history:
+                        if event['id'] > last_event_id and sub.wants(event):
+                            sub._push(event)
+                            self._stats['replayed'] += 1
+            self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._cond:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['subscribers'] = len(self._subscribers)
+            stats['buffered'] = len(self._history)
+            stats['last_id'] = self._last_id
+        return stats
+
+
+def get_event_bus(flask_app) -> EventBus:
+    """每个应用一个事件总线，保存在 app.extensions['event_bus']"""
+    bus = flask_app.extensions.get('event_bus')
+    if bus is None:
+        config = flask_app.config
+        bus = EventBus(
+            buffer_size=config.get('EVENT_STREAM_BUFFER', 1000),
+            client_queue=config.get('EVENT_STREAM_CLIENT_QUEUE', 256),
+        )
+        flask_app.extensions['event_bus'] = bus
+    return bus
@@ -0,0 +1,429 @@
+"""
+攻击日志冷数据层（归档段查询）
+保留期任务（retention）把过期的攻击日志按日期写入 gzip NDJSON 段，SQLite 中只保留近期日志（热数据层）。
+每个段旁边有一个小索引文件（<段名>.idx.json）：行数、有效字节数、时间范围、id 范围，
+以及 ip 与 attack_type 的布隆过滤器。索引在每批归档写入并 fsync 之后、删除数据库行之前原子替换，
+因此数据库中已删除的行一定能在某个段的索引范围内找到；读取时只读到索引记录的字节数，
+正在追加的段也可以安全查询。
+
+查询时先用时间范围、id 范围和布隆过滤器排除不可能命中的段，再解压剩余段逐行过滤：
+- /api/attack/logs 按 (timestamp, id) 倒序分页时，把冷数据层中比本页最后一行更新的行合并进来，
+  第一页通常整段被时间范围排除，不读取任何文件；游标指向已归档的行时同样可以继续翻页；
+  每个请求最多解压 ARCHIVE_QUERY_MAX_SEGMENTS 个段（q 等无法用索引排除的筛选），
+  达到上限时只返回已完整扫描的时间范围内的行，并给出 before_ts 续查游标；
+- 导出按 id 升序把两层合并输出。
+相关度排序（全文检索默认）和 offset 分页只查询热数据层。
+q 在冷数据层中按不区分大小写的子串匹配 payload / target_url / user_agent，与 trigram 检索语义一致。
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = 'attack_log'
+INDEX_SUFFIX = '.idx.json'
+INDEX_VERSION = 1
+# 建立布隆过滤器的列
+BLOOM_FIELDS = ('ip', 'attack_type')
+BLOOM_FP_RATE = 0.01
+# 没有索引的段在创建后多久才视为早期版本写入的完整段（秒）
+IN_PROGRESS_GRACE_S = 60
+_DATETIME_FIELDS = ('timestamp', 'first_seen', 'last_seen')
+_SEARCH_FIELDS = ('payload', 'target_url', 'user_agent')
+
+
+def index_path(segment_path: str) -> str:
+    return segment_path + INDEX_SUFFIX
+
+
+class BloomFilter:
+    """按元素个数与误判率确定位数和哈希个数，双重哈希取位"""
+
+    def __init__(self, bits: int, hashes: int, data: Optional[bytes] = None):
+        self.bits = max(8, int(bits))
+        self.hashes = max(1, int(hashes))
+        self.data = bytearray(data) if data is not None else bytearray((self.bits + 7) // 8)
+
+    @classmethod
+    def from_values(cls, values: Iterable[str], fp_rate: float = BLOOM_FP_RATE) -> 'BloomFilter':
+        values = list(values)
+        n = max(1, len(values))
+        bits = math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2))
+        bloom = cls(bits, round(bits / n * math.log(2)))
+        for v in values:
+            bloom.add(v)
+        return bloom
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        for p in self._positions(value):
+            self.data[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.data[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+    def to_dict(self) -> Dict:
+        return {'bits': self.bits, 'hashes': self.hashes, 'data': base64.b64encode(bytes(self.data)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> 'BloomFilter':
+        return cls(d['bits'], d['hashes'], base64.b64decode(d['data']))
+
+
+class SegmentIndexBuilder:
+    """归档写入方维护的段索引，每批写入后调用 save() 原子替换索引文件"""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.rows = 0
+        self.min_ts = self.max_ts = None
+        self.min_id = self.max_id = None
+        self._values = {f: set() for f in BLOOM_FIELDS}
+
+    def add(self, row: Dict) -> None:
+        self.rows += 1
+        ts = row.get('timestamp')
+        if ts is not None:
+            self.min_ts = ts if self.min_ts is None or ts < self.min_ts else self.min_ts
+            self.max_ts = ts if self.max_ts is None or ts > self.max_ts else self.max_ts
+        rid = row.get('id')
+        if rid is not None:
+            self.min_id = rid if self.min_id is None or rid < self.min_id else self.min_id
+            self.max_id = rid if self.max_id is None or rid > self.max_id else self.max_id
+        for f, values in self._values.items():
+            if row.get(f) is not None:
+                values.add(str(row[f]))
+
+    def to_dict(self, size: int) -> Dict:
+        return {
+            'version': INDEX_VERSION,
+            'table': self.table,
+            'rows': self.rows,
+            'bytes': size,
+            'min_ts': self.min_ts.isoformat() if self.min_ts else None,
+            'max_ts': self.max_ts.isoformat() if self.max_ts else None,
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'blooms': {f: BloomFilter.from_values(v).to_dict() for f, v in self._values.items() if v},
+        }
+
+    def save(self, segment_path: str, size: int) -> None:
+        path = index_path(segment_path)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(size), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+def _parse_row(line: str) -> SimpleNamespace:
+    row = json.loads(line)
+    for f in _DATETIME_FIELDS:
+        if row.get(f):
+            row[f] = datetime.fromisoformat(row[f])
+    return SimpleNamespace(**row)
+
+
+def _key(row) -> Tuple[datetime, int]:
+    return (row.timestamp or datetime.min, row.id)
+
+
+class Segment:
+
+    def __init__(self, path: str, index: Dict, index_mtime: int):
+        self.path = path
+        self.index_mtime = index_mtime
+        self.rows = index['rows']
+        self.bytes = index['bytes']
+        self.min_ts = datetime.fromisoformat(index['min_ts']) if index.get('min_ts') else datetime.min
+        self.max_ts = datetime.fromisoformat(index['max_ts']) if index.get('max_ts') else datetime.min
+        self.min_id = index.get('min_id') or 0
+        self.max_id = index.get('max_id') or 0
+        self.blooms = {f: BloomFilter.from_dict(d) for f, d in (index.get('blooms') or {}).items()}
+
+    def may_contain(self, field: str, value) -> bool:
+        bloom = self.blooms.get(field)
+        return bloom is None or str(value) in bloom
+
+    def read(self) -> List[SimpleNamespace]:
+        with open(self.path, 'rb') as f:
+            data = f.read(self.bytes)
+        return [_parse_row(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+
+class ArchiveStore:
+
+    def __init__(self, root: Optional[str], enabled: bool = True):
+        self.root = os.path.join(root, ARCHIVE_TABLE) if root else None
+        self.enabled = bool(enabled) and self.root is not None
+        self._segments: Dict[str, Segment] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stats = {'queries': 0, 'segments_read': 0, 'skipped_range': 0, 'skipped_bloom': 0,
+                       'rows_returned': 0, 'indexes_built': 0, 'capped_queries': 0}
+
+    # ---- 段发现 ----
+
+    def _dir_signature(self):
+        try:
+            days = sorted(e.path for e in os.scandir(self.root) if e.is_dir())
+        except FileNotFoundError:
+            return ()
+        return tuple((d, os.stat(d).st_mtime_ns) for d in days)
+
+    def segments(self) -> List[Segment]:
+        """当前所有段；日期目录有变化（新段、索引替换）时重新扫描"""
+        if not self.enabled:
+            return []
+        with self._lock:
+            signature = self._dir_signature()
+            if signature != self._signature:
+                found = {}
+                for day, _ in signature:
+                    for name in os.listdir(day):
+                        if name.endswith('.ndjson.gz'):
+                            path = os.path.join(day, name)
+                            seg = self._load(path)
+                            if seg is not None:
+                                found[path] = seg
+                self._segments = found
+                # 有尚未写出索引的段时下次重新扫描
+                pending = any(name.endswith('.ndjson.gz') and os.path.join(day, name) not in found
+                              for day, _ in signature for name in os.listdir(day))
+                self._signature = None if pending else signature
+            return list(self._segments.values())
+
+    def _load(self, path: str) -> Optional[Segment]:
+        idx = index_path(path)
+        try:
+            mtime = os.stat(idx).st_mtime_ns
+        except FileNotFoundError:
+            # 刚创建、第一批还未写完索引的段稍后再读
+            if time.time() - os.path.getmtime(path) < IN_PROGRESS_GRACE_S:
+                return None
+            return self._build_index(path)
+        cached = self._segments.get(path)
+        if cached is not None and cached.index_mtime == mtime:
+            return cached
+        try:
+            with open(idx, encoding='utf-8') as f:
+                return Segment(path, json.load(f), mtime)
+        except (OSError, ValueError, KeyError):
+            logger.warning('归档段索引损坏，重新生成：%s', idx)
+            return self._build_index(path)
+
+    def _build_index(self, path: str) -> Optional[Segment]:
+        """没有索引的段（早期版本写入）：扫描一次生成索引"""
+        try:
+            size = os.path.getsize(path)
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                rows = [_parse_row(line) for line in f if line.strip()]
+        except (OSError, EOFError, ValueError):
+            logger.warning('无法读取归档段：%s', path)
+            return None
+        builder = SegmentIndexBuilder(ARCHIVE_TABLE)
+        for row in rows:
+            builder.add(vars(row))
+        builder.save(path, size)
+        self._stats['indexes_built'] += 1
+        return Segment(path, builder.to_dict(size), os.stat(index_path(path)).st_mtime_ns)
+
+    # ---- 查询 ----
+
+    def _candidates(self, filters: Dict, lo: Optional[datetime] = None, hi: Optional[datetime] = None,
+                    below_id: Optional[int] = None) -> List[Segment]:
+        """按时间范围 (lo, hi)、id 上界和布隆过滤器排除段"""
+        if filters.get('after_ts') is not None:
+            lo = max(lo, filters['after_ts']) if lo is not None else filters['after_ts']
+        if filters.get('before_ts') is not None:
+            hi = min(hi, filters['before_ts']) if hi is not None else filters['before_ts']
+        result = []
+        for seg in self.segments():
+            if (lo is not None and seg.max_ts < lo) or (hi is not None and seg.min_ts > hi) \
+                    or (below_id is not None and seg.min_id >= below_id):
+                self._stats['skipped_range'] += 1
+                continue
+            if (filters.get('ip') and not seg.may_contain('ip', filters['ip'])) or \
+                    (filters.get('type') and not seg.may_contain('attack_type', filters['type'])):
+                self._stats['skipped_bloom'] += 1
+                continue
+            result.append(seg)
+        return result
+
+    @staticmethod
+    def matches(row, filters: Dict) -> bool:
+        """与 log_export.apply_filters 相同的筛选语义"""
+        if filters.get('type') and row.attack_type != filters['type']:
+            return False
+        if filters.get('severity') and row.severity != filters['severity']:
+            return False
+        if filters.get('blocked') is not None and bool(row.blocked) != filters['blocked']:
+            return False
+        if filters.get('ip') and row.ip != filters['ip']:
+            return False
+        ts = row.timestamp or datetime.min
+        if filters.get('after_ts') is not None and not ts > filters['after_ts']:
+            return False
+        if filters.get('before_ts') is not None and not ts < filters['before_ts']:
+            return False
+        q = (filters.get('q') or '').lower()
+        if q and not any(q in (getattr(row, f, None) or '').lower() for f in _SEARCH_FIELDS):
+            return False
+        return True
+
+    def _read(self, seg: Segment) -> List[SimpleNamespace]:
+        self._stats['segments_read'] += 1
+        return seg.read()
+
+    def newest(self, filters: Dict, limit: int, before: Optional[Tuple[datetime, int]] = None,
+               floor: Optional[Tuple[datetime, int]] = None, below_id: Optional[int] = None,
+               max_segments: Optional[int] = None) -> Tuple[List, Optional[datetime]]:
+        """
+        按 (timestamp, id) 倒序取最多 limit 行，只取 floor < 键 < before（before_id 游标找不到时用 below_id）
+        段按最新时间倒序读取，已凑满 limit 且下一段整体更旧时停止。
+        返回 (行, 续查时间)：读满 max_segments 个段仍未结束时停止，只返回时间晚于续查时间的行
+        （这部分已完整扫描），更早的行由调用方以 before_ts=续查时间+1 微秒继续查询；未截断时续查时间为 None
+        """
+        self._stats['queries'] += 1
+        # 时间上界（含）：游标时间与 before_ts（不含，时间精度为微秒）中较早者
+        hi = before[0] if before else None
+        if filters.get('before_ts') is not None:
+            bound = filters['before_ts'] - timedelta(microseconds=1)
+            hi = bound if hi is None else min(hi, bound)
+        segs = self._candidates(filters, lo=floor[0] if floor else None, hi=hi, below_id=below_id)
+
+        def top(seg):
+            return seg.max_ts if hi is None else min(seg.max_ts, hi)
+
+        segs.sort(key=top, reverse=True)
+        best: Dict[int, SimpleNamespace] = {}
+        cutoff = None
+        resume = None
+        for i, seg in enumerate(segs):
+            if cutoff is not None and seg.max_ts < cutoff[0]:
+                break
+            # 只在段的上界严格早于第一段时截断，续查时间逐次递减，不会原地重复
+            if max_segments and i >= max_segments and top(seg) < top(segs[0]):
+                resume = top(seg)
+                self._stats['capped_queries'] += 1
+                break
+            for row in self._read(seg):
+                key = _key(row)
+                if (before is not None and not key < before) or (floor is not None and not key > floor) \
+                        or (below_id is not None and not row.id < below_id) or not self.matches(row, filters):
+                    continue
+                best[row.id] = row  # 崩溃后重复归档的行按 id 去重
+            if len(best) >= limit:
+                ranked = sorted(best.values(), key=_key, reverse=True)[:limit]
+                best = {r.id: r for r in ranked}
+                cutoff = _key(ranked[-1])
+        rows = sorted(best.values(), key=_key, reverse=True)
+        if resume is not None:
+            rows = [r for r in rows if _key(r)[0] > resume]
+        rows = rows[:limit]
+        self._stats['rows_returned'] += len(rows)
+        return rows, resume
+
+    def lookup_timestamp(self, log_id: int) -> Optional[datetime]:
+        """已归档日志的时间戳（游标行不在热数据层时使用）"""
+        for seg in self.segments():
+            if seg.min_id <= log_id <= seg.max_id:
+                for row in self._read(seg):
+                    if row.id == log_id:
+                        return row.timestamp
+        return None
+
+    def iter_ascending(self, filters: Dict) -> Iterator:
+        """按 id 升序产出符合条件的归档行；各段 id 范围可能交叉，只同时打开范围重叠的段"""
+        self._stats['queries'] += 1
+        pending = sorted(self._candidates(filters), key=lambda s: s.min_id)
+        heap: list = []
+        last_id = None
+        i = 0
+        while heap or i < len(pending):
+            # 下一段的最小 id 不大于当前堆顶时先载入，保证输出有序
+            while i < len(pending) and (not heap or pending[i].min_id <= heap[0][0]):
+                rows = sorted((r for r in self._read(pending[i]) if self.matches(r, filters)), key=lambda r: r.id)
+                if rows:
+                    heapq.heappush(heap, (rows[0].id, i, 0, rows))
+                i += 1
+            if not heap:
+                continue
+            rid, seg_no, pos, rows = heapq.heappop(heap)
+            if rid != last_id:
+                last_id = rid
+                self._stats['rows_returned'] += 1
+                yield rows[pos]
+            if pos + 1 < len(rows):
+                heapq.heappush(heap, (rows[pos + 1].id, seg_no, pos + 1, rows))
+
+    def may_cover(self, filters: Dict) -> bool:
+        """筛选的时间范围是否可能落在冷数据层"""
+        return bool(self.enabled and self._candidates(filters))
+
+    def get_stats(self) -> Dict:
+        segments = self.segments()
+        stats = dict(self._stats)
+        stats.update({
+            'enabled': self.enabled,
+            'segments': len(segments),
+            'rows': sum(s.rows for s in segments),
+            'bytes': sum(s.bytes for s in segments),
+            'oldest': min((s.min_ts for s in segments), default=None),
+            'newest': max((s.max_ts for s in segments), default=None),
+        })
+        for k in ('oldest', 'newest'):
+            stats[k] = stats[k].isoformat() if stats[k] else None
+        return stats
+
+
+def merge_newest(hot: List, cold: List, limit: int) -> List:
+    """两层各自倒序的结果合并，按 id 去重后取前 limit 行"""
+    seen = set()
+    rows = []
+    for row in sorted(list(hot) + list(cold), key=_key, reverse=True):
+        if row.id not in seen:
+            seen.add(row.id)
+            rows.append(row)
+    return rows[:limit]
+
+
+def merge_ascending(hot: Iterable, cold: Iterable) -> Iterator:
+    """两层各自按 id 升序的迭代器合并，按 id 去重"""
+    last_id = None
+    for row in heapq.merge(cold, hot, key=lambda r: r.id):
+        if row.id != last_id:
+            last_id = row.id
+            yield row
+
+
+def get_log_archive(flask_app) -> ArchiveStore:
+    """每个应用一个冷数据层，保存在 app.extensions['log_archive']；目录与 RETENTION_ARCHIVE_DIR 相同"""
+    store = flask_app.extensions.get('log_archive')
+    if store is None:
+        config = flask_app.config
+        root = config.get('RETENTION_ARCHIVE_DIR', 'archive')
+        if root and not os.path.isabs(root):
+            root = os.path.join(flask_app.instance_path, root)
+        store = ArchiveStore(root or None, enabled=config.get('ARCHIVE_QUERY_ENABLED', True))
+        flask_app.extensions['log_archive'] = store
+    return store
@@ -0,0 +1,191 @@
+"""
+攻击日志筛选与流式导出
+/api/attack/logs 与导出接口（/api/attack/logs/export、export_attack_logs.py）共用同一套筛选条件：
+type、severity、blocked、ip、q（全文检索，见 log_search）、after_ts / before_ts。
+
+导出按 id 升序以键集分批读取（每批 ATTACK_LOG_EXPORT_BATCH_SIZE 行，只取列元组，不进入会话的对象表），
+逐行生成 NDJSON 或 CSV，可选 gzip；内存占用与导出行数无关，且批次之间不持有读事务，
+导出过程中新写入的日志不会造成重复或遗漏（id 只增不减）。
+时间范围可能早于热数据时同时读取保留期归档段（见 log_archive），按 id 合并输出。
+CSV 中以 = + - @ 等公式字符开头的文本单元格加单引号前缀，防止在电子表格中被当作公式执行。
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Mapping, Optional
+
+from . import db
+from .log_archive import merge_ascending
+from .models import AttackLog
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# 导出/列表的字段顺序（CSV 表头）
+LOG_FIELDS = ('id', 'time', 'ip', 'attack_type', 'attack_category', 'severity', 'blocked',
+              'target_url', 'user_agent', 'payload', 'count', 'first_seen', 'last_seen')
+
+_COLUMNS = (AttackLog.id, AttackLog.timestamp, AttackLog.ip, AttackLog.attack_type, AttackLog.attack_category,
+            AttackLog.severity, AttackLog.blocked, AttackLog.target_url, AttackLog.user_agent, AttackLog.payload,
+            AttackLog.count, AttackLog.first_seen, AttackLog.last_seen)
+
+
+def serialize_log(l) -> Dict:
+    """AttackLog 对象或 _COLUMNS 对应的行 -> JSON 字典"""
+    return {
+        "id": int(l.id),
+        "ip": l.ip,
+        "payload": l.payload,
+        "time": l.timestamp.isoformat() if l.timestamp else None,
+        "blocked": bool(l.blocked),
+        "attack_type": l.attack_type,
+        "attack_category": l.attack_category,
+        "severity": l.severity,
+        "target_url": l.target_url,
+        "user_agent": l.user_agent,
+        "count": int(l.count or 1),
+        "first_seen": l.first_seen.isoformat() if l.first_seen else None,
+        "last_seen": l.last_seen.isoformat() if l.last_seen else None,
+    }
+
+
+def parse_filters(args: Mapping) -> Dict:
+    """从请求参数（或命令行参数字典）解析筛选条件；时间格式错误抛出 ValueError"""
+    def arg(name):
+        return (args.get(name) or '').strip()
+
+    blocked = arg('blocked').lower()
+    filters = {
+        'type': arg('type'),
+        'severity': arg('severity'),
+        'blocked': (blocked == 'true') if blocked in ('true', 'false') else None,
+        'ip': arg('ip'),
+        'q': arg('q'),
+        'after_ts': None,
+        'before_ts': None,
+    }
+    for name in ('after_ts', 'before_ts'):
+        if arg(name):
+            filters[name] = datetime.fromisoformat(arg(name))
+    return filters
+
+
+def apply_filters(qset, filters: Dict, log_search=None):
+    """
+    在查询上叠加筛选条件，返回 (查询, 全文检索子查询或 None)
+    q 优先走全文检索，不可用时退回 payload ILIKE
+    """
+    if filters.get('type'):
+        qset = qset.filter(AttackLog.attack_type == filters['type'])
+    if filters.get('severity'):
+        qset = qset.filter(AttackLog.severity == filters['severity'])
+    if filters.get('blocked') is not None:
+        qset = qset.filter(AttackLog.blocked == filters['blocked'])
+    if filters.get('ip'):
+        qset = qset.filter(AttackLog.ip == filters['ip'])
+    if filters.get('after_ts') is not None:
+        qset = qset.filter(AttackLog.timestamp > filters['after_ts'])
+    if filters.get('before_ts') is not None:
+        qset = qset.filter(AttackLog.timestamp < filters['before_ts'])
+    search = filters.get('q')
+    fts = log_search.matches(search) if search and log_search is not None else None
+    if fts is not None:
+        qset = qset.join(fts, fts.c.rowid == AttackLog.id)
+    elif search:
+        qset = qset.filter(AttackLog.payload.ilike(f"%{search}%"))
+    return qset, fts
+
+
+def iter_logs(filters: Dict, log_search=None, batch_size: int = 1000, limit: Optional[int] = None,
+              archive=None) -> Iterator:
+    """
+    按 id 升序产出符合条件的日志行（热数据为列元组，归档行为同名属性的对象）
+    给出 archive 且时间范围可能落在归档段时，两层按 id 合并
+    """
+    if archive is None or not archive.may_cover(filters):
+        return _iter_hot(filters, log_search, batch_size, limit)
+    rows = merge_ascending(_iter_hot(filters, log_search, batch_size), archive.iter_ascending(filters))
+    return islice(rows, limit) if limit is not None else rows
+
+
+def _iter_hot(filters: Dict, log_search=None, batch_size: int = 1000, limit: Optional[int] = None) -> Iterator:
+    base, _ = apply_filters(db.session.query(*_COLUMNS), filters, log_search)
+    last_id = 0
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        rows = base.filter(AttackLog.id > last_id).order_by(AttackLog.id).limit(size).all()
+        if not rows:
+            return
+        # 每批单独提交读事务，长时间导出不阻塞写入方的检查点
+        db.session.commit()
+        yield from rows
+        last_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < size:
+            return
+
+
+def ndjson_lines(rows: Iterable) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(serialize_log(row), ensure_ascii=False) + '\n'
+
+
+# 电子表格会把以这些字符开头的单元格当作公式执行（CSV 注入）
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    """以公式字符开头的文本单元格前加单引号，表格软件按文本显示；载荷等字段由攻击者控制"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows: Iterable) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=LOG_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: _csv_cell(v) for k, v in serialize_log(row).items()})
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def encode(lines: Iterable[str], compress: bool = False, flush_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """把文本行编码为字节块；compress 时输出 gzip 流。小行合并到 flush_bytes 左右再产出"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= flush_bytes:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_stream(fmt: str, filters: Dict, log_search=None, compress: bool = False,
+                  batch_size: int = 1000, limit: Optional[int] = None, archive=None) -> Iterator[bytes]:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    rows = iter_logs(filters, log_search=log_search, batch_size=batch_size, limit=limit, archive=archive)
+    lines = ndjson_lines(rows) if fmt == 'ndjson' else csv_lines(rows)
+    return encode(lines, compress=compress)
@@ -0,0 +1,116 @@
+"""
+攻击日志全文检索
+/api/attack/logs 的 q 参数原先是 payload ILIKE '%q%'，每次搜索都要扫描所有载荷。
+开启 ATTACK_LOG_FTS 且数据库为带 FTS5 的 SQLite 时，在 payload / target_url / user_agent 上建立
+外部内容（content='attack_log'）的 FTS5 索引：
+- trigram 分词，语义与原来的子串匹配一致（不区分大小写），xp_cmdshell 之类的片段可直接命中；
+- 由 attack_log 上的触发器同步，批量写入、ORM 插入、保留期删除都会自动更新索引；
+  洪泛聚合只 UPDATE count / last_seen，不触发重建索引行；
+- 首次创建时从现有日志重建（rebuild）。
+关闭开关时删除索引和触发器（写入不再有额外开销），搜索退回 ILIKE；
+查询少于 3 个字符（trigram 无法匹配）时同样退回 ILIKE。
+"""
+from __future__ import annotations
+
+import logging
+from typing import Dict
+
+from sqlalchemy import Float, Integer, text
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'attack_log_fts'
+FTS_COLUMNS = ('payload', 'target_url', 'user_agent')
+MIN_QUERY_CHARS = 3
+
+_TRIGGERS = {
+    'attack_log_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS attack_log_fts_ai AFTER INSERT ON attack_log BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, payload, target_url, user_agent)
+            VALUES (new.id, new.payload, new.target_url, new.user_agent);
+        END""",
+    'attack_log_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS attack_log_fts_ad AFTER DELETE ON attack_log BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, payload, target_url, user_agent)
+            VALUES ('delete', old.id, old.payload, old.target_url, old.user_agent);
+        END""",
+    'attack_log_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS attack_log_fts_au AFTER UPDATE OF payload, target_url, user_agent
+        ON attack_log BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, payload, target_url, user_agent)
+            VALUES ('delete', old.id, old.payload, old.target_url, old.user_agent);
+            INSERT INTO {FTS_TABLE}(rowid, payload, target_url, user_agent)
+            VALUES (new.id, new.payload, new.target_url, new.user_agent);
+        END""",
+}
+
+
+class LogSearchIndex:
+
+    def __init__(self, flask_app, enabled: bool = True):
+        self.flask_app = flask_app
+        self.enabled = bool(enabled)
+        self.available = False
+        self._stats = {'fts_searches': 0, 'fallback_searches': 0}
+
+    def setup(self) -> None:
+        """按开关创建或删除索引与触发器（应用启动时调用一次）"""
+        with self.flask_app.app_context():
+            engine = db.engine
+            if engine.dialect.name != 'sqlite':
+                return
+            with engine.begin() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"), {'n': FTS_TABLE}).first()
+                if not self.enabled:
+                    if exists:
+                        for name in _TRIGGERS:
+                            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                        conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+                    return
+                try:
+                    conn.execute(text(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                        f"{', '.join(FTS_COLUMNS)}, content='attack_log', content_rowid='id', tokenize='trigram')"))
+                except Exception:
+                    # SQLite 未编译 FTS5 或不支持 trigram 分词（3.34 之前）
+                    logger.warning('FTS5 trigram 不可用，日志搜索使用 ILIKE')
+                    return
+                for ddl in _TRIGGERS.values():
+                    conn.execute(text(ddl))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            self.available = True
+
+    def matches(self, q: str):
+        """
+        返回 (rowid, rank) 子查询；不可用或查询过短时返回 None（调用方改用 ILIKE）
+        rank 为 bm25，越小越相关
+        """
+        if not self.available or len(q) < MIN_QUERY_CHARS:
+            self._stats['fallback_searches'] += 1
+            return None
+        self._stats['fts_searches'] += 1
+        # 整体作为短语查询，避免用户输入被解析为 FTS 语法
+        phrase = '"' + q.replace('"', '""') + '"'
+        return text(
+            f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :phrase"
+        ).bindparams(phrase=phrase).columns(rowid=Integer, rank=Float).subquery('fts')
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        stats['available'] = self.available
+        return stats
+
+
+def get_log_search(flask_app) -> LogSearchIndex:
+    """每个应用一个检索索引，保存在 app.extensions['log_search']"""
+    index = flask_app.extensions.get('log_search')
+    if index is None:
+        index = LogSearchIndex(flask_app, enabled=flask_app.config.get('ATTACK_LOG_FTS', True))
+        index.setup()
+        flask_app.extensions['log_search'] = index
+    return index
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime
 from . import db
 from flask_login import UserMixin
@@ -18,7 +19,46 @@ class User(UserMixin, db.Model):
         except Exception:
             return self.password == pwd
 
+def payload_hash(payload) -> str:
+    """载荷摘要，用于洪泛聚合时判断"同一载荷"（不必比较 2000 字符的原文）"""
+    return hashlib.sha1((payload or '').encode('utf-8', 'replace')).hexdigest()
+
+
+PAYLOAD_FAMILIES = ('script', 'alert', 'javascript', 'others')
+
+
+def classify_payload_family(payload):
+    """载荷特征分类（/api/stats/types 的 script / alert / javascript / others），空载荷不分类"""
+    if not payload:
+        return None
+    pl = payload.lower()
+    if '<script' in pl:
+        return 'script'
+    if 'alert' in pl:
+        return 'alert'
+    if 'javascript:' in pl:
+        return 'javascript'
+    return 'others'
+
+
+def _param_default(name, fn=None):
+    # 列默认值取自同一行的其他参数（未显式给出时）
+    def default(context):
+        value = context.get_current_parameters().get(name)
+        return fn(value) if fn else (value or datetime.utcnow())
+    return default
+
+
 class AttackLog(db.Model):
+    # 列表接口按 (timestamp, id) 倒序分页，各筛选条件各有一个以 timestamp 结尾的复合索引
+    # （迁移脚本 migrate_add_attacklog_indexes.py 为已有数据库创建）
+    __table_args__ = (
+        db.Index('ix_attack_log_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_attack_log_type_timestamp', 'attack_type', 'timestamp', 'id'),
+        db.Index('ix_attack_log_severity_timestamp', 'severity', 'timestamp', 'id'),
+        db.Index('ix_attack_log_blocked_timestamp', 'blocked', 'timestamp', 'id'),
+        db.Index('ix_attack_log_ip_timestamp', 'ip', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String(45), nullable=False)
     payload = db.Column(db.Text, nullable=False)
@@ -29,6 +69,45 @@ class AttackLog(db.Model):
     severity = db.Column(db.String(20), default='medium')  # low, medium, high, critical
     target_url = db.Column(db.String(500), nullable=True)  # 攻击目标URL
     user_agent = db.Column(db.String(500), nullable=True)  # User-Agent信息
+    # 洪泛聚合：同一 (ip, attack_type, payload_hash, target_url) 在时间窗口内合并为一行
+    count = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # 该行代表的事件数
+    first_seen = db.Column(db.DateTime, nullable=True, default=_param_default('timestamp'))
+    last_seen = db.Column(db.DateTime, nullable=True, default=_param_default('timestamp'))
+    payload_hash = db.Column(db.String(40), nullable=True, index=True, default=_param_default('payload', payload_hash))
+    # 写入时分类一次，统计接口按该列分组
+    payload_family = db.Column(db.String(20), nullable=True, index=True,
+                               default=_param_default('payload', classify_payload_family))
+
+    @classmethod
+    def events(cls):
+        """事件数表达式：统计时按 count 求和而不是数行"""
+        return db.func.coalesce(db.func.sum(cls.count), 0)
+
+    @classmethod
+    def column_default(cls, name):
+        """列的常量默认值（批量写入的行字典中未给出该字段时数据库中的取值）"""
+        default = cls.__table__.c[name].default
+        return default.arg if default is not None and not callable(default.arg) else None
+
+class AttackRollup(db.Model):
+    """攻击统计预聚合：按天分桶，维度为攻击类型、严重级别、是否拦截、来源 IP"""
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'attack_type', 'severity', 'blocked', 'ip',
+                            name='uq_attack_rollup_key'),
+        db.Index('ix_attack_rollup_granularity_bucket', 'granularity', 'bucket'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # day
+    bucket = db.Column(db.DateTime, nullable=False)  # 桶起始时间（UTC）
+    attack_type = db.Column(db.String(50), nullable=False)
+    severity = db.Column(db.String(20), nullable=False)
+    blocked = db.Column(db.Boolean, nullable=False)
+    ip = db.Column(db.String(45), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def events(cls):
+        return db.func.coalesce(db.func.sum(cls.count), 0)
 
 class BannedIP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
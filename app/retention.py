@@ -0,0 +1,263 @@
+"""
+日志保留期清理与归档
+AttackLog、AuthLoginAttempt、RateLimitLog 各有独立的保留期（RETENTION_*，0 表示不清理）。
+后台线程每 RETENTION_INTERVAL_S 秒执行一轮：
+- 按 id 顺序每次取 RETENTION_BATCH_SIZE 行过期记录，先写入归档，再在一个短事务中按 id 删除，
+  批次之间暂停 RETENTION_BATCH_PAUSE_MS 毫秒，不长时间持有 SQLite 写锁；
+- 归档为按日期分区的 gzip NDJSON 段：<归档目录>/<表名>/<YYYY-MM-DD>/part-<本轮时间>-<pid>-<序号>.ndjson.gz，
+  每行是一条记录的全部列，每段最多 RETENTION_SEGMENT_ROWS 行，旁边的索引文件供冷数据查询（见 log_archive）；
+  RateLimitLog 只是限流计数，直接删除不归档；
+- 先归档后删除，进程在两者之间退出时下一轮会再次归档同一批（至少一次，不会丢失）；
+- 多个 worker 通过 Setting 中的租约（retention_lease）保证同一时刻只有一个进程执行。
+AttackRollup 不清理，统计图表保留完整历史。每轮的删除/归档行数、批次数、耗时见 get_stats()。
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from . import db
+from .conditional import bump_log_version
+from .log_archive import SegmentIndexBuilder
+from .models import AttackLog, AuthLoginAttempt, RateLimitLog, Setting
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY = 'retention_lease'
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    name: str
+    model: type
+    ttl: timedelta
+    archive: bool = True
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class SegmentWriter:
+    """
+    一轮清理中按 (表, 日期) 打开的归档段
+    每批追加为一个完整的 gzip 成员并 fsync，随后原子替换段索引（见 log_archive），
+    查询方读到索引记录的字节数即为完整数据；段达到 segment_rows 行后换新段
+    """
+
+    def __init__(self, root: str, stamp: str, segment_rows: int = 50000):
+        self.root = root
+        self.stamp = stamp
+        self.segment_rows = max(1, int(segment_rows))
+        self._open: Dict[tuple, tuple] = {}
+        self._seq = 0
+        self.paths: List[str] = []
+
+    def write(self, table: str, rows: List[Dict], timestamp_key: str = 'timestamp') -> None:
+        by_day: Dict[str, List[Dict]] = {}
+        for row in rows:
+            ts = row.get(timestamp_key)
+            by_day.setdefault(ts.date().isoformat() if ts else 'unknown', []).append(row)
+        for day, day_rows in by_day.items():
+            while day_rows:
+                room = self._room(table, day)
+                self._append(table, day, day_rows[:room])
+                day_rows = day_rows[room:]
+
+    def _room(self, table: str, day: str) -> int:
+        current = self._open.get((table, day))
+        if current is None or current[1].rows >= self.segment_rows:
+            return self.segment_rows  # _append 会换新段
+        return self.segment_rows - current[1].rows
+
+    def _append(self, table: str, day: str, rows: List[Dict]) -> None:
+        current = self._open.get((table, day))
+        if current is None or current[1].rows >= self.segment_rows:
+            directory = os.path.join(self.root, table, day)
+            os.makedirs(directory, exist_ok=True)
+            self._seq += 1
+            path = os.path.join(directory, f'part-{self.stamp}-{os.getpid()}-{self._seq:04d}.ndjson.gz')
+            current = self._open[(table, day)] = (path, SegmentIndexBuilder(table))
+            self.paths.append(path)
+        path, index = current
+        lines = ''.join(json.dumps({k: _json_value(v) for k, v in row.items()}, ensure_ascii=False) + '\n'
+                        for row in rows)
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(lines.encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        for row in rows:
+            index.add(row)
+        index.save(path, size)
+
+    def close(self) -> None:
+        self._open.clear()
+
+
+class RetentionJob:
+
+    def __init__(self, flask_app, policies: List[RetentionPolicy], archive_dir: Optional[str],
+                 batch_size: int = 500, batch_pause_ms: int = 50, interval_s: int = 300,
+                 segment_rows: int = 50000):
+        self.flask_app = flask_app
+        self.policies = [p for p in policies if p.ttl.total_seconds() > 0]
+        self.archive_dir = archive_dir
+        self.batch_size = max(1, int(batch_size))
+        self.batch_pause = max(0, int(batch_pause_ms)) / 1000.0
+        self.interval = max(1, int(interval_s))
+        self.segment_rows = segment_rows
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._stats = {'runs': 0, 'skipped': 0, 'errors': 0, 'last_run': None, 'totals': {}}
+
+    def start(self) -> None:
+        if self._thread is None and self.policies:
+            self._thread = threading.Thread(target=self._loop, name='retention', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        # 首轮同样等待一个周期，避免进程启动时与初始化争用数据库
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                self._stats['errors'] += 1
+                logger.exception('日志保留期清理失败')
+
+    def run_once(self, now: Optional[datetime] = None) -> Optional[Dict]:
+        """执行一轮清理，返回本轮指标；未取得租约（其他进程正在执行）时返回 None"""
+        with self._run_lock, self.flask_app.app_context():
+            if not self._acquire_lease():
+                self._stats['skipped'] += 1
+                return None
+            now = now or datetime.utcnow()
+            started = time.perf_counter()
+            segments = SegmentWriter(self.archive_dir, now.strftime('%Y%m%dT%H%M%S'),
+                                     self.segment_rows) if self.archive_dir else None
+            tables = {}
+            try:
+                for policy in self.policies:
+                    tables[policy.name] = self._purge(policy, now - policy.ttl, segments)
+            finally:
+                if segments is not None:
+                    segments.close()
+                self._release_lease()
+            run = {
+                'started_at': now.isoformat(),
+                'seconds': round(time.perf_counter() - started, 3),
+                'tables': tables,
+                'segments': segments.paths if segments is not None else [],
+            }
+            self._stats['runs'] += 1
+            self._stats['last_run'] = run
+            for name, metrics in tables.items():
+                total = self._stats['totals'].setdefault(name, {'deleted': 0, 'archived': 0})
+                total['deleted'] += metrics['deleted']
+                total['archived'] += metrics['archived']
+            return run
+
+    def _purge(self, policy: RetentionPolicy, cutoff: datetime, segments: Optional[SegmentWriter]) -> Dict:
+        table = policy.model.__table__
+        archive = policy.archive and segments is not None
+        columns = [table] if archive else [table.c.id]
+        metrics = {'cutoff': cutoff.isoformat(), 'deleted': 0, 'archived': 0, 'batches': 0}
+        started = time.perf_counter()
+        last_id = 0
+        while not self._stop.is_set():
+            rows = db.session.execute(
+                select(*columns).where(table.c.timestamp < cutoff, table.c.id > last_id)
+                .order_by(table.c.id).limit(self.batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+            ids = [r['id'] for r in rows]
+            last_id = ids[-1]
+            if archive:
+                segments.write(table.name, [dict(r) for r in rows])
+                metrics['archived'] += len(rows)
+            deleted = db.session.execute(table.delete().where(table.c.id.in_(ids))).rowcount
+            if policy.model is AttackLog and deleted:
+                bump_log_version()
+            db.session.commit()
+            metrics['deleted'] += deleted
+            metrics['batches'] += 1
+            if len(rows) < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        metrics['seconds'] = round(time.perf_counter() - started, 3)
+        return metrics
+
+    def _acquire_lease(self) -> bool:
+        # 租约值为到期时间（epoch 秒），过期的租约可被任何进程接管
+        now = time.time()
+        expires = str(now + max(self.interval, 60))
+        taken = Setting.query.filter(
+            Setting.key == LEASE_KEY,
+            db.cast(Setting.value, db.Float) < now,
+        ).update({Setting.value: expires}, synchronize_session=False)
+        if not taken and not Setting.query.filter_by(key=LEASE_KEY).first():
+            db.session.add(Setting(key=LEASE_KEY, value=expires))
+            taken = 1
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()  # 另一进程同时创建了租约
+            return False
+        return bool(taken)
+
+    def _release_lease(self) -> None:
+        Setting.query.filter_by(key=LEASE_KEY).update({Setting.value: '0'}, synchronize_session=False)
+        db.session.commit()
+
+    def get_stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['policies'] = {p.name: {'ttl_s': int(p.ttl.total_seconds()), 'archive': p.archive}
+                             for p in self.policies}
+        stats['archive_dir'] = self.archive_dir
+        stats['interval_s'] = self.interval
+        return stats
+
+
+def get_retention_job(flask_app) -> RetentionJob:
+    """每个应用一个清理任务，保存在 app.extensions['retention']"""
+    job = flask_app.extensions.get('retention')
+    if job is None:
+        config = flask_app.config
+        archive_dir = config.get('RETENTION_ARCHIVE_DIR', 'archive')
+        if archive_dir and not os.path.isabs(archive_dir):
+            archive_dir = os.path.join(flask_app.instance_path, archive_dir)
+        job = RetentionJob(
+            flask_app,
+            [
+                RetentionPolicy('attack_log', AttackLog, timedelta(days=config.get('RETENTION_ATTACK_LOG_DAYS', 90))),
+                RetentionPolicy('auth_login_attempt', AuthLoginAttempt,
+                                timedelta(days=config.get('RETENTION_AUTH_LOGIN_DAYS', 30))),
+                RetentionPolicy('rate_limit_log', RateLimitLog,
+                                timedelta(minutes=config.get('RETENTION_RATE_LIMIT_MINUTES', 60)), archive=False),
+            ],
+            archive_dir=archive_dir or None,
+            batch_size=config.get('RETENTION_BATCH_SIZE', 500),
+            batch_pause_ms=config.get('RETENTION_BATCH_PAUSE_MS', 50),
+            interval_s=config.get('RETENTION_INTERVAL_S', 300),
+            segment_rows=config.get('RETENTION_SEGMENT_ROWS', 50000),
+        )
+        flask_app.extensions['retention'] = job
+        if config.get('RETENTION_ENABLED', True):
+            job.start()
+    return job
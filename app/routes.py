@@ -1,15 +1,44 @@
-from flask import current_app, request, jsonify, render_template, redirect, url_for, flash, make_response, session
-from .models import BannedIP, AttackLog, User, Setting, Comment, VulnerableUser, VulnerableFile, RateLimitLog
+from flask import current_app, request, jsonify, render_template, redirect, url_for, flash, make_response, session, Response, stream_with_context
+from .models import PAYLOAD_FAMILIES, BannedIP, AttackLog, AttackRollup, User, Comment, VulnerableUser, VulnerableFile, RateLimitLog
 from . import db, login_manager
 from flask_login import login_user, logout_user, login_required, current_user
-import ipaddress
 from datetime import datetime, timedelta
 import os
+import json
+import time
 from urllib.parse import urlparse
 from werkzeug.utils import secure_filename
 import uuid
-from .attack_detectors import AttackDetectorManager
+from .attack_detectors import AttackDetectorManager, DetectionPolicy
+from .xss_security import VERDICTS_ENVIRON_KEY
 from . import auth_security
+from .ban_index import get_ban_index, parse_ban_target
+from .settings_service import get_settings
+from .attack_log_writer import get_attack_log_writer
+from .stats_cache import get_stats_cache
+from .conditional import conditional, current_data_version
+from .event_bus import get_event_bus
+from .log_search import get_log_search
+from .log_archive import get_log_archive, merge_newest
+from .retention import get_retention_job
+from .log_export import EXPORT_FORMATS, apply_filters, export_stream, parse_filters, serialize_log
+
+# 端点检测策略：未列出的端点使用 DEFAULT_DETECTION_POLICY（仅检测 XSS，命中即拦截）
+# 攻击靶场端点只运行对应检测器，并由路由根据 defense_enabled 自行决定拦截
+DEFAULT_DETECTION_POLICY = DetectionPolicy(detectors=('xss',))
+ENDPOINT_DETECTION_POLICIES = {
+    'sqli_search': DetectionPolicy(detectors=('sqli',), fields=('json:query',), max_chars=2048, mode='log'),
+    'cmdi_ping': DetectionPolicy(detectors=('cmdi',), fields=('json:target',), max_chars=2048, mode='log'),
+    'path_view': DetectionPolicy(detectors=('path_traversal',), fields=('json:filepath',), max_chars=2048, mode='log'),
+    'xss_reflected': DetectionPolicy(detectors=('xss',), fields=('query:q',), max_chars=4096),
+    # 上传接口：multipart 文本字段全部检测，文件内容由 _validate_upload_file 校验；
+    # 非 multipart 请求体最多扫描 64KB，超出时拒绝
+    'upload_mascot': DetectionPolicy(detectors=('xss',), max_body_bytes=64 * 1024),
+    'upload_test_bg': DetectionPolicy(detectors=('xss',), max_body_bytes=64 * 1024),
+    'upload_dashboard_bg': DetectionPolicy(detectors=('xss',), max_body_bytes=64 * 1024),
+    # 日志检索的关键字本身就是攻击载荷，不检测
+    'api_attack_logs': DetectionPolicy(detectors=(), mode='log'),
+}
 
 # 允许上传的图片格式
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
@@ -288,7 +317,7 @@ def init_routes(app):
 
     @app.route('/test_xss', methods=['POST'])
     def test_xss_api():
-        data = request.get_json() or {}
+        data = json_body() or {}
         payload = data.get('input', '')
         return jsonify({"message": f"已接收: {payload}"})
 
@@ -302,7 +331,7 @@ def init_routes(app):
     def xss_stored():
         """存储型 XSS：评论保存到数据库后展示"""
         if request.method == 'POST':
-            data = request.get_json() or {}
+            data = json_body() or {}
             content = data.get('content', '')
             author = data.get('author', '匿名')
             if content:
@@ -390,53 +419,54 @@ def init_routes(app):
         url = _find_static_img_by_prefix(app, 'dashboard_bg')
         return jsonify({"dashboard_bg_url": url})
 
+    def _utc_today():
+        # 趋势图按天滚动，日期变化时 ETag 也随之变化
+        return datetime.utcnow().date().isoformat()
+
     @app.route('/api/stats/attacks')
+    @conditional('logs', extra=_utc_today)
     def api_attack_trend():
         end = datetime.utcnow().date()
         start = end - timedelta(days=13)
         days = [(start + timedelta(days=i)) for i in range(14)]
         counts = {d.isoformat(): 0 for d in days}
         rows = db.session.query(
-            db.func.date(AttackLog.timestamp).label('d'),
-            db.func.count(AttackLog.id)
-        ).filter(AttackLog.timestamp >= start).group_by('d').all()
+            AttackRollup.bucket,
+            AttackRollup.events()
+        ).filter(AttackRollup.granularity == 'day', AttackRollup.bucket >= start).group_by(AttackRollup.bucket).all()
         for d, c in rows:
-            counts[str(d)] = c
+            counts[d.date().isoformat()] = int(c)
         return jsonify({"labels": list(counts.keys()), "data": list(counts.values())})
 
     @app.route('/api/stats/types')
+    @conditional('logs')
     def api_attack_types():
-        rows = db.session.query(AttackLog.payload).all()
-        types = {"script":0, "alert":0, "javascript":0, "others":0}
-        import re
-        for (p,) in rows:
-            if not p: 
-                continue
-            pl = p.lower()
-            if re.search(r'<script', pl):
-                types["script"] += 1
-            elif 'alert' in pl:
-                types["alert"] += 1
-            elif 'javascript:' in pl:
-                types["javascript"] += 1
-            else:
-                types["others"] += 1
+        types = {family: 0 for family in PAYLOAD_FAMILIES}
+        rows = db.session.query(
+            AttackLog.payload_family,
+            AttackLog.events()
+        ).filter(AttackLog.payload_family.isnot(None)).group_by(AttackLog.payload_family).all()
+        for family, c in rows:
+            types[family] = int(c)
         return jsonify({"labels": list(types.keys()), "data": list(types.values())})
 
     @app.route('/api/stats/top_ips')
     @login_required
+    @conditional('logs')
     def api_top_ips():
         rows = db.session.query(
-            AttackLog.ip,
-            db.func.count(AttackLog.id).label('cnt')
-        ).group_by(AttackLog.ip).order_by(db.desc('cnt')).limit(10).all()
+            AttackRollup.ip,
+            AttackRollup.events().label('cnt')
+        ).filter(AttackRollup.granularity == 'day').group_by(AttackRollup.ip).order_by(db.desc('cnt')).limit(10).all()
         return jsonify({"labels": [r[0] for r in rows], "data": [int(r[1]) for r in rows]})
 
     @app.route('/api/stats/summary')
     @login_required
+    @conditional('logs', 'bans')
     def api_summary():
-        total = db.session.query(db.func.count(AttackLog.id)).scalar() or 0
-        blocked = db.session.query(db.func.count(AttackLog.id)).filter(AttackLog.blocked == True).scalar() or 0
+        daily = db.session.query(AttackRollup.events()).filter(AttackRollup.granularity == 'day')
+        total = daily.scalar() or 0
+        blocked = daily.filter(AttackRollup.blocked == True).scalar() or 0
         banned = db.session.query(db.func.count(BannedIP.id)).scalar() or 0
         return jsonify({
             "total_attacks": int(total),
@@ -446,34 +476,33 @@ def init_routes(app):
 
     @app.route('/logs')
     @login_required
+    @conditional('logs')
     def get_logs():
         logs = AttackLog.query.order_by(AttackLog.timestamp.desc()).limit(50).all()
-        return jsonify([{'ip':l.ip,'payload':l.payload,'time':l.timestamp.isoformat(),'blocked':l.blocked} for l in logs])
+        return jsonify([{'ip':l.ip,'payload':l.payload,'time':l.timestamp.isoformat(),'blocked':l.blocked,'count':l.count or 1} for l in logs])
+
+    settings = get_settings(app)
 
     @app.route('/toggle_defense', methods=['POST'])
     @login_required
     def toggle_defense():
         data = request.get_json() or {}
         enable = bool(data.get('enabled', True))
-        with app.app_context():
-            s = Setting.query.filter_by(key='xss_defense_enabled').first()
-            if not s:
-                s = Setting(key='xss_defense_enabled', value='1' if enable else '0')
-                db.session.add(s)
-            else:
-                s.value = '1' if enable else '0'
-            db.session.commit()
+        settings.set_bool('xss_defense_enabled', enable)
         return jsonify({"enabled": enable})
 
     @app.route('/api/stats/ip_distribution')
     @login_required
+    @conditional('logs')
     def api_ip_distribution():
         # 返回 top 20 IP 源及次数
         rows = db.session.query(
-            AttackLog.ip,
-            db.func.count(AttackLog.id).label('cnt')
-        ).group_by(AttackLog.ip).order_by(db.desc('cnt')).limit(20).all()
-        return jsonify({"labels":[r[0] for r in rows], "data":[r[1] for r in rows]})
+            AttackRollup.ip,
+            AttackRollup.events().label('cnt')
+        ).filter(AttackRollup.granularity == 'day').group_by(AttackRollup.ip).order_by(db.desc('cnt')).limit(20).all()
+        return jsonify({"labels":[r[0] for r in rows], "data":[int(r[1]) for r in rows]})
+
+    ban_index = get_ban_index(app)
 
     @app.route('/ban_ip', methods=['POST'])
     @login_required
@@ -484,26 +513,29 @@ def init_routes(app):
         permanent = bool(data.get('permanent', False))
         if not ip:
             return jsonify({"error":"missing ip"}), 400
+        # 支持单个地址、CIDR 网段（10.0.0.0/16）和地址区间（10.0.0.1-10.0.3.255）
         try:
-            ipaddress.ip_address(ip)
-        except Exception as e:
+            targets = parse_ban_target(ip)
+        except ValueError:
             return jsonify({"error":"invalid ip"}), 400
         with app.app_context():
-            existing = BannedIP.query.filter_by(ip=ip).first()
             expires_at = None
             if duration_minutes:
                 try:
                     expires_at = datetime.utcnow() + timedelta(minutes=int(duration_minutes))
                 except Exception:
                     expires_at = None
-            if existing:
-                existing.permanent = permanent
-                existing.expires_at = expires_at
-            else:
-                ban = BannedIP(ip=ip, permanent=permanent, expires_at=expires_at)
-                db.session.add(ban)
+            existing = {b.ip: b for b in BannedIP.query.filter(BannedIP.ip.in_(targets)).all()}
+            for target in targets:
+                if target in existing:
+                    existing[target].permanent = permanent
+                    existing[target].expires_at = expires_at
+                else:
+                    db.session.add(BannedIP(ip=target, permanent=permanent, expires_at=expires_at))
+            ban_index.bump_version()
             db.session.commit()
-        return jsonify({"status":"ok"})
+        ban_index.invalidate()
+        return jsonify({"status":"ok", "banned": targets})
 
     @app.route('/unban_ip', methods=['POST'])
     @login_required
@@ -512,14 +544,21 @@ def init_routes(app):
         ip = data.get('ip')
         if not ip:
             return jsonify({"error":"missing ip"}), 400
+        try:
+            targets = parse_ban_target(ip)
+        except ValueError:
+            targets = [ip]
         with app.app_context():
-            b = BannedIP.query.filter_by(ip=ip).first()
-            if b:
-                db.session.delete(b); db.session.commit()
+            deleted = BannedIP.query.filter(BannedIP.ip.in_(targets)).delete(synchronize_session=False)
+            if deleted:
+                ban_index.bump_version()
+                db.session.commit()
+                ban_index.invalidate()
         return jsonify({"status":"ok"})
 
     @app.route('/get_banned_ips')
     @login_required
+    @conditional('bans')
     def get_banned_ips():
         rows = BannedIP.query.order_by(BannedIP.banned_at.desc()).all()
         def serialize(r):
@@ -577,6 +616,100 @@ def init_routes(app):
 
     # 攻击测试中心路由
     detector_manager = AttackDetectorManager(app, db)
+    # 中间件复用同一个检测管理器
+    app.extensions['detector_manager'] = detector_manager
+    # 攻击日志由后台线程批量写入
+    attack_log_writer = get_attack_log_writer(app)
+    # 仪表盘统计的短 TTL 共享缓存
+    stats_cache = get_stats_cache(app)
+
+    @app.route('/api/detector/stats')
+    @login_required
+    def api_detector_stats():
+        """检测引擎各阶段计数（预过滤跳过率等）"""
+        return jsonify(detector_manager.get_stats())
+
+    @app.route('/api/log_writer/stats')
+    @login_required
+    def api_log_writer_stats():
+        """攻击日志写入队列深度、丢弃/合并计数"""
+        return jsonify(attack_log_writer.get_stats())
+
+    event_bus = get_event_bus(app)
+    # 攻击日志全文检索（SQLite FTS5，不可用时退回 ILIKE）
+    log_search = get_log_search(app)
+    # 保留期归档段（冷数据层），日志列表与导出在时间范围较早时一并查询
+    log_archive = get_log_archive(app)
+    # 过期日志的后台归档与分批清理
+    retention_job = get_retention_job(app)
+
+    @app.route('/api/events/stream')
+    @login_required
+    def api_events_stream():
+        """
+        实时攻击事件（Server-Sent Events）
+        可选参数：type、severity（逗号分隔，服务端过滤）；断线重连时按 Last-Event-ID 补发
+        连接在 EVENT_STREAM_MAX_LIFETIME_S 秒后由服务端关闭，客户端自动重连
+        """
+        def split(name):
+            return [v.strip() for v in (request.args.get(name) or '').split(',') if v.strip()]
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = -1  # 无法识别的 id 按需要整体刷新处理
+        heartbeat = float(app.config.get('EVENT_STREAM_HEARTBEAT_S', 15))
+        deadline = time.monotonic() + float(app.config.get('EVENT_STREAM_MAX_LIFETIME_S', 300))
+        sub = event_bus.subscribe(last_event_id, types=split('type'), severities=split('severity'))
+
+        def stream():
+            try:
+                yield 'retry: 3000\n\n'
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return  # 到达最长连接时间，客户端按 retry 间隔带 Last-Event-ID 重连
+                    events, dropped, reset = sub.get(timeout=min(heartbeat, remaining))
+                    if reset:
+                        yield f'event: reset\ndata: {json.dumps({"last_id": event_bus.last_id})}\n\n'
+                    if dropped:
+                        yield f'event: gap\ndata: {json.dumps({"dropped": dropped})}\n\n'
+                    for e in events:
+                        yield f'id: {e["id"]}\nevent: attack\ndata: {json.dumps(e, ensure_ascii=False)}\n\n'
+                    if not (events or dropped or reset):
+                        yield ': heartbeat\n\n'
+            finally:
+                event_bus.unsubscribe(sub)
+
+        rv = Response(stream(), mimetype='text/event-stream')
+        rv.headers['Cache-Control'] = 'no-cache'
+        rv.headers['X-Accel-Buffering'] = 'no'  # 关闭 nginx 缓冲
+        return rv
+
+    @app.route('/api/attack/search/stats')
+    @login_required
+    def api_attack_search_stats():
+        """全文检索是否可用、检索/回退次数"""
+        return jsonify(log_search.get_stats())
+
+    @app.route('/api/attack/archive/stats')
+    @login_required
+    def api_attack_archive_stats():
+        """归档段数、行数、时间范围，以及按时间范围/布隆过滤器跳过的段数"""
+        return jsonify(log_archive.get_stats())
+
+    @app.route('/api/events/stats')
+    @login_required
+    def api_events_stats():
+        """事件流订阅者数、推送/丢弃/补发计数"""
+        return jsonify(event_bus.get_stats())
+
+    @app.route('/api/retention/stats')
+    @login_required
+    def api_retention_stats():
+        """保留期策略、最近一轮清理的删除/归档行数与耗时"""
+        return jsonify(retention_job.get_stats())
     
     def simulate_command_injection(target):
         """模拟命令注入执行结果（仅用于演示）"""
@@ -721,10 +854,24 @@ Ethernet adapter Ethernet:
         
         return '\n'.join(output_parts)
     
+    def json_body():
+        """JSON 请求体；中间件已解析过时复用其结果，不再读取、解析回放的请求体"""
+        verdicts = request.environ.get(VERDICTS_ENVIRON_KEY)
+        if verdicts is not None and verdicts.json is not None:
+            return verdicts.json
+        return request.get_json()
+
+    def detect_json_field(name, value):
+        """检测 JSON 请求字段，优先复用中间件已写入 environ 的检测结论"""
+        verdicts = request.environ.get(VERDICTS_ENVIRON_KEY)
+        verdict = verdicts.get('json', name) if verdicts is not None else None
+        policy = getattr(request.url_rule, 'detection_policy', None) or detector_manager.default_policy
+        return detector_manager.detect_or_reuse(value, verdict, policy.ruleset)
+
     def log_attack(ip, payload, attack_info, blocked=True, target_url='', user_agent=''):
         """记录攻击日志"""
         attack = attack_info['attacks'][0] if attack_info.get('attacks') else {}
-        log = AttackLog(
+        attack_log_writer.submit(
             ip=ip,
             payload=payload[:2000],
             blocked=blocked,
@@ -734,31 +881,32 @@ Ethernet adapter Ethernet:
             target_url=target_url[:500],
             user_agent=user_agent[:500]
         )
-        db.session.add(log)
-        db.session.commit()
 
     @app.route('/attack_hub')
     def attack_hub():
         return render_template('attack_hub.html')
 
     @app.route('/api/attack/stats')
+    @conditional('logs')
     def attack_stats():
         """攻击统计API"""
-        total = AttackLog.query.count()
-        blocked = AttackLog.query.filter_by(blocked=True).count()
-        types = db.session.query(AttackLog.attack_type).distinct().count()
+        daily = db.session.query(AttackRollup.events()).filter(AttackRollup.granularity == 'day')
+        total = daily.scalar() or 0
+        blocked = daily.filter(AttackRollup.blocked == True).scalar() or 0
+        types = db.session.query(AttackRollup.attack_type).filter(AttackRollup.granularity == 'day').distinct().count()
         return jsonify({
-            'total': total,
-            'blocked': blocked,
+            'total': int(total),
+            'blocked': int(blocked),
             'types': types
         })
 
     @app.route('/api/attack/type_breakdown')
+    @conditional('logs')
     def api_attack_type_breakdown():
         rows = db.session.query(
-            AttackLog.attack_type,
-            db.func.count(AttackLog.id).label('cnt')
-        ).group_by(AttackLog.attack_type).order_by(db.desc('cnt')).all()
+            AttackRollup.attack_type,
+            AttackRollup.events().label('cnt')
+        ).filter(AttackRollup.granularity == 'day').group_by(AttackRollup.attack_type).order_by(db.desc('cnt')).all()
         labels = []
         data = []
         for t, c in rows:
@@ -767,14 +915,20 @@ Ethernet adapter Ethernet:
         return jsonify({"labels": labels, "data": data})
 
     @app.route('/api/attack/logs')
+    @conditional('logs')
     def api_attack_logs():
+        """
+        攻击日志列表，按 (timestamp, id) 倒序
+        分页：before_id=<上一页最后一行 id> 为游标分页（深翻页代价不随页数增长）；
+        after_ts=<ISO 时间> 只取该时间之后的新日志；offset 分页保留兼容
+        q：全文检索 payload / target_url / user_agent，默认按相关度排序（order=time 或使用游标时按时间）
+        按时间排序的第一页与游标分页同时查询已归档的日志（相关度排序与 offset 分页只查询数据库）；
+        归档扫描达到段数上限时本页可能不满，next_cursor 为 {"before_ts": ...}，与原有筛选参数一起带上继续请求
+        """
         limit = request.args.get('limit')
         offset = request.args.get('offset')
-        attack_type = (request.args.get('type') or '').strip()
-        severity = (request.args.get('severity') or '').strip()
-        blocked = (request.args.get('blocked') or '').strip().lower()
-        ip = (request.args.get('ip') or '').strip()
-        search = (request.args.get('q') or '').strip()
+        before_id = (request.args.get('before_id') or '').strip()
+        order = (request.args.get('order') or '').strip().lower()
 
         try:
             n = int(limit) if limit else 50
@@ -788,62 +942,129 @@ Ethernet adapter Ethernet:
         n = max(1, min(n, 200))
         o = max(0, o)
 
-        qset = AttackLog.query
-        if attack_type:
-            qset = qset.filter(AttackLog.attack_type == attack_type)
-        if severity:
-            qset = qset.filter(AttackLog.severity == severity)
-        if blocked in ('true', 'false'):
-            qset = qset.filter(AttackLog.blocked == (blocked == 'true'))
-        if ip:
-            qset = qset.filter(AttackLog.ip == ip)
-        if search:
-            qset = qset.filter(AttackLog.payload.ilike(f"%{search}%"))
-
-        rows = qset.order_by(AttackLog.timestamp.desc()).offset(o).limit(n).all()
+        try:
+            before_id = int(before_id) if before_id else None
+            filters = parse_filters(request.args)
+        except ValueError:
+            return jsonify({"error": "before_id 或 after_ts 格式错误"}), 400
+
+        qset, fts = apply_filters(AttackLog.query, filters, log_search)
+        by_rank = fts is not None and order != 'time' and before_id is None and filters['after_ts'] is None
+
+        cursor = None
+        if before_id is not None:
+            # 游标为 (timestamp, id)：取游标行之后（更旧）的行，可直接沿复合索引继续扫描
+            cursor_ts = db.session.query(AttackLog.timestamp).filter(AttackLog.id == before_id).scalar()
+            if cursor_ts is None:
+                cursor_ts = log_archive.lookup_timestamp(before_id)  # 游标行已归档
+            if cursor_ts is None:
+                qset = qset.filter(AttackLog.id < before_id)  # 游标行已不存在，退化为按 id
+            else:
+                cursor = (cursor_ts, before_id)
+                qset = qset.filter(db.tuple_(AttackLog.timestamp, AttackLog.id) < cursor)
+            o = 0
+
+        if by_rank:
+            qset = qset.order_by(fts.c.rank, AttackLog.timestamp.desc(), AttackLog.id.desc())
+        else:
+            qset = qset.order_by(AttackLog.timestamp.desc(), AttackLog.id.desc())
+        rows = qset.offset(o).limit(n).all()
+        resume = None
+        if not by_rank and o == 0:
+            # 只需要归档中比本页最后一行更新的行；本页不满时不设下界
+            floor = (rows[-1].timestamp, rows[-1].id) if len(rows) == n else None
+            cold, resume = log_archive.newest(filters, n, before=cursor, floor=floor,
+                                              below_id=before_id if cursor is None else None,
+                                              max_segments=app.config.get('ARCHIVE_QUERY_MAX_SEGMENTS', 16))
+            if cold:
+                rows = merge_newest(rows, cold, n)
+            if resume is not None:
+                # 归档只扫描到 resume，更早的行（两层）留给续查
+                rows = [r for r in rows if (r.timestamp or datetime.min) > resume]
+        # 相关度排序只支持 offset 分页
+        next_cursor = {"before_id": int(rows[-1].id)} if len(rows) == n and not by_rank else None
+        if next_cursor is None and resume is not None:
+            # 本页未满但归档还有未扫描的段：与原有筛选参数一起带上 before_ts（及 before_id）继续请求
+            next_cursor = {"before_ts": (resume + timedelta(microseconds=1)).isoformat()}
+            if before_id is not None:
+                next_cursor["before_id"] = before_id
         return jsonify({
-            "logs": [
-                {
-                    "id": int(l.id),
-                    "ip": l.ip,
-                    "payload": l.payload,
-                    "time": l.timestamp.isoformat(),
-                    "blocked": bool(l.blocked),
-                    "attack_type": l.attack_type,
-                    "attack_category": l.attack_category,
-                    "severity": l.severity,
-                    "target_url": l.target_url,
-                    "user_agent": l.user_agent,
-                }
-                for l in rows
-            ]
+            "next_cursor": next_cursor,
+            "logs": [serialize_log(l) for l in rows]
         })
 
+    @app.route('/api/attack/logs/export')
+    @login_required
+    def api_attack_logs_export():
+        """
+        流式导出攻击日志（筛选参数同 /api/attack/logs，另支持 before_ts）
+        format=ndjson|csv，gzip=1 输出 .gz 文件，limit 可选（默认不限）
+        """
+        fmt = (request.args.get('format') or 'ndjson').strip().lower()
+        compress = (request.args.get('gzip') or '').strip().lower() in ('1', 'true', 'yes')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": f"format 仅支持 {', '.join(EXPORT_FORMATS)}"}), 400
+        try:
+            filters = parse_filters(request.args)
+            limit = int(request.args['limit']) if request.args.get('limit') else None
+        except ValueError:
+            return jsonify({"error": "after_ts / before_ts / limit 格式错误"}), 400
+
+        body = export_stream(fmt, filters, log_search=log_search, compress=compress,
+                             batch_size=app.config.get('ATTACK_LOG_EXPORT_BATCH_SIZE', 1000), limit=limit,
+                             archive=log_archive)
+        filename = f"attack_logs_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{fmt}"
+        if compress:
+            filename += '.gz'
+        mimetype = 'application/gzip' if compress else (
+            'application/x-ndjson' if fmt == 'ndjson' else 'text/csv')
+        # 生成器在视图返回后才执行查询，需要保留请求/应用上下文
+        rv = Response(stream_with_context(body), mimetype=mimetype)
+        rv.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        rv.headers['X-Accel-Buffering'] = 'no'
+        return rv
+
     @app.route('/api/dashboard/stats', methods=['GET'])
     @login_required
+    @conditional('logs')
     def dashboard_stats_api():
-        """为 3D 仪表盘提供实时统计数据"""
-        total_attacks = AttackLog.query.count()
-        blocked_count = AttackLog.query.filter_by(blocked=True).count()
+        """为 3D 仪表盘提供实时统计数据（TTL 内多个仪表盘共享同一次计算）"""
+        # 以 ETag 所用的日志版本为缓存版本：返回的内容一定与 ETag 对应
+        return jsonify(stats_cache.get_or_compute('dashboard_stats', _compute_dashboard_stats,
+                                                  version=current_data_version()))
+
+    def _compute_dashboard_stats():
+        # 一条条件聚合查询，读取天粒度 rollup
+        def events_where(cond):
+            return db.func.coalesce(db.func.sum(db.case((cond, AttackRollup.count), else_=0)), 0)
+
+        row = db.session.query(
+            AttackRollup.events(),
+            events_where(AttackRollup.blocked == True),
+            events_where(AttackRollup.attack_type.ilike('%sql%')),
+            events_where(AttackRollup.attack_type.ilike('%xss%')),
+            events_where(AttackRollup.attack_type.ilike('%cmd%')),
+            events_where(AttackRollup.attack_type.ilike('%path%')),
+        ).filter(AttackRollup.granularity == 'day').one()
+        total_attacks, blocked_count, sqli, xss, cmdi, path = (int(v or 0) for v in row)
 
         success_rate = 0
         if total_attacks > 0:
             success_rate = round((blocked_count / total_attacks) * 100, 1)
 
-        type_counts = {
-            'sqli': AttackLog.query.filter(AttackLog.attack_type.ilike('%sql%')).count(),
-            'xss': AttackLog.query.filter(AttackLog.attack_type.ilike('%xss%')).count(),
-            'cmdi': AttackLog.query.filter(AttackLog.attack_type.ilike('%cmd%')).count(),
-            'path': AttackLog.query.filter(AttackLog.attack_type.ilike('%path%')).count(),
-        }
-
-        return jsonify({
+        return {
             'total_attacks': total_attacks,
             'blocked_attacks': blocked_count,
             'success_rate': success_rate,
             'attack_types_count': 4,
-            'details': type_counts
-        })
+            'details': {'sqli': sqli, 'xss': xss, 'cmdi': cmdi, 'path': path}
+        }
+
+    @app.route('/api/stats/cache')
+    @login_required
+    def api_stats_cache():
+        """统计缓存命中/未命中计数"""
+        return jsonify(stats_cache.get_stats())
 
     @app.route('/test_sqli')
     def test_sqli():
@@ -865,7 +1086,7 @@ Ethernet adapter Ethernet:
     def sqli_search():
         """SQL注入搜索测试"""
         try:
-            data = request.get_json() or {}
+            data = json_body() or {}
             query = data.get('query', '')
             defense_enabled = data.get('defense_enabled', True)
             simulated_ip = data.get('simulated_ip', '')
@@ -873,7 +1094,7 @@ Ethernet adapter Ethernet:
             ip = simulated_ip if simulated_ip else request.remote_addr
 
             if defense_enabled:
-                detection = detector_manager.detect_all(query)
+                detection = detect_json_field('query', query)
 
                 if detection['detected']:
                     attack_info = detection['attacks'][0]
@@ -886,7 +1107,7 @@ Ethernet adapter Ethernet:
                         'category': attack_info['category']
                     })
             else:
-                detection = detector_manager.detect_all(query)
+                detection = detect_json_field('query', query)
                 if detection['detected']:
                     attack_info = detection['attacks'][0]
                     log_attack(ip, query, detection, blocked=False, target_url=request.path, user_agent=request.headers.get('User-Agent', ''))
@@ -976,7 +1197,7 @@ Ethernet adapter Ethernet:
     def cmdi_ping():
         """命令注入Ping测试"""
         try:
-            data = request.get_json() or {}
+            data = json_body() or {}
             target = data.get('target', '')
             defense_enabled = data.get('defense_enabled', True)
             simulated_ip = data.get('simulated_ip', '')
@@ -984,7 +1205,7 @@ Ethernet adapter Ethernet:
             ip = simulated_ip if simulated_ip else request.remote_addr
             
             if defense_enabled:
-                detection = detector_manager.detect_all(target)
+                detection = detect_json_field('target', target)
                 
                 if detection['detected']:
                     attack_info = detection['attacks'][0]
@@ -998,7 +1219,7 @@ Ethernet adapter Ethernet:
                     })
             else:
                 import re
-                detection = detector_manager.detect_all(target)
+                detection = detect_json_field('target', target)
 
                 looks_injected = bool(re.search(r'(;|\||&&|\|\||`|\$\(\))', target))
 
@@ -1049,7 +1270,7 @@ Ethernet adapter Ethernet:
     def path_view():
         """目录遍历文件查看测试"""
         try:
-            data = request.get_json() or {}
+            data = json_body() or {}
             filepath = data.get('filepath', '')
             defense_enabled = data.get('defense_enabled', True)
             simulated_ip = data.get('simulated_ip', '')
@@ -1057,7 +1278,7 @@ Ethernet adapter Ethernet:
             ip = simulated_ip if simulated_ip else request.remote_addr
             
             if defense_enabled:
-                detection = detector_manager.detect_all(filepath)
+                detection = detect_json_field('filepath', filepath)
                 
                 if detection['detected']:
                     attack_info = detection['attacks'][0]
@@ -1070,7 +1291,7 @@ Ethernet adapter Ethernet:
                         'category': attack_info['category']
                     })
             else:
-                detection = detector_manager.detect_all(filepath)
+                detection = detect_json_field('filepath', filepath)
                 if detection['detected']:
                     attack_info = detection['attacks'][0]
                     log_attack(ip, filepath, detection, blocked=False, target_url=request.path, user_agent=request.headers.get('User-Agent', ''))
@@ -1095,4 +1316,7 @@ Ethernet adapter Ethernet:
         except Exception as e:
             import traceback
             traceback.print_exc()
-            return jsonify({'error': f'服务器错误: {str(e)}'}), 500
\ No newline at end of file
+            return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+
+    # 所有路由注册完毕后编译端点检测策略
+    detector_manager.compile_policies(app.url_map, ENDPOINT_DETECTION_POLICIES, DEFAULT_DETECTION_POLICY)
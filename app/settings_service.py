@@ -0,0 +1,122 @@
+"""
+设置快照服务
+把 Setting 表整体加载为只读快照，请求路径上的开关读取（防御开关、认证安全开关等）直接读内存。
+
+一致性：
+- 通过 set() 写入时在同一事务中递增 settings_version，提交后本进程立即重新加载（推送）；
+- 其他进程最多每 SETTINGS_POLL_MS 毫秒读取一次 settings_version，变化时重新加载整张表，
+  因此开关切换在有界延迟内对所有 worker 生效。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from . import db
+from .models import Setting
+
+SETTINGS_VERSION_KEY = 'settings_version'
+
+_TRUE_VALUES = ('1', 'true', 'True', 'yes', 'on')
+
+
+def bump_version(key: str = SETTINGS_VERSION_KEY) -> None:
+    """
+    在当前会话中原子递增 Setting 中的计数器（UPDATE ... SET value = value + 1），随调用方的事务一起提交
+    """
+    updated = Setting.query.filter_by(key=key).update(
+        {Setting.value: db.cast(db.func.coalesce(db.cast(Setting.value, db.Integer), 0) + 1, db.String)},
+        synchronize_session=False,
+    )
+    if not updated:
+        db.session.add(Setting(key=key, value='1'))
+
+
+class SettingsService:
+
+    def __init__(self, flask_app, poll_ms: int = 1000):
+        self.flask_app = flask_app
+        self.poll_interval = max(0, int(poll_ms)) / 1000.0
+        self._snapshot: Mapping[str, Optional[str]] = MappingProxyType({})
+        self._next_poll = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        # 读取路径上的计数不加锁，仅作参考
+        self._stats = {'reads': 0, 'polls': 0, 'reloads': 0, 'writes': 0}
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.snapshot().get(SETTINGS_VERSION_KEY)
+
+    def snapshot(self) -> Mapping[str, Optional[str]]:
+        if self._dirty or time.monotonic() >= self._next_poll:
+            self.refresh(wait=self._dirty)
+        self._stats['reads'] += 1
+        return self._snapshot
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        value = self.snapshot().get(key)
+        return default if value is None else value
+
+    def get_bool(self, key: str, default: bool = True) -> bool:
+        value = self.snapshot().get(key)
+        if value is None:
+            return default
+        return str(value).strip() in _TRUE_VALUES
+
+    def set(self, key: str, value: str) -> None:
+        """写入设置并递增版本号；提交后本进程立即重新加载"""
+        with self.flask_app.app_context():
+            s = Setting.query.filter_by(key=key).first()
+            if not s:
+                db.session.add(Setting(key=key, value=value))
+            else:
+                s.value = value
+            bump_version()
+            db.session.commit()
+        self._stats['writes'] += 1
+        self.invalidate()
+
+    def set_bool(self, key: str, enabled: bool) -> None:
+        self.set(key, '1' if enabled else '0')
+
+    def invalidate(self) -> None:
+        self._dirty = True
+
+    def refresh(self, wait: bool = False) -> None:
+        """读取版本号，变化（或本进程已标记失效）时重新加载整张表；同一时刻只有一个线程执行"""
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            if not self._dirty and time.monotonic() < self._next_poll:
+                return  # 等锁期间已由其他线程刷新
+            dirty, self._dirty = self._dirty, False
+            self._next_poll = time.monotonic() + self.poll_interval
+            with self.flask_app.app_context():
+                self._stats['polls'] += 1
+                if not dirty:
+                    row = db.session.query(Setting.value).filter_by(key=SETTINGS_VERSION_KEY).first()
+                    if (row[0] if row else None) == self._snapshot.get(SETTINGS_VERSION_KEY):
+                        return
+                rows = db.session.query(Setting.key, Setting.value).all()
+                self._snapshot = MappingProxyType(dict(rows))
+                self._stats['reloads'] += 1
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['version'] = self._snapshot.get(SETTINGS_VERSION_KEY)
+        stats['keys'] = len(self._snapshot)
+        return stats
+
+
+def get_settings(flask_app) -> SettingsService:
+    """每个应用一个设置服务，保存在 app.extensions['settings']"""
+    service = flask_app.extensions.get('settings')
+    if service is None:
+        service = SettingsService(flask_app, poll_ms=flask_app.config.get('SETTINGS_POLL_MS', 1000))
+        flask_app.extensions['settings'] = service
+    return service
@@ -94,6 +94,9 @@
   let selectedAttackType = '';
   let attackLogsCache = [];
   let searchDebounceTimer = null;
+  let liveSummaryTimer = null;
+  let eventSource = null;
+  const LIVE_LOG_LIMIT = 80;
   const ALERT_STORAGE_KEY = 'securityDashboard.alertConfig';
   const defaultAlertConfig = {
     enabled: false,
@@ -170,6 +173,7 @@
     selectedAttackType = (selectedAttackType === t) ? '' : t;
     setTypeFilterLabel();
     loadAttackLogs().catch(()=>{});
+    connectEventStream();
   }
 
   function escapeHtml(s){
@@ -307,14 +311,7 @@
     showAlertBanner('', 'danger');
   }
 
-  async function loadAll(){
-    try{
-      await ensureChart();
-    }catch(e){
-      // 已在 ensureChart 中 debug
-      return;
-    }
-
+  async function loadSummary(){
     try{
       const s = await fetchJson('/api/stats/summary');
       const totalEl = document.getElementById('metricTotal');
@@ -326,6 +323,51 @@
     }catch(e){
       debug('/api/stats/summary 获取失败：' + e.message);
     }
+  }
+
+  // 实时事件流：新攻击直接插入表格，汇总数字去抖后刷新（服务端 ETag 使重复请求很便宜）
+  function onLiveAttack(ev){
+    let e;
+    try{
+      e = JSON.parse(ev.data);
+    }catch(_e){
+      return;
+    }
+    const q = (document.getElementById('attackLogSearch')?.value || '').trim();
+    if(!q){
+      attackLogsCache = [e, ...attackLogsCache].slice(0, LIVE_LOG_LIMIT);
+      renderAttackLogsTable(attackLogsCache);
+      evaluateAlert();
+    }
+    if(liveSummaryTimer) return;
+    liveSummaryTimer = window.setTimeout(()=>{
+      liveSummaryTimer = null;
+      loadSummary();
+    }, 2000);
+  }
+
+  function connectEventStream(){
+    if(!window.EventSource) return;
+    if(eventSource) eventSource.close();
+    const u = new URL('/api/events/stream', window.location.origin);
+    if(selectedAttackType) u.searchParams.set('type', selectedAttackType);
+    eventSource = new EventSource(u.pathname + u.search, { withCredentials: true });
+    eventSource.addEventListener('attack', onLiveAttack);
+    // 错过的事件无法补发（或客户端过慢被丢弃）时整体重新加载
+    eventSource.addEventListener('reset', ()=>{ loadAttackLogs().catch(()=>{}); loadSummary(); });
+    eventSource.addEventListener('gap', ()=>{ loadAttackLogs().catch(()=>{}); });
+    eventSource.onerror = ()=> debug('实时事件流断开，浏览器将自动重连');
+  }
+
+  async function loadAll(){
+    try{
+      await ensureChart();
+    }catch(e){
+      // 已在 ensureChart 中 debug
+      return;
+    }
+
+    await loadSummary();
 
     try{
       const trend = await fetchJson('/api/stats/attacks');
@@ -369,6 +411,7 @@
     loadAlertConfig();
     syncAlertForm();
     await loadAttackLogs();
+    connectEventStream();
   }
 
   document.getElementById('refresh')?.addEventListener('click', loadAll);
@@ -410,6 +453,7 @@
     selectedAttackType = '';
     setTypeFilterLabel();
     loadAttackLogs().catch(()=>{});
+    connectEventStream();
   });
 
   document.getElementById('btnReloadAttackLogs')?.addEventListener('click', ()=>{
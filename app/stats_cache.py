@@ -0,0 +1,105 @@
+"""
+统计结果共享缓存
+仪表盘会被多人长时间打开并定时轮询，统计接口的结果在 TTL 内直接复用。
+
+single-flight：缓存过期时只有一个请求（leader）执行计算，其余并发请求
+- 有旧值时直接返回旧值（不等待）；
+- 没有旧值时等待 leader 的结果。
+因此 N 个并发仪表盘每个 TTL 周期最多触发一次计算。
+
+version：结果所依赖的数据版本（通常为 conditional.current_data_version()，与 ETag 同源）。
+缓存值只在版本相同时复用（包括过期旧值），数据变化后第一个请求即重新计算，
+不会把旧数据配上新 ETag 返回给客户端。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class StatsCache:
+
+    def __init__(self, ttl_ms: int = 2000):
+        self.ttl = max(0, int(ttl_ms)) / 1000.0
+        # key -> (过期时间, 值, 数据版本)
+        self._entries: Dict[Hashable, tuple] = {}
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale_hits': 0, 'coalesced': 0, 'errors': 0}
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], version: Hashable = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] != version:
+                entry = None  # 数据已变化，旧值不可再用
+            if entry is not None and entry[0] > time.monotonic():
+                self._stats['hits'] += 1
+                return entry[1]
+            flight = self._flights.get((key, version))
+            leader = flight is None
+            if leader:
+                flight = self._flights[(key, version)] = _Flight()
+                self._stats['misses'] += 1
+            elif entry is not None:
+                # 已有请求在重新计算，先返回旧值
+                self._stats['stale_hits'] += 1
+                return entry[1]
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as exc:
+            flight.error = exc
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._entries[key] = (time.monotonic() + self.ttl, flight.value, version)
+                del self._flights[(key, version)]
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['in_flight'] = len(self._flights)
+        lookups = stats['hits'] + stats['misses'] + stats['stale_hits'] + stats['coalesced']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        stats['ttl_ms'] = int(self.ttl * 1000)
+        return stats
+
+
+def get_stats_cache(flask_app) -> StatsCache:
+    """每个应用一个统计缓存，保存在 app.extensions['stats_cache']"""
+    cache = flask_app.extensions.get('stats_cache')
+    if cache is None:
+        cache = StatsCache(ttl_ms=flask_app.config.get('STATS_CACHE_TTL_MS', 2000))
+        flask_app.extensions['stats_cache'] = cache
+    return cache
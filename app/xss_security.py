@@ -1,76 +1,393 @@
+import io
 import re
+import json
+import codecs
+import hashlib
 import logging
-from io import BytesIO
+import tempfile
+import threading
 from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl
 from flask import jsonify
-from .models import AttackLog, BannedIP, Setting
-from . import db
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, MultipartDecoder, NeedData
+from .ban_index import get_ban_index
+from .settings_service import get_settings
+from .attack_log_writer import get_attack_log_writer
+from .attack_detectors import AttackDetectorManager, Canonicalizer, DetectionCache, optimize_pattern
 from datetime import datetime
 
 class XSSDetector:
     xss_patterns = [
         r'<script[^>]*>.*?</script>',
         r'javascript\s*:',
-        r'on\w+\s*=',
+        r'<[^>]*\bon[a-z]+\s*=',
         r'alert\s*\(',
         r'eval\s*\(',
     ]
+    # 安全模式：改写会灾难性回溯的量词（见 attack_detectors.optimize_pattern）
+    safe_mode = False
+    max_repeat = 128
+    max_scan_chars = 512 * 1024
+    _compiled = None
+    _compiled_for = None
+    _version = ''
+    _cache = DetectionCache(max_entries=2048, max_bytes=1024 * 1024)
+    # 匹配前先做 URL/HTML 实体解码与 NFKC 归一化，%3Cscript、&#x3c;script、全角＜script 均可识别
+    _canonicalizer = Canonicalizer()
 
     @classmethod
-    def detect_xss_patterns(cls, content: str) -> bool:
+    def configure(cls, safe_mode: bool, max_repeat: int, max_scan_chars: int, url_decode_depth: int = 3) -> None:
+        cls.safe_mode = bool(safe_mode)
+        cls.max_repeat = int(max_repeat)
+        cls.max_scan_chars = int(max_scan_chars)
+        if url_decode_depth != cls._canonicalizer.max_depth:
+            cls._canonicalizer = Canonicalizer(max_depth=url_decode_depth)
+            cls._cache.clear()
+
+    @classmethod
+    def _compiled_patterns(cls):
+        # xss_patterns 或安全模式配置变化时重新编译并清空结果缓存
+        signature = (tuple(cls.xss_patterns), cls.safe_mode, cls.max_repeat)
+        if cls._compiled_for != signature:
+            if cls._compiled_for is not None:
+                cls._cache.clear()
+            compiled = []
+            for p in cls.xss_patterns:
+                rewritten, _ = optimize_pattern(p, cls.safe_mode, cls.max_repeat, re.IGNORECASE | re.DOTALL)
+                if rewritten is None:
+                    logging.warning('安全模式拒绝 XSS 规则 %r', p)
+                    continue
+                compiled.append(re.compile(rewritten, re.IGNORECASE | re.DOTALL))
+            cls._compiled = compiled
+            cls._version = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+            cls._compiled_for = signature
+        return cls._compiled
+
+    @classmethod
+    def detect_xss_patterns(cls, content: str, use_cache: bool = True) -> bool:
         if not content:
             return False
-        for p in cls.xss_patterns:
-            if re.search(p, content, re.IGNORECASE | re.DOTALL):
-                return True
-        return False
+        if cls.safe_mode and len(content) > cls.max_scan_chars:
+            content = content[:cls.max_scan_chars]
+        compiled = cls._compiled_patterns()
+        if not use_cache:
+            text = cls._canonicalizer.normalize(content).text
+            return any(regex.search(text) for regex in compiled)
+        key = DetectionCache.make_key(content, cls._version)
+        cached = cls._cache.get(key)
+        if cached is not None:
+            return cached['detected']
+        text = cls._canonicalizer.normalize(content).text
+        detected = any(regex.search(text) for regex in compiled)
+        cls._cache.put(key, {'detected': detected}, 256)
+        return detected
 
     @staticmethod
     def sanitize_content(content: str) -> str:
         return content.replace('<script>', '').replace('</script>', '').replace('javascript:', '')
 
+
+class ReplayableInput(io.RawIOBase):
+    """
+    交还给下游的 wsgi.input：先读出已扫描部分（SpooledTemporaryFile），再继续读原始输入中未读取的剩余字节
+    """
+
+    def __init__(self, scanned, rest, rest_length: int):
+        super().__init__()
+        scanned.seek(0)
+        self._scanned = scanned
+        self._rest = rest
+        self._rest_length = rest_length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        data = self._scanned.read(size)
+        if not data and self._rest_length > 0:
+            data = self._rest.read(min(size, self._rest_length))
+            self._rest_length -= len(data)
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._scanned.close()
+        super().close()
+
+
+class InspectionResult(NamedTuple):
+    blocked: bool
+    excerpt: str         # 命中时所在窗口的文本（用于记录日志）
+    scanned_bytes: int
+    truncated: bool      # 请求体超过 max_scan_bytes，剩余部分未扫描
+    fields: List[Tuple[str, str, str]] = []  # 从请求体提取的文本字段 (来源, 字段名, 值)
+    json: Any = None     # 完整读取并解析成功的 JSON 请求体
+
+
+class BodyInspector:
+    """
+    流式请求体检测
+    按 chunk_size 分块读取 wsgi.input，相邻块之间保留 overlap 个字符的重叠窗口，跨块边界的模式仍能命中；
+    最多扫描 max_scan_bytes 字节，命中即停止读取；超出部分未检测（truncated），拦截模式下由中间件拒绝请求。
+    multipart 不受该上限限制：整个请求体都经过增量解析（文件内容只解析不保留），文件之后的文本字段同样被检测。
+    已读取的字节写入 SpooledTemporaryFile（超过 spool_bytes 落盘），与原始输入的剩余部分拼接后交还下游，
+    内存中不再同时保留 bytes、str、BytesIO 三份完整请求体。
+
+    同时提取请求体中的文本字段交给逐字段检测：JSON 顶层字符串值、urlencoded 表单字段、
+    multipart 中不带文件名的字段（文件内容不扫描）；每个字段最多保留 field_max_chars 个字符。
+    其他内容类型（octet-stream、图片等）不检测，wsgi.input 原样交给下游，不读取也不落盘。
+    """
+
+    def __init__(self, detect, chunk_size: int = 64 * 1024, overlap: int = 4096,
+                 max_scan_bytes: int = 1024 * 1024, spool_bytes: int = 256 * 1024,
+                 field_max_chars: int = 8192):
+        self.detect = detect
+        self.chunk_size = max(1, int(chunk_size))
+        self.overlap = max(0, int(overlap))
+        self.max_scan_bytes = int(max_scan_bytes)
+        self.spool_bytes = int(spool_bytes)
+        self.field_max_chars = int(field_max_chars)
+        self._lock = threading.Lock()
+        self._stats = {'bodies': 0, 'bytes_scanned': 0, 'blocked': 0, 'early_stops': 0, 'truncated': 0,
+                       'passed_through': 0}
+
+    def inspect(self, environ, scan_windows: bool = True, max_bytes: Optional[int] = None,
+                field_max_chars: Optional[int] = None) -> InspectionResult:
+        """
+        scan_windows 为 False 时只提取字段，不对 JSON 原文做分块检测；
+        max_bytes / field_max_chars 可按端点策略覆盖全局上限
+        """
+        field_max_chars = self.field_max_chars if field_max_chars is None else field_max_chars
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            return InspectionResult(False, '', 0, False)
+
+        mimetype, options = parse_options_header(environ.get('CONTENT_TYPE', ''))
+        kind = None
+        multipart = None
+        if mimetype == 'application/json':
+            kind = 'json'
+        elif mimetype == 'application/x-www-form-urlencoded':
+            kind = 'form'
+        elif mimetype == 'multipart/form-data' and options.get('boundary'):
+            kind = 'multipart'
+            multipart = _MultipartFields(options['boundary'].encode('latin-1'), field_max_chars + 1)
+        else:
+            with self._lock:
+                self._stats['passed_through'] += 1
+            return InspectionResult(False, '', 0, False)
+
+        stream = environ['wsgi.input']
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        limit = length if multipart is not None else min(length, self.max_scan_bytes if max_bytes is None else max_bytes)
+        scanned = 0
+        tail = ''
+        blocked = False
+        excerpt = ''
+        while scanned < limit:
+            chunk = stream.read(min(self.chunk_size, limit - scanned))
+            if not chunk:
+                break
+            scanned += len(chunk)
+            spool.write(chunk)
+            if multipart is not None:
+                multipart.feed(chunk)
+                continue
+            if kind != 'json' or not scan_windows:
+                continue
+            window = tail + decoder.decode(chunk, final=scanned >= length)
+            # 单块请求体与原实现一致走结果缓存；分块扫描的窗口不进入缓存
+            if self.detect(window, use_cache=scanned >= length and not tail):
+                blocked = True
+                excerpt = window
+                break
+            tail = window[-self.overlap:] if self.overlap else ''
+
+        truncated = not blocked and scanned < length
+        fields, data = [], None
+        if not blocked:
+            if multipart is not None:
+                fields = multipart.fields
+            elif kind in ('json', 'form'):
+                fields, data = self._body_fields(kind, spool, not truncated, field_max_chars)
+        environ['wsgi.input'] = ReplayableInput(spool, stream, length - scanned)
+        with self._lock:
+            s = self._stats
+            s['bodies'] += 1
+            s['bytes_scanned'] += scanned
+            s['blocked'] += int(blocked)
+            s['early_stops'] += int(blocked and scanned < length)
+            s['truncated'] += int(truncated)
+        return InspectionResult(blocked, excerpt, scanned, truncated, fields, data)
+
+    def _body_fields(self, kind, spool, complete, field_max_chars):
+        """返回 (字段, 解析后的 JSON 请求体或 None)"""
+        spool.seek(0)
+        text = spool.read().decode('utf-8', errors='ignore')
+        # 多保留一个字符，检测阶段据此判断字段是否被截断
+        cap = field_max_chars + 1
+        if kind == 'form':
+            return [('form', k, v[:cap]) for k, v in parse_qsl(text, keep_blank_values=True)], None
+        if not complete:
+            return [], None
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return [], None
+        if not isinstance(data, dict):
+            return [], data
+        return [('json', str(k), v[:cap]) for k, v in data.items() if isinstance(v, str)], data
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class _MultipartFields:
+    """增量解析 multipart 请求体，只收集不带文件名的文本字段"""
+
+    def __init__(self, boundary: bytes, max_chars: int):
+        self._decoder = MultipartDecoder(boundary)
+        self._max_bytes = max_chars * 4
+        self._max_chars = max_chars
+        self._name = None
+        self._buf = None
+        self.fields: List[Tuple[str, str, str]] = []
+
+    def feed(self, chunk: bytes) -> None:
+        try:
+            self._decoder.receive_data(chunk)
+            event = self._decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, Field):
+                    self._name, self._buf = event.name, bytearray()
+                elif isinstance(event, Data):
+                    if self._buf is not None and len(self._buf) < self._max_bytes:
+                        self._buf += event.data[:self._max_bytes - len(self._buf)]
+                    if not event.more_data:
+                        if self._buf is not None:
+                            value = self._buf.decode('utf-8', errors='ignore')[:self._max_chars]
+                            self.fields.append(('multipart', self._name, value))
+                        self._name, self._buf = None, None
+                else:  # File：文件内容不检测
+                    self._name, self._buf = None, None
+                event = self._decoder.next_event()
+        except ValueError:
+            # 格式错误的 multipart 交给下游处理，这里只停止提取
+            self._decoder = MultipartDecoder(b'\x00')
+
+
+class RequestVerdicts:
+    """
+    中间件对一次请求的检测结论，存放在 environ[VERDICTS_ENVIRON_KEY]
+    fields 以 "来源:字段名" 为键（如 query:q、json:query、form:username、header:User-Agent），
+    值为 AttackDetectorManager.detect_all 的结果；下游路由可直接复用，无需重复检测。
+    超过 field_max_chars 被截断检测的字段放在 partial 中，只参与拦截判断，get() 不返回，路由需自行检测。
+    json 为中间件已完整解析的 JSON 请求体（未解析时为 None），路由通过 json_body() 复用，不再重新读取、解析回放的请求体。
+    请求头（header:*）的命中只记录不拦截：Referer 等请求头常带有站内 URL，误报不应导致请求被拒；
+    命中的 (字段, 值) 放在 log_only 中，由中间件以未拦截状态写入攻击日志。
+    """
+
+    def __init__(self):
+        self.endpoint = ''       # 匹配到的端点（决定所用的检测策略）
+        self.fields: Dict[str, Dict] = {}
+        self.partial: Dict[str, Dict] = {}
+        self.blocked = False
+        self.truncated = False   # 请求体或字段数超出上限，存在未检测的内容
+        self.oversized = False   # 拦截模式下存在未检测的内容，中间件拒绝请求（413）
+        self.log_only: List[Tuple[str, str]] = []
+        self.json: Any = None
+
+    def get(self, source: str, name: str) -> Optional[Dict]:
+        return self.fields.get(f'{source}:{name}')
+
+    @property
+    def detected(self) -> bool:
+        return any(v['detected'] for d in (self.fields, self.partial) for v in d.values())
+
+
+VERDICTS_ENVIRON_KEY = 'xss_security.verdicts'
+
+
 class XSSMiddleware:
     def __init__(self, flask_app, app_wsgi):
         self.flask_app = flask_app
         self.app_wsgi = app_wsgi
         self.detector = XSSDetector()
+        self.detector.configure(
+            safe_mode=flask_app.config.get('DETECTION_SAFE_MODE', False),
+            max_repeat=flask_app.config.get('DETECTION_SAFE_MAX_REPEAT', 128),
+            max_scan_chars=flask_app.config.get('DETECTION_MAX_SCAN_CHARS', 512 * 1024),
+            url_decode_depth=flask_app.config.get('DETECTION_URL_DECODE_DEPTH', 3),
+        )
+        self.inspector = BodyInspector(
+            self.detector.detect_xss_patterns,
+            chunk_size=flask_app.config.get('BODY_INSPECT_CHUNK_SIZE', 64 * 1024),
+            overlap=flask_app.config.get('BODY_INSPECT_OVERLAP', 4096),
+            max_scan_bytes=flask_app.config.get('BODY_INSPECT_MAX_BYTES', 1024 * 1024),
+            spool_bytes=flask_app.config.get('BODY_INSPECT_SPOOL_BYTES', 256 * 1024),
+            field_max_chars=flask_app.config.get('INSPECT_FIELD_MAX_CHARS', 8192),
+        )
+        # 逐字段检测与路由共用同一个检测管理器（及其结果缓存）
+        self.detector_manager = flask_app.extensions.get('detector_manager') or AttackDetectorManager(flask_app)
+        self.inspect_headers = list(flask_app.config.get('INSPECT_HEADERS', ['User-Agent', 'Referer']))
+        self.field_max_chars = int(flask_app.config.get('INSPECT_FIELD_MAX_CHARS', 8192))
+        self.max_fields = int(flask_app.config.get('INSPECT_MAX_FIELDS', 64))
+        self.ban_index = get_ban_index(flask_app)
+        self.settings = get_settings(flask_app)
+        self.log_writer = get_attack_log_writer(flask_app)
+        self.rate_limit_enabled = bool(flask_app.config.get('RATE_LIMIT_ENABLED', True))
+        self.static_prefix = (flask_app.static_url_path or '/static').rstrip('/') + '/'
         self.ip_attack_count = defaultdict(int)
 
     def _log_attack(self, ip, payload, blocked=True):
-        with self.flask_app.app_context():
-            log = AttackLog(ip=ip, payload=payload[:2000], blocked=blocked)
-            db.session.add(log)
-            db.session.commit()
+        # 交给后台写入器，拦截响应不等待数据库提交
+        self.log_writer.submit(ip=ip, payload=payload[:2000], blocked=blocked)
 
     def is_defense_enabled(self):
-        # 优先读取持久化设置，回退到 app.config
+        # 优先读取持久化设置（内存快照），回退到 app.config
         try:
-            with self.flask_app.app_context():
-                s = Setting.query.filter_by(key='xss_defense_enabled').first()
-                if s is not None:
-                    return s.value == '1'
+            value = self.settings.get('xss_defense_enabled')
+            if value is not None:
+                return value == '1'
         except Exception:
             pass
         return bool(self.flask_app.config.get('XSS_DEFENSE_ENABLED', True))
 
     def check_ip_banned(self, ip):
+        # 内存封禁索引：O(1) 查询，版本号变化时才访问数据库
         try:
-            with self.flask_app.app_context():
-                b = BannedIP.query.filter_by(ip=ip).first()
-                if not b:
-                    return False
-                if b.permanent:
-                    return True
-                if b.expires_at and b.expires_at > datetime.utcnow():
-                    return True
-                # 过期则自动移除
-                if b.expires_at and b.expires_at <= datetime.utcnow():
-                    db.session.delete(b); db.session.commit()
-                    return False
-                return False
+            return self.ban_index.is_banned(ip)
         except Exception:
+            logging.exception("ban index lookup failed")
             return False
 
+    def check_rate_limit(self, ip, environ, block=True):
+        """内存滑动窗口限流（detector_manager.rate_limiter），静态文件不计数；需要拦截时返回限流结论"""
+        limiter = self.detector_manager.rate_limiter
+        if limiter is None or not self.rate_limit_enabled:
+            return None
+        path = environ.get('PATH_INFO', '') or '/'
+        if path.startswith(self.static_prefix):
+            return None
+        method = environ.get('REQUEST_METHOD', 'GET')
+        try:
+            decision = limiter.check(ip, path, method)
+            if decision.first_violation:
+                limiter.record_violation(ip, path, decision, blocked=block, method=method)
+        except Exception:
+            logging.exception("rate limiter error")
+            return None
+        return decision if decision.exceeded and block else None
+
     def __call__(self, environ, start_response):
         ip = environ.get('HTTP_X_FORWARDED_FOR', environ.get('REMOTE_ADDR', '127.0.0.1')).split(',')[0].strip()
         # 检查封禁
@@ -79,27 +396,107 @@ class XSSMiddleware:
             start_response('403 Forbidden', [('Content-Type','application/json; charset=utf-8'), ('Content-Length', str(len(body)))])
             return [body]
 
-        # 仅在防御开启时拦截/检测
-        if not self.is_defense_enabled():
-            return self.app_wsgi(environ, start_response)
-
-        # 只检查 JSON POST 体作为示例
-        if environ.get('REQUEST_METHOD') == 'POST' and environ.get('CONTENT_TYPE', '').startswith('application/json'):
-            try:
-                length = int(environ.get('CONTENT_LENGTH') or 0)
-                body_bytes = environ['wsgi.input'].read(length) if length > 0 else b''
-                environ['wsgi.input'] = BytesIO(body_bytes)
-                content = body_bytes.decode('utf-8', errors='ignore')
-                if self.detector.detect_xss_patterns(content):
-                    # 记录并返回拦截响应
-                    self._log_attack(ip, content, blocked=True)
-                    response_body = b'{"error": "XSS attack detected and blocked"}'
-                    start_response('400 Bad Request', [
-                        ('Content-Type', 'application/json; charset=utf-8'),
-                        ('Content-Length', str(len(response_body)))
-                    ])
-                    return [response_body]
-            except Exception as e:
-                logging.exception("XSS middleware error")
-
-        return self.app_wsgi(environ, start_response)
\ No newline at end of file
+        # 频率限制在内容检测之前：洪泛请求不再消耗检测开销；仅在防御开启时拦截
+        defense_enabled = self.is_defense_enabled()
+        limited = self.check_rate_limit(ip, environ, block=defense_enabled)
+        if limited is not None:
+            body = b'{"error":"Too many requests"}'
+            start_response('429 Too Many Requests', [
+                ('Content-Type', 'application/json; charset=utf-8'),
+                ('Content-Length', str(len(body))),
+                ('Retry-After', str(limited.retry_after)),
+            ])
+            return [body]
+
+        # 每个请求都检测并把结论写入 environ 供路由复用；仅在防御开启时拦截
+        try:
+            verdicts, excerpt = self.inspect_request(environ, block=defense_enabled)
+            environ[VERDICTS_ENVIRON_KEY] = verdicts
+            for _, value in verdicts.log_only:
+                self._log_attack(ip, value, blocked=False)
+            if verdicts.oversized:
+                response_body = b'{"error": "Request body too large to inspect"}'
+                start_response('413 Request Entity Too Large', [
+                    ('Content-Type', 'application/json; charset=utf-8'),
+                    ('Content-Length', str(len(response_body)))
+                ])
+                return [response_body]
+            if defense_enabled and verdicts.blocked:
+                # 记录并返回拦截响应
+                self._log_attack(ip, excerpt, blocked=True)
+                response_body = b'{"error": "XSS attack detected and blocked"}'
+                start_response('400 Bad Request', [
+                    ('Content-Type', 'application/json; charset=utf-8'),
+                    ('Content-Length', str(len(response_body)))
+                ])
+                return [response_body]
+        except Exception as e:
+            logging.exception("XSS middleware error")
+
+        return self.app_wsgi(environ, start_response)
+
+    def policy_for(self, environ):
+        """按请求匹配到的 URL 规则取端点检测策略（compile_policies 挂在 rule 上），未匹配时使用默认策略"""
+        try:
+            rule, _ = self.flask_app.url_map.bind_to_environ(environ).match(return_rule=True)
+        except HTTPException:
+            return self.detector_manager.default_policy
+        return getattr(rule, 'detection_policy', None) or self.detector_manager.default_policy
+
+    def inspect_request(self, environ, block: bool = True) -> Tuple[RequestVerdicts, str]:
+        """
+        统一检测入口：查询参数、请求体（JSON / urlencoded / multipart 文本字段）、INSPECT_HEADERS 中的请求头（只记录不拦截）
+        检测器、字段、单字段长度、请求体上限和是否拦截由端点检测策略决定，每个请求最多 max_fields 个字段；
+        block 为 True 且策略为拦截模式时，出现命中即停止检测其余字段；请求体超出扫描上限或字段数超出 max_fields 时
+        标记 oversized（中间件返回 413）。返回 (检测结论, 命中内容摘录)
+        """
+        policy = self.policy_for(environ)
+        verdicts = RequestVerdicts()
+        verdicts.endpoint = policy.endpoint
+        if not policy.policy.detectors:
+            return verdicts, ''
+        block = block and policy.blocking
+        cap = min(policy.policy.max_chars, self.field_max_chars)
+
+        fields = [('query', k, v) for k, v in parse_qsl(environ.get('QUERY_STRING', ''), keep_blank_values=True)]
+        for name in self.inspect_headers:
+            value = environ.get('HTTP_' + name.upper().replace('-', '_'))
+            if value:
+                fields.append(('header', name, value))
+
+        result = self.inspector.inspect(environ, scan_windows=block and 'xss' in policy.policy.detectors,
+                                        max_bytes=policy.policy.max_body_bytes, field_max_chars=cap)
+        verdicts.truncated = result.truncated
+        verdicts.json = result.json
+        if result.blocked:
+            verdicts.blocked = True
+            return verdicts, result.excerpt
+        fields = [f for f in fields + result.fields if policy.wants(f[0], f[1])]
+        if len(fields) > self.max_fields:
+            verdicts.truncated = True
+            fields = fields[:self.max_fields]
+        if verdicts.truncated and block:
+            # 未检测的内容不能交给下游（路由会读取完整请求体）
+            verdicts.oversized = True
+            return verdicts, ''
+
+        excerpt = ''
+        for source, name, value in fields:
+            key = f'{source}:{name}'
+            if not value or key in verdicts.fields or key in verdicts.partial:
+                continue
+            detection = self.detector_manager.detect_all(value[:cap], policy.ruleset)
+            if len(value) > cap:
+                verdicts.partial[key] = detection
+            else:
+                verdicts.fields[key] = detection
+            if source == 'header':
+                if detection['detected']:
+                    verdicts.log_only.append((key, value))
+                continue
+            if policy.blocking and not verdicts.blocked and detection['detected']:
+                verdicts.blocked = True
+                excerpt = value
+                if block:
+                    break
+        return verdicts, excerpt
@@ -0,0 +1,52 @@
+"""
+流式导出攻击日志（NDJSON / CSV，可选 gzip），供 SIEM 等离线导入
+用法：
+    python export_attack_logs.py -o logs.ndjson
+    python export_attack_logs.py --format csv --gzip --type sqli --after-ts 2024-01-01 -o sqli.csv.gz
+    python export_attack_logs.py --q xp_cmdshell              # 不给 -o 时写到标准输出
+筛选条件与 /api/attack/logs/export 相同，按 id 分批读取，内存占用与导出行数无关；包含已归档的日志
+"""
+import argparse
+import sys
+
+from app import create_app
+from app.log_export import EXPORT_FORMATS, export_stream, parse_filters
+from app.log_archive import get_log_archive
+from app.log_search import get_log_search
+
+parser = argparse.ArgumentParser(description='导出攻击日志')
+parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+parser.add_argument('--gzip', action='store_true', help='输出 gzip 压缩流')
+parser.add_argument('-o', '--output', help='输出文件（默认标准输出）')
+parser.add_argument('--type')
+parser.add_argument('--severity')
+parser.add_argument('--blocked', choices=('true', 'false'))
+parser.add_argument('--ip')
+parser.add_argument('--q', help='全文检索关键字')
+parser.add_argument('--after-ts', help='只导出该时间（ISO 格式）之后的日志')
+parser.add_argument('--before-ts', help='只导出该时间（ISO 格式）之前的日志')
+parser.add_argument('--limit', type=int)
+parser.add_argument('--batch-size', type=int, default=None, help='每批读取行数（默认 ATTACK_LOG_EXPORT_BATCH_SIZE）')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    try:
+        filters = parse_filters({k: v for k, v in vars(args).items() if isinstance(v, str)})
+    except ValueError as e:
+        parser.error(f'时间格式错误: {e}')
+    batch_size = args.batch_size or app.config.get('ATTACK_LOG_EXPORT_BATCH_SIZE', 1000)
+    chunks = export_stream(args.format, filters, log_search=get_log_search(app), compress=args.gzip,
+                           batch_size=batch_size, limit=args.limit, archive=get_log_archive(app))
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        written = 0
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.output:
+            out.close()
+    if args.output:
+        print(f"导出完成：{args.output}（{written} 字节）", file=sys.stderr)
@@ -0,0 +1,59 @@
+from app import create_app, db
+from app.models import payload_hash
+from sqlalchemy import text
+
+# 为 attack_log 增加洪泛聚合列：count / first_seen / last_seen / payload_hash
+# 已有行视为各自代表 1 个事件，first_seen = last_seen = timestamp
+
+BATCH = 2000
+
+app = create_app()
+
+with app.app_context():
+    conn = db.engine.connect()
+    try:
+        res = conn.execute(text("PRAGMA table_info('attack_log')")).fetchall()
+        cols = [r[1] for r in res]
+        changed = False
+
+        if 'count' not in cols:
+            print("添加列: count")
+            conn.execute(text("ALTER TABLE attack_log ADD COLUMN count INTEGER NOT NULL DEFAULT 1"))
+            changed = True
+
+        for col in ('first_seen', 'last_seen'):
+            if col not in cols:
+                print(f"添加列: {col}")
+                conn.execute(text(f"ALTER TABLE attack_log ADD COLUMN {col} DATETIME"))
+                conn.execute(text(f"UPDATE attack_log SET {col} = timestamp WHERE {col} IS NULL"))
+                changed = True
+
+        if 'payload_hash' not in cols:
+            print("添加列: payload_hash")
+            conn.execute(text("ALTER TABLE attack_log ADD COLUMN payload_hash VARCHAR(40)"))
+            changed = True
+
+        # 分批回填载荷摘要，避免一次性读入整张表
+        filled = 0
+        while True:
+            rows = conn.execute(text(
+                "SELECT id, payload FROM attack_log WHERE payload_hash IS NULL LIMIT :n"), {'n': BATCH}).fetchall()
+            if not rows:
+                break
+            conn.execute(text("UPDATE attack_log SET payload_hash = :h WHERE id = :id"),
+                         [{'h': payload_hash(p), 'id': i} for i, p in rows])
+            filled += len(rows)
+        if filled:
+            print(f"回填 payload_hash: {filled} 行")
+            changed = True
+
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_attack_log_payload_hash ON attack_log (payload_hash)"))
+        conn.commit()
+
+        if changed:
+            print("迁移完成。")
+        else:
+            print("无需迁移：列已存在。")
+    finally:
+        conn.close()
@@ -0,0 +1,41 @@
+"""
+为已有数据库的 attack_log 创建列表分页用的复合索引（定义见 models.AttackLog.__table_args__）
+用法：
+    python migrate_add_attacklog_indexes.py
+逐个创建、每个索引单独提交，避免长时间持有写锁；PostgreSQL 上使用 CREATE INDEX CONCURRENTLY，
+不阻塞写入。SQLite 不支持并发建索引，建索引期间写入会短暂等待（日志由后台线程批量写入，请求不受影响）。
+已存在的索引会跳过，可重复运行。
+"""
+from app import create_app, db
+from app.models import AttackLog
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+app = create_app()
+
+with app.app_context():
+    engine = db.engine
+    existing = {ix['name'] for ix in inspect(engine).get_indexes('attack_log')}
+    created = []
+
+    for index in sorted(AttackLog.__table__.indexes, key=lambda ix: ix.name):
+        if index.name in existing:
+            continue
+        ddl = str(CreateIndex(index).compile(dialect=engine.dialect))
+        print(f"创建索引: {index.name}")
+        if engine.dialect.name == 'postgresql':
+            ddl = ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text(ddl))
+        else:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+        created.append(index.name)
+
+    if created:
+        # 更新统计信息，让查询规划器使用新索引
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE attack_log"))
+        print("迁移完成。")
+    else:
+        print("无需迁移：索引已存在。")
@@ -0,0 +1,56 @@
+"""
+为 attack_log 增加 payload_family 列（script / alert / javascript / others）并分批回填
+用法：
+    python migrate_add_attacklog_payload_family.py [--batch-size 5000]
+按 id 顺序分块读取未分类的行，每块单独提交，可随时中断后重新运行继续回填
+"""
+import argparse
+
+from app import create_app, db
+from app.models import classify_payload_family
+from sqlalchemy import text
+
+parser = argparse.ArgumentParser(description='回填攻击日志的载荷分类')
+parser.add_argument('--batch-size', type=int, default=5000, help='每块处理的行数')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    conn = db.engine.connect()
+    try:
+        res = conn.execute(text("PRAGMA table_info('attack_log')")).fetchall()
+        cols = [r[1] for r in res]
+
+        if 'payload_family' not in cols:
+            print("添加列: payload_family")
+            conn.execute(text("ALTER TABLE attack_log ADD COLUMN payload_family VARCHAR(20)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_attack_log_payload_family ON attack_log (payload_family)"))
+        conn.commit()
+
+        last_id = 0
+        filled = 0
+        while True:
+            rows = conn.execute(text(
+                "SELECT id, payload FROM attack_log WHERE id > :last AND payload_family IS NULL "
+                "ORDER BY id LIMIT :n"), {'last': last_id, 'n': args.batch_size}).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            by_family = {}
+            for i, p in rows:
+                family = classify_payload_family(p)
+                if family:
+                    by_family.setdefault(family, []).append(i)
+            # 每个分类一条 UPDATE
+            for family, ids in by_family.items():
+                conn.execute(text("UPDATE attack_log SET payload_family = :f WHERE id IN (%s)"
+                                  % ','.join(str(i) for i in ids)), {'f': family})
+            conn.commit()
+            filled += sum(len(ids) for ids in by_family.values())
+            print(f"已处理至 id={last_id}，累计分类 {filled} 行")
+
+        print("回填完成。" if filled else "无需回填：所有行已分类。")
+    finally:
+        conn.close()
@@ -0,0 +1,25 @@
+"""
+按现有 AttackLog 重建统计预聚合表（AttackRollup）
+用法：
+    python rebuild_attack_rollups.py                   # 全量重建
+    python rebuild_attack_rollups.py --since 2024-01-01  # 只重算该日期之后的桶
+升级到带 rollup 的版本后需要运行一次，为历史日志回填统计
+"""
+import argparse
+from datetime import datetime
+
+from app import create_app, db
+from app.attack_rollups import rebuild
+
+parser = argparse.ArgumentParser(description='重建攻击统计预聚合表')
+parser.add_argument('--since', help='只重算该日期（YYYY-MM-DD）及之后的桶')
+parser.add_argument('--batch-size', type=int, default=5000, help='每批读取的日志行数')
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    since = datetime.strptime(args.since, '%Y-%m-%d') if args.since else None
+    result = rebuild(since=since, batch_size=args.batch_size)
+    print(f"删除旧桶 {result['deleted']} 行，扫描日志 {result['logs_scanned']} 行，写入桶 {result['bucket_upserts']} 次")
+    print("重建完成。")
@@ -0,0 +1,19 @@
+"""
+立即执行一轮日志保留期清理（与后台任务相同：先归档到 instance/archive，再分批删除）
+用法：
+    python run_retention.py
+保留期、批大小、归档目录见 config.py 中的 RETENTION_*；多进程部署时与后台任务共用同一租约，不会重复执行
+"""
+import json
+import sys
+
+from app import create_app
+from app.retention import get_retention_job
+
+app = create_app()
+job = get_retention_job(app)
+run = job.run_once()
+if run is None:
+    print('其他进程正在执行清理，本次跳过', file=sys.stderr)
+    sys.exit(1)
+print(json.dumps(run, ensure_ascii=False, indent=2))
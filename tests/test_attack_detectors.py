@@ -0,0 +1,179 @@
+from app.attack_detectors import AttackDetectorManager, SQLInjectionDetector
+
+
+def test_detect_all_reports_every_matching_rule():
+    manager = AttackDetectorManager()
+    result = manager.detect_all('; cat /etc/passwd')
+    assert result['detected'] is True
+    assert [a['type'] for a in result['attacks']] == ['cmdi', 'path_traversal']
+    descriptions = [m['description'] for m in result['matches']]
+    assert 'cat /etc/passwd 命令' in descriptions
+    assert '直接访问 /etc/passwd' in descriptions
+    assert all({'detector', 'type', 'severity', 'description'} <= set(m) for m in result['matches'])
+
+
+def test_detect_all_matches_detector_semantics():
+    manager = AttackDetectorManager()
+    payloads = ["' OR '1'='1", 'ADMIN\'--', '<SCRIPT>x</script>', 'hello world', 'ſleep(1)', '']
+    sqli = SQLInjectionDetector()
+    for p in payloads:
+        attacks = manager.detect_all(p)['attacks']
+        expected = sqli.detect(p)
+        got = next(((True, a['description']) for a in attacks if a['type'] == 'sqli'), (False, None))
+        assert got == expected
+
+
+def test_benign_content_not_detected():
+    manager = AttackDetectorManager()
+    assert manager.detect_all('hello world')['detected'] is False
+
+
+def test_prefilter_skips_rules_without_literals():
+    manager = AttackDetectorManager()
+    manager.detect_all('hello world')
+    stats = manager.get_stats()['ruleset']
+    assert stats['scans'] == 1
+    assert stats['rules_skipped'] > 0
+    assert stats['rules_skipped'] + stats['rules_evaluated'] == stats['rules']
+    assert 0 < stats['skip_rate'] <= 1
+
+
+def test_detector_stats_api(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'}, follow_redirects=True)
+    rv = client.get('/api/detector/stats')
+    assert rv.status_code == 200
+    assert 'skip_rate' in rv.get_json()['ruleset']
+
+
+def test_detection_cache_hits_and_invalidates_on_rule_change():
+    manager = AttackDetectorManager()
+    first = manager.detect_all("' OR '1'='1")
+    second = manager.detect_all("' OR '1'='1")
+    assert first == second
+    stats = manager.get_stats()['cache']
+    assert stats['hits'] == 1 and stats['entries'] == 1
+
+    old_version = manager.ruleset.version
+    manager.detectors['sqli'].patterns = [(r'nothing-matches-this', 'x')]
+    manager.reload_rules()
+    assert manager.ruleset.version != old_version
+    assert manager.detect_all("' OR '1'='1")['attacks'] == []
+
+
+def test_detection_cache_bounded():
+    from app.attack_detectors import DetectionCache
+    cache = DetectionCache(max_entries=2, max_bytes=10_000)
+    for i in range(5):
+        cache.put(DetectionCache.make_key(str(i), 'v'), {'detected': False}, 100)
+    stats = cache.get_stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 3
+    assert cache.get(DetectionCache.make_key('4', 'v')) is not None
+    assert cache.get(DetectionCache.make_key('0', 'v')) is None
+
+
+def test_optimize_pattern_safe_mode():
+    from app.attack_detectors import optimize_pattern
+    assert optimize_pattern(r'(a+)+b', safe_mode=True) == (None, 'rejected')
+    assert optimize_pattern(r'(\w)\1', safe_mode=True)[0] is None
+    # 只有相邻且字符集相交的无界重复才会改写为有界
+    assert optimize_pattern(r'x\s+y.*z', safe_mode=True, max_repeat=64) == (r'x\s+y.*z', 'linear')
+    assert optimize_pattern(r'a.*\s*b', safe_mode=True, max_repeat=64) == (r'a.{0,64}\s{0,64}b', 'bounded')
+    assert optimize_pattern(r'\w+\s*=', safe_mode=True)[1] == 'linear'
+    # 等价改写在非安全模式下同样生效
+    assert optimize_pattern(r'\bexec\s+', safe_mode=False)[0] == r'exec(?<!\wexec)\s'
+
+
+def test_safe_mode_scan_is_fast_on_adversarial_input():
+    import time
+    from app.attack_detectors import CompiledRuleSet
+    manager = AttackDetectorManager()
+    ruleset = CompiledRuleSet(manager.detectors, safe_mode=True, max_scan_chars=64 * 1024)
+    start = time.perf_counter()
+    ruleset.scan('$(' * 100_000)
+    assert time.perf_counter() - start < 2
+    assert ruleset.get_stats()['truncated_scans'] == 1
+    assert [r.rule_id for r in ruleset.scan("' OR '1'='1")] == [r.rule_id for r in manager.ruleset.scan("' OR '1'='1")]
+
+
+def test_safe_mode_still_detects_padded_payloads(client):
+    from app.xss_security import XSSDetector
+    manager = client.application.extensions['detector_manager']
+    assert manager.ruleset.safe_mode and XSSDetector.safe_mode
+    pad = ' ' * 200
+    for payload, attack in [('<script>' + 'x' * 200 + '</script>', 'xss'), ('alert' + pad + '(1)', 'xss'),
+                            ("'" + pad + 'UNION SELECT 1', 'sqli')]:
+        assert attack in [a['type'] for a in manager.detect_all(payload)['attacks']], payload
+        if attack == 'xss':
+            assert XSSDetector.detect_xss_patterns(payload, use_cache=False), payload
+    from app.settings_service import get_settings
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    enabled = get_settings(client.application).get('xss_defense_enabled') != '0'
+    client.post('/toggle_defense', json={'enabled': True})
+    try:
+        rv = client.post('/test_xss', json={'c': '<script>' + 'x' * 200 + '</script>'})
+        assert rv.status_code == 400
+    finally:
+        client.post('/toggle_defense', json={'enabled': enabled})
+
+
+def test_canonicalization_catches_encoded_payloads():
+    manager = AttackDetectorManager()
+    for payload in ['%3Cscript%3Ealert(1)%3C/script%3E', '&#x3c;script>alert(1)&#x3c;/script>',
+                    '＜script＞alert(1)＜/script＞', 'java\x00script:alert(1)']:
+        assert [a['type'] for a in manager.detect_all(payload)['attacks']] == ['xss'], payload
+    for payload in ['%2e%2e/etc', '%252e%252e%252fetc', '..%5cwindows']:
+        assert manager.detect_all(payload)['attacks'][0]['type'] == 'path_traversal', payload
+    # '+' 不做 unquote_plus 解码，解码轮数有上限
+    assert manager.canonicalizer.normalize('a+b%20c').text == 'a+b c'
+    assert manager.canonicalizer.normalize('%2525252e').text == '%2e'
+    manager.canonicalizer.normalize('a+b%20c')
+    assert manager.canonicalizer.get_stats()['hits'] >= 1
+
+
+def test_single_plain_traversal_is_not_flagged():
+    manager = AttackDetectorManager()
+    for text in ['see ../docs/readme.md', 'cd ..\\build', 'ratio 1..2/3']:
+        assert manager.detect_all(text)['detected'] is False, text
+    for payload in ['../../app.py', '..\\..\\boot.ini', '.%2e/etc', '..%252fsecret']:
+        assert [a['type'] for a in manager.detect_all(payload)['attacks']] == ['path_traversal'], payload
+
+
+def test_canonical_memo_is_bounded_by_size():
+    from app.attack_detectors import Canonicalizer
+    canonicalizer = Canonicalizer(max_entries=1024, max_memo_chars=4096, max_memo_bytes=64 * 1024)
+    for i in range(200):
+        canonicalizer.normalize('%3Cb%3E' * 500 + str(i))
+    stats = canonicalizer.get_stats()
+    assert 0 < stats['bytes'] <= 64 * 1024
+    assert stats['entries'] < 200 and stats['evictions'] > 0
+    # 超过 max_memo_chars 的长输入只计算不记忆
+    canonicalizer.normalize('x' * 5000)
+    assert canonicalizer.get_stats()['entries'] == stats['entries']
+    canonicalizer.clear()
+    assert canonicalizer.get_stats()['bytes'] == 0
+
+
+def test_attack_range_routes_reuse_middleware_verdicts(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'}, follow_redirects=True)
+    manager = client.application.extensions['detector_manager']
+    before = manager.get_stats()['verdict_reuse']
+    rv = client.post('/attack/cmdi/ping', json={'target': '127.0.0.1; whoami', 'defense_enabled': True})
+    assert rv.get_json()['blocked'] is True
+    rv = client.post('/attack/path/view', json={'filepath': 'documents/readme.txt', 'defense_enabled': False})
+    assert rv.status_code == 200
+    after = manager.get_stats()['verdict_reuse']
+    assert after['scans_avoided'] - before['scans_avoided'] == 2
+    assert after['scans_performed'] == before['scans_performed']
+
+
+def test_policy_rulesets_only_contain_selected_detectors():
+    import pytest
+    from app.attack_detectors import DetectionPolicy
+    manager = AttackDetectorManager()
+    compiled = manager.compile_policy(DetectionPolicy(detectors=('cmdi',)), 'ping')
+    assert {r.detector for r in compiled.ruleset.rules} == {'cmdi'}
+    assert manager.ruleset_for(('cmdi',)) is compiled.ruleset
+    assert manager.detect_all('; cat /etc/passwd', compiled.ruleset)['attacks'][0]['type'] == 'cmdi'
+    assert len(manager.detect_all('; cat /etc/passwd', compiled.ruleset)['attacks']) == 1
+    with pytest.raises(ValueError):
+        manager.compile_policy(DetectionPolicy(detectors=('nope',)))
@@ -0,0 +1,153 @@
+from app import db
+from app.models import AttackLog
+from app import attack_log_writer
+from app.attack_log_writer import AttackLogWriter
+from app.event_bus import EventBus
+
+
+def _reset(app, ip):
+    """共享数据库中清掉上一次运行留下的同 IP 记录"""
+    with app.app_context():
+        AttackLog.query.filter_by(ip=ip).delete()
+        db.session.commit()
+
+
+def _count(app, **filters):
+    with app.app_context():
+        return AttackLog.query.filter_by(**filters).count()
+
+
+def test_writer_batches_rows_until_flush(client):
+    app = client.application
+    _reset(app, '10.9.9.1')
+    writer = AttackLogWriter(app, batch_size=1000, flush_ms=10000)
+    for i in range(5):
+        assert writer.submit(ip='10.9.9.1', payload=f'p{i}', blocked=True, attack_type='xss')
+    assert writer.get_stats()['queue_depth'] == 5
+    assert writer.flush() is True
+    assert _count(app, ip='10.9.9.1') == 5
+    stats = writer.get_stats()
+    assert stats['written'] == 5 and stats['flushes'] == 1 and stats['queue_depth'] == 0
+    writer.close()
+
+
+def test_writer_overflow_policies(client):
+    app = client.application
+    for ip in ('10.9.9.2', '10.9.9.3'):
+        _reset(app, ip)
+    bus = EventBus()
+    writer = AttackLogWriter(app, batch_size=1000, flush_ms=10000, max_queue=2, overflow='drop', event_bus=bus)
+    results = [writer.submit(ip='10.9.9.2', payload=f'p{i}', blocked=True) for i in range(4)]
+    assert results == [True, True, False, False]
+    assert writer.get_stats()['dropped'] == 2
+    # 被丢弃的日志不推送到事件流
+    assert [e['payload'] for e in bus.subscribe(last_event_id=0).get(timeout=0)[0]] == ['p0', 'p1']
+    writer.flush()
+    assert _count(app, ip='10.9.9.2') == 2
+    writer.close()
+
+    writer = AttackLogWriter(app, batch_size=1000, flush_ms=10000, max_queue=2, overflow='aggregate',
+                             aggregate_window_s=0)
+    for i in range(10):
+        writer.submit(ip='10.9.9.3', payload='flood', blocked=True)
+    stats = writer.get_stats()
+    assert stats['queue_depth'] == 3 and stats['aggregated'] == 7
+    writer.flush()
+    with app.app_context():
+        rows = AttackLog.query.filter_by(ip='10.9.9.3').all()
+        assert len(rows) == 3 and sum(r.count for r in rows) == 10
+    writer.close()
+
+
+def test_flood_is_coalesced_within_window(client):
+    app = client.application
+    _reset(app, '10.9.9.5')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    before = client.get('/api/stats/summary').get_json()['total_attacks']
+    writer = AttackLogWriter(app, batch_size=1000, flush_ms=10000, aggregate_window_s=60)
+    for _ in range(3):
+        for _ in range(500):
+            writer.submit(ip='10.9.9.5', payload='<script>x</script>', blocked=True, attack_type='xss',
+                          target_url='/test_xss')
+        writer.submit(ip='10.9.9.5', payload='other', blocked=True, attack_type='xss', target_url='/test_xss')
+        # 同一载荷被放行（如防御关闭）时不并入已拦截的行
+        writer.submit(ip='10.9.9.5', payload='<script>x</script>', blocked=False, attack_type='xss',
+                      target_url='/test_xss')
+        writer.flush()
+    with app.app_context():
+        rows = AttackLog.query.filter_by(ip='10.9.9.5').order_by(AttackLog.id).all()
+        assert [(r.count, r.blocked) for r in rows] == [(1500, True), (3, True), (3, False)]
+        assert rows[0].first_seen <= rows[0].last_seen
+        assert rows[0].payload_hash and rows[0].payload_hash != rows[1].payload_hash
+        assert rows[0].payload_hash == rows[2].payload_hash
+    stats = writer.get_stats()
+    assert stats['written'] == 1506 and stats['rows_inserted'] == 3 and stats['rows_updated'] == 6
+    writer.close()
+
+    # 统计按 count 求和，合并不丢事件数
+    assert client.get('/api/stats/summary').get_json()['total_attacks'] - before == 1506
+
+
+def test_direct_inserts_fill_aggregation_defaults(client):
+    from datetime import datetime
+    from app import db
+    from app.models import payload_hash
+    with client.application.app_context():
+        ts = datetime(2024, 1, 2, 3, 4, 5)
+        log = AttackLog(ip='10.9.9.6', payload='p', timestamp=ts)
+        db.session.add(log)
+        db.session.commit()
+        assert log.count == 1 and log.first_seen == ts and log.last_seen == ts
+        assert log.payload_hash == payload_hash('p')
+
+
+def test_sync_writes_from_request_threads_share_one_window(client, monkeypatch):
+    import threading
+    import time
+    app = client.application
+    _reset(app, '10.9.9.7')
+    writer = AttackLogWriter(app, async_mode=False, aggregate_window_s=60)
+    bulk_insert = db.session.bulk_insert_mappings
+
+    def slow_insert(*args, **kwargs):
+        # 放大 "查窗口 -> 插入 -> 登记窗口" 之间的间隙
+        time.sleep(0.02)
+        return bulk_insert(*args, **kwargs)
+
+    monkeypatch.setattr(db.session, 'bulk_insert_mappings', slow_insert)
+    # 跳过 rollup 与版本号写入：SQLite 在第一条写语句处取得写锁，会顺带把各线程的事务串行化，掩盖窗口竞争
+    monkeypatch.setattr(attack_log_writer, 'apply_deltas', lambda connection, deltas: 0)
+    monkeypatch.setattr(attack_log_writer, 'bump_log_version', lambda: None)
+    start = threading.Barrier(8)
+
+    def hammer():
+        start.wait()
+        for _ in range(10):
+            writer.submit(ip='10.9.9.7', payload='flood', blocked=True, attack_type='xss')
+
+    threads = [threading.Thread(target=hammer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with app.app_context():
+        rows = AttackLog.query.filter_by(ip='10.9.9.7').all()
+        assert [r.count for r in rows] == [80]
+    assert writer.get_stats()['errors'] == 0
+
+
+def test_blocked_request_is_logged_after_flush(client):
+    from app.settings_service import get_settings
+    app = client.application
+    _reset(app, '10.9.9.4')
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    enabled = get_settings(app).get('xss_defense_enabled') != '0'
+    client.post('/toggle_defense', json={'enabled': True})
+    try:
+        rv = client.post('/test_xss', json={'input': '<script>alert(1)</script>'},
+                         headers={'X-Forwarded-For': '10.9.9.4'})
+        assert rv.status_code == 400
+        app.extensions['attack_log_writer'].flush()
+        assert _count(app, ip='10.9.9.4', blocked=True) == 1
+    finally:
+        client.post('/toggle_defense', json={'enabled': enabled})
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import AttackLog
+
+
+def test_keyset_pagination_matches_offset_paging(client):
+    base = datetime(2023, 5, 1)
+    with client.application.app_context():
+        db.session.add_all([
+            # 同一时间戳的多行由 id 区分先后
+            AttackLog(ip='10.5.0.1', payload=f'p{i}', attack_type='cmdi', timestamp=base + timedelta(seconds=i // 2))
+            for i in range(25)
+        ])
+        db.session.commit()
+
+    url = '/api/attack/logs?ip=10.5.0.1&limit=10'
+    by_offset = []
+    for o in (0, 10, 20):
+        by_offset += [l['id'] for l in client.get(f'{url}&offset={o}').get_json()['logs']]
+
+    by_cursor, cursor = [], {}
+    while True:
+        qs = f"&before_id={cursor['before_id']}" if cursor else ''
+        j = client.get(url + qs).get_json()
+        by_cursor += [l['id'] for l in j['logs']]
+        cursor = j['next_cursor']
+        if not cursor:
+            break
+    assert by_cursor == by_offset and len(by_cursor) == 25
+
+    newer = client.get(f'{url}&after_ts={(base + timedelta(seconds=10)).isoformat()}').get_json()['logs']
+    assert [l['payload'] for l in newer] == ['p24', 'p23', 'p22']
+    assert client.get(f'{url}&before_id=abc').status_code == 400
@@ -0,0 +1,128 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app import attack_rollups, db
+from app.models import AttackLog, AttackRollup
+from app.attack_log_writer import AttackLogWriter
+from app.attack_rollups import rebuild
+
+
+def _reset(app, ip):
+    """共享数据库中清掉上一次运行留下的同 IP 日志与统计"""
+    with app.app_context():
+        AttackLog.query.filter_by(ip=ip).delete()
+        AttackRollup.query.filter_by(ip=ip).delete()
+        db.session.commit()
+
+
+def _rollup(granularity, ip):
+    rows = AttackRollup.query.filter_by(granularity=granularity, ip=ip).all()
+    return {(r.bucket, r.attack_type, r.blocked): r.count for r in rows}
+
+
+def test_rollups_follow_orm_and_batched_writes(client):
+    app = client.application
+    ts = datetime(2024, 3, 1, 10, 15, 30)
+    _reset(app, '10.8.0.1')
+    with app.app_context():
+        db.session.add_all([
+            AttackLog(ip='10.8.0.1', payload='a', attack_type='sqli', timestamp=ts),
+            AttackLog(ip='10.8.0.1', payload='b', attack_type='sqli', timestamp=ts + timedelta(minutes=1)),
+        ])
+        db.session.commit()
+
+    writer = AttackLogWriter(app, batch_size=1000, flush_ms=10000)
+    for _ in range(300):
+        writer.submit(ip='10.8.0.1', payload='flood', blocked=False, attack_type='xss',
+                      timestamp=ts + timedelta(hours=1))
+    writer.flush()
+    writer.close()
+
+    with app.app_context():
+        day = _rollup('day', '10.8.0.1')
+        assert day == {
+            (datetime(2024, 3, 1), 'sqli', True): 2,
+            (datetime(2024, 3, 1), 'xss', False): 300,
+        }
+        # 只维护天粒度
+        assert AttackRollup.query.filter_by(ip='10.8.0.1').count() == 2
+
+        # 重建结果与增量维护一致，旧版本遗留的分钟桶被清除
+        db.session.add(AttackRollup(granularity='minute', bucket=ts, attack_type='sqli', severity='high',
+                                    blocked=True, ip='10.8.0.1', count=1))
+        db.session.commit()
+        rebuild(since=ts)
+        assert _rollup('day', '10.8.0.1') == day
+        assert AttackRollup.query.filter_by(granularity='minute').count() == 0
+
+
+def test_rebuild_is_atomic_and_holds_writer_off(client, monkeypatch):
+    app = client.application
+    ts = datetime(2024, 4, 1, 9)
+    ip = '10.8.0.4'
+    _reset(app, ip)
+    with app.app_context():
+        db.session.add_all([AttackLog(ip=ip, payload=f'r{i}', attack_type='sqli', timestamp=ts) for i in range(10)])
+        db.session.commit()
+    total = f"SELECT SUM(count) FROM attack_rollup WHERE granularity = 'day' AND ip = '{ip}'"
+    writer = AttackLogWriter(app, batch_size=1, flush_ms=10)
+    observed = []
+    apply_deltas = attack_rollups.apply_deltas
+
+    def slow_apply(connection, deltas):
+        if not observed:
+            writer.submit(ip=ip, payload='during', attack_type='sqli', timestamp=ts)
+        time.sleep(0.05)
+        # 另一个连接在重算提交前读到的仍是完整的旧统计
+        with db.engine.connect() as other:
+            observed.append(other.execute(text(total)).scalar())
+        return apply_deltas(connection, deltas)
+
+    monkeypatch.setattr(attack_rollups, 'apply_deltas', slow_apply)
+    with app.app_context():
+        rebuild(since=ts, batch_size=2)
+    writer.flush()
+    writer.close()
+    assert len(observed) >= 5 and set(observed) == {10}
+    # 重算期间提交的日志只计入一次
+    with app.app_context():
+        assert db.session.execute(text(total)).scalar() == 11
+        assert writer.get_stats()['errors'] == 0
+
+
+def test_stats_routes_read_rollups(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    with client.application.app_context():
+        db.session.add(AttackLog(ip='10.8.0.2', payload='p', attack_type='cmdi', count=7))
+        db.session.commit()
+        expected = db.session.query(AttackRollup.events()).filter_by(granularity='day').scalar()
+
+    assert client.get('/api/attack/stats').get_json()['total'] == expected
+    assert client.get('/api/stats/summary').get_json()['total_attacks'] == expected
+    breakdown = client.get('/api/attack/type_breakdown').get_json()
+    assert 'cmdi' in breakdown['labels']
+    trend = client.get('/api/stats/attacks').get_json()
+    assert trend['data'][-1] >= 7
+    top = client.get('/api/stats/ip_distribution').get_json()
+    assert '10.8.0.2' in top['labels']
+
+
+def test_payload_family_is_classified_at_insert(client):
+    from app.models import classify_payload_family
+    assert classify_payload_family('<SCRIPT>x</SCRIPT>') == 'script'
+    assert classify_payload_family('javascript:alert(1)') == 'alert'
+    assert classify_payload_family('javascript:void(0)') == 'javascript'
+    assert classify_payload_family('x') == 'others' and classify_payload_family('') is None
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    before = client.get('/api/stats/types').get_json()
+    with client.application.app_context():
+        log = AttackLog(ip='10.8.0.3', payload='<script>1</script>', count=4)
+        db.session.add(log)
+        db.session.commit()
+        assert log.payload_family == 'script'
+    after = client.get('/api/stats/types').get_json()
+    assert after['labels'] == ['script', 'alert', 'javascript', 'others']
+    assert after['data'][0] == before['data'][0] + 4
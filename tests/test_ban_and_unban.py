@@ -22,4 +22,60 @@ def test_ban_and_unban_flow(client):
     rv3 = client.post('/unban_ip', json={'ip': ip})
     assert rv3.status_code == 200
     rv4 = client.get('/get_banned_ips')
-    assert not any(item['ip'] == ip for item in rv4.get_json())
\ No newline at end of file
+    assert not any(item['ip'] == ip for item in rv4.get_json())
+
+def test_ban_takes_effect_immediately_in_middleware(client):
+    login(client)
+    ip = '10.9.8.7'
+    # 被封禁方使用独立的客户端（会话绑定了登录 IP）
+    other = client.application.test_client()
+    headers = {'X-Forwarded-For': ip}
+    assert other.get('/login', headers=headers).status_code == 200
+    client.post('/ban_ip', json={'ip': ip, 'permanent': True})
+    assert other.get('/login', headers=headers).status_code == 403
+    client.post('/unban_ip', json={'ip': ip})
+    assert other.get('/login', headers=headers).status_code == 200
+
+
+def test_ban_index_picks_up_external_writes_and_expiry(client):
+    from datetime import datetime, timedelta
+    from app import db
+    from app.ban_index import BanIndex
+    index = BanIndex(client.application, poll_ms=0)
+    with client.application.app_context():
+        BannedIP.query.filter(BannedIP.ip.in_(['10.0.0.1', '10.0.0.2'])).delete(synchronize_session=False)
+        db.session.add(BannedIP(ip='10.0.0.1', permanent=True))
+        db.session.add(BannedIP(ip='10.0.0.2', expires_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.commit()
+    assert index.is_banned('10.0.0.1') is True
+    assert index.is_banned('10.0.0.2') is False
+    # 下一次轮询删除已过期的行
+    index.is_banned('10.0.0.3')
+    with client.application.app_context():
+        assert BannedIP.query.filter_by(ip='10.0.0.2').first() is None
+        BannedIP.query.filter_by(ip='10.0.0.1').delete()
+        db.session.commit()
+    assert index.is_banned('10.0.0.1') is False
+
+
+def test_cidr_and_range_bans(client):
+    from app.ban_index import parse_ban_target
+    assert parse_ban_target('10.1.2.3/16') == ['10.1.0.0/16']
+    assert parse_ban_target('10.0.0.0-10.0.1.255') == ['10.0.0.0/23']
+    assert parse_ban_target('2001:db8::1/128') == ['2001:db8::1']
+
+    login(client)
+    index = client.application.extensions['ban_index']
+    assert client.post('/ban_ip', json={'ip': 'not-an-ip/8'}).status_code == 400
+    client.post('/ban_ip', json={'ip': '198.51.0.0/16', 'permanent': True})
+    client.post('/ban_ip', json={'ip': '2001:db8::-2001:db8::ffff', 'permanent': True})
+    assert index.is_banned('198.51.7.9') is True
+    assert index.is_banned('198.52.0.1') is False
+    assert index.is_banned('2001:db8::abcd') is True
+    assert index.is_banned('2001:db8::1:0') is False
+    assert index.is_banned('garbage') is False
+
+    client.post('/unban_ip', json={'ip': '198.51.0.0/16'})
+    client.post('/unban_ip', json={'ip': '2001:db8::-2001:db8::ffff'})
+    assert index.is_banned('198.51.7.9') is False
+    assert index.is_banned('2001:db8::abcd') is False
@@ -0,0 +1,41 @@
+from app import db
+from app.models import AttackLog
+
+
+def _login(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+
+
+def test_stats_endpoints_answer_304_until_logs_change(client):
+    _login(client)
+    rv = client.get('/api/stats/summary')
+    etag = rv.headers['ETag']
+    assert rv.status_code == 200 and etag
+
+    rv = client.get('/api/stats/summary', headers={'If-None-Match': etag})
+    assert rv.status_code == 304 and rv.get_data() == b''
+
+    # 其他接口的 ETag 不同
+    assert client.get('/api/stats/top_ips').headers['ETag'] != etag
+
+    with client.application.app_context():
+        db.session.add(AttackLog(ip='10.7.0.1', payload='p'))
+        db.session.commit()
+    rv = client.get('/api/stats/summary', headers={'If-None-Match': etag})
+    assert rv.status_code == 200 and rv.headers['ETag'] != etag
+
+
+def test_batched_writes_and_bans_change_etags(client):
+    _login(client)
+    logs_etag = client.get('/api/attack/logs').headers['ETag']
+    bans_etag = client.get('/get_banned_ips').headers['ETag']
+
+    writer = client.application.extensions['attack_log_writer']
+    writer.submit(ip='10.7.0.2', payload='p', blocked=True)
+    writer.flush()
+    assert client.get('/api/attack/logs', headers={'If-None-Match': logs_etag}).status_code == 200
+    assert client.get('/get_banned_ips', headers={'If-None-Match': bans_etag}).status_code == 304
+
+    client.post('/ban_ip', json={'ip': '10.7.0.3'})
+    assert client.get('/get_banned_ips', headers={'If-None-Match': bans_etag}).status_code == 200
+    client.post('/unban_ip', json={'ip': '10.7.0.3'})
@@ -0,0 +1,66 @@
+import json
+
+from app.event_bus import EventBus
+
+
+def _frames(rv, n):
+    it = iter(rv.response)
+    frames = []
+    while len(frames) < n:
+        chunk = next(it)
+        frames.append(chunk.decode() if isinstance(chunk, bytes) else chunk)
+    return frames
+
+
+def test_bus_filters_buffers_and_resumes():
+    bus = EventBus(buffer_size=3, client_queue=2)
+    live = bus.subscribe(types=['sqli'])
+    for i in range(4):
+        bus.publish({'ip': '1.1.1.1', 'payload': f'p{i}', 'attack_type': 'sqli' if i % 2 else 'xss'})
+    events, dropped, reset = live.get(timeout=0)
+    assert [e['payload'] for e in events] == ['p1', 'p3'] and dropped == 0 and not reset
+
+    for i in range(3):
+        bus.publish({'ip': '1.1.1.1', 'payload': f'q{i}', 'attack_type': 'sqli'})
+    events, dropped, _ = live.get(timeout=0)
+    assert [e['payload'] for e in events] == ['q1', 'q2'] and dropped == 1
+
+    resumed = bus.subscribe(last_event_id=5)
+    assert [e['id'] for e in resumed.get(timeout=0)[0]] == [6, 7]
+    assert bus.subscribe(last_event_id=1).get(timeout=0)[2] is True  # 已被缓冲淘汰
+    assert bus.subscribe(last_event_id=999).get(timeout=0)[2] is True  # 来自重启前
+    events, dropped, reset = bus.subscribe().get(timeout=0.01)
+    assert events == [] and not reset  # 超时，调用方发送心跳
+
+
+def test_stream_pushes_logged_attacks_with_resume(client):
+    app = client.application
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    app.config['EVENT_STREAM_HEARTBEAT_S'] = 0.05
+    writer = app.extensions['attack_log_writer']
+    start = app.extensions['event_bus'].last_id
+
+    writer.submit(ip='10.6.0.1', payload='<script>', attack_type='xss', severity='high')
+    writer.submit(ip='10.6.0.1', payload='1 OR 1=1', attack_type='sqli', severity='high')
+    rv = client.get('/api/events/stream?type=sqli', headers={'Last-Event-ID': str(start)})
+    assert rv.mimetype == 'text/event-stream'
+    retry, frame, heartbeat = _frames(rv, 3)
+    assert retry.startswith('retry:') and heartbeat.startswith(': heartbeat')
+    assert frame.startswith(f'id: {start + 2}\nevent: attack\n')
+    event = json.loads(frame.split('data: ', 1)[1])
+    assert event['ip'] == '10.6.0.1' and event['attack_type'] == 'sqli'
+    rv.close()
+    writer.flush()
+    assert app.extensions['event_bus'].get_stats()['subscribers'] == 0
+
+
+def test_stream_closes_after_max_lifetime(client):
+    app = client.application
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    app.config['EVENT_STREAM_HEARTBEAT_S'] = 0.05
+    app.config['EVENT_STREAM_MAX_LIFETIME_S'] = 0.2
+    rv = client.get('/api/events/stream')
+    frames = [chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in rv.response]
+    assert frames[0].startswith('retry:') and len(frames) < 10  # 到期后流结束，客户端重连
+    rv.close()
+    assert app.extensions['event_bus'].get_stats()['subscribers'] == 0
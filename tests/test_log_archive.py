@@ -0,0 +1,113 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.log_archive import ARCHIVE_TABLE, BloomFilter, get_log_archive
+from app.models import AttackLog
+from app.retention import RetentionJob, RetentionPolicy
+
+
+@pytest.fixture
+def archive(client, tmp_path, monkeypatch):
+    """归档段写入 tmp_path，冷数据层也指向同一目录，不触碰实例目录下的真实归档"""
+    store = get_log_archive(client.application)
+    monkeypatch.setattr(store, 'root', os.path.join(str(tmp_path), ARCHIVE_TABLE))
+    monkeypatch.setattr(store, 'enabled', True)
+    monkeypatch.setattr(store, '_segments', {})
+    monkeypatch.setattr(store, '_signature', None)
+    return store
+
+
+def _reset_ip(app, ip):
+    """共享数据库中清掉上一次运行留下的同 IP 记录"""
+    with app.app_context():
+        AttackLog.query.filter_by(ip=ip).delete()
+        db.session.commit()
+
+
+def test_bloom_filter_round_trip():
+    bloom = BloomFilter.from_values([f'10.0.0.{i}' for i in range(200)])
+    restored = BloomFilter.from_dict(json.loads(json.dumps(bloom.to_dict())))
+    assert all(f'10.0.0.{i}' in restored for i in range(200))
+    assert sum(f'10.9.9.{i}' in restored for i in range(1000)) < 50
+
+
+def test_logs_and_export_fan_out_over_archived_segments(client, archive, tmp_path):
+    app = client.application
+    base = datetime(2002, 1, 1)
+    ip = '10.45.0.1'
+    _reset_ip(app, ip)
+    with app.app_context():
+        db.session.add_all([AttackLog(ip=ip, payload=f'cold{i}', attack_type='sqli' if i % 2 else 'xss',
+                                      timestamp=base + timedelta(hours=i)) for i in range(12)]
+                           + [AttackLog(ip=ip, payload=f'hot{i}', attack_type='sqli',
+                                        timestamp=base + timedelta(days=30, hours=i)) for i in range(3)])
+        db.session.commit()
+    job = RetentionJob(app, [RetentionPolicy('attack_log', AttackLog, timedelta(days=10))],
+                       archive_dir=str(tmp_path), batch_size=5, batch_pause_ms=0, segment_rows=4)
+    run = job.run_once(now=base + timedelta(days=20))
+    assert run['tables']['attack_log']['deleted'] == 12
+    assert len(run['segments']) == 3 and all(os.path.exists(p + '.idx.json') for p in run['segments'])
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    payloads, params = [], {'ip': ip, 'limit': 5}
+    while True:
+        body = client.get('/api/attack/logs', query_string=params).get_json()
+        payloads += [l['payload'] for l in body['logs']]
+        if not body['next_cursor']:
+            break
+        params = {'ip': ip, 'limit': 5, **body['next_cursor']}
+    assert payloads == [f'hot{i}' for i in (2, 1, 0)] + [f'cold{i}' for i in range(11, -1, -1)]
+
+    logs = client.get('/api/attack/logs', query_string={'ip': ip, 'type': 'sqli', 'order': 'time'}).get_json()['logs']
+    assert [l['payload'] for l in logs] == ['hot2', 'hot1', 'hot0', 'cold11', 'cold9', 'cold7', 'cold5', 'cold3', 'cold1']
+    logs = client.get('/api/attack/logs', query_string={'ip': ip, 'q': 'COLD1', 'order': 'time'}).get_json()['logs']
+    assert [l['payload'] for l in logs] == ['cold11', 'cold10', 'cold1']
+    logs = client.get('/api/attack/logs', query_string={
+        'ip': ip, 'after_ts': (base + timedelta(hours=8)).isoformat(), 'before_ts': (base + timedelta(days=31)).isoformat(),
+    }).get_json()['logs']
+    assert [l['payload'] for l in logs] == ['hot2', 'hot1', 'hot0', 'cold11', 'cold10', 'cold9']
+
+    rows = [json.loads(line) for line in client.get(f'/api/attack/logs/export?ip={ip}').get_data(as_text=True).splitlines()]
+    assert [r['payload'] for r in rows] == [f'cold{i}' for i in range(12)] + [f'hot{i}' for i in range(3)]
+    assert [r['id'] for r in rows] == sorted(r['id'] for r in rows)
+    assert rows[0]['time'] == base.isoformat()
+
+    before = client.get('/api/attack/archive/stats').get_json()
+    assert client.get('/api/attack/logs?ip=10.45.9.9').get_json()['logs'] == []
+    stats = client.get('/api/attack/archive/stats').get_json()
+    assert stats['segments'] >= 3 and stats['skipped_bloom'] > before['skipped_bloom']
+    assert stats['segments_read'] == before['segments_read']
+
+
+def test_archive_scan_is_capped_with_continuation_cursor(client, archive, tmp_path):
+    app = client.application
+    base = datetime(2003, 1, 1)
+    ip = '10.46.0.1'
+    _reset_ip(app, ip)
+    with app.app_context():
+        db.session.add_all([AttackLog(ip=ip, payload=f'cold{i}', attack_type='xss',
+                                      timestamp=base + timedelta(hours=i)) for i in range(12)])
+        db.session.commit()
+    job = RetentionJob(app, [RetentionPolicy('attack_log', AttackLog, timedelta(days=10))],
+                       archive_dir=str(tmp_path), batch_size=5, batch_pause_ms=0, segment_rows=4)
+    job.run_once(now=base + timedelta(days=20))
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    app.config['ARCHIVE_QUERY_MAX_SEGMENTS'] = 1
+    before = archive.get_stats()['segments_read']
+    pages, payloads, params = [], [], {'ip': ip, 'q': 'cold', 'order': 'time', 'limit': 50}
+    while True:
+        body = client.get('/api/attack/logs', query_string=params).get_json()
+        pages.append(body['next_cursor'])
+        payloads += [l['payload'] for l in body['logs']]
+        if not body['next_cursor']:
+            break
+        params = {'ip': ip, 'q': 'cold', 'order': 'time', 'limit': 50, **body['next_cursor']}
+    assert payloads == [f'cold{i}' for i in range(11, -1, -1)]
+    # 每个请求只解压一个段，不满的页带 before_ts 续查
+    assert len(pages) == 3 and 'before_ts' in pages[0]
+    assert archive.get_stats()['segments_read'] - before == 3
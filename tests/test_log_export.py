@@ -0,0 +1,45 @@
+import csv
+import gzip
+import io
+import json
+
+from app import db
+from app.models import AttackLog
+
+
+def test_export_streams_filtered_ndjson_csv_and_gzip(client):
+    app = client.application
+    app.config['ATTACK_LOG_EXPORT_BATCH_SIZE'] = 7
+    with app.app_context():
+        db.session.add_all([AttackLog(ip='10.3.0.1', payload=f'p{i}', attack_type='sqli') for i in range(30)]
+                           + [AttackLog(ip='10.3.0.1', payload='other', attack_type='xss')])
+        db.session.commit()
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+
+    rv = client.get('/api/attack/logs/export?ip=10.3.0.1&type=sqli')
+    assert rv.mimetype == 'application/x-ndjson' and rv.is_streamed
+    rows = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+    assert [r['payload'] for r in rows] == [f'p{i}' for i in range(30)]
+
+    rv = client.get('/api/attack/logs/export?ip=10.3.0.1&format=csv&limit=12')
+    rows = list(csv.DictReader(io.StringIO(rv.get_data(as_text=True))))
+    assert len(rows) == 12 and rows[0]['ip'] == '10.3.0.1' and rows[0]['attack_type'] == 'sqli'
+
+    rv = client.get('/api/attack/logs/export?ip=10.3.0.1&gzip=1')
+    assert rv.mimetype == 'application/gzip'
+    assert 'attachment' in rv.headers['Content-Disposition'] and '.ndjson.gz' in rv.headers['Content-Disposition']
+    assert len(gzip.decompress(rv.get_data()).splitlines()) == 31
+
+    assert client.get('/api/attack/logs/export?format=xml').status_code == 400
+
+
+def test_csv_export_neutralises_formula_cells(client):
+    with client.application.app_context():
+        db.session.add_all([AttackLog(ip='10.3.0.2', payload=p, attack_type='cmdi', user_agent='@SUM(A1)')
+                            for p in ('=cmd|\' /C calc\'!A0', '+1', '-2+3', 'safe')])
+        db.session.commit()
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    rv = client.get('/api/attack/logs/export?ip=10.3.0.2&format=csv')
+    rows = list(csv.DictReader(io.StringIO(rv.get_data(as_text=True))))
+    assert [r['payload'] for r in rows] == ["'=cmd|' /C calc'!A0", "'+1", "'-2+3", 'safe']
+    assert rows[0]['user_agent'] == "'@SUM(A1)" and rows[0]['ip'] == '10.3.0.2'
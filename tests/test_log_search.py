@@ -0,0 +1,48 @@
+from app import db
+from app.models import AttackLog
+from app.log_search import LogSearchIndex
+
+
+def _search(client, q, **params):
+    qs = '&'.join(f'{k}={v}' for k, v in params.items())
+    return client.get(f'/api/attack/logs?q={q}&limit=50&{qs}').get_json()['logs']
+
+
+def test_full_text_search_ranks_and_tracks_deletes(client):
+    app = client.application
+    assert app.extensions['log_search'].available is True
+    with app.app_context():
+        db.session.add_all([
+            AttackLog(ip='10.4.0.1', payload="'; EXEC xp_cmdshell 'dir' --"),
+            AttackLog(ip='10.4.0.2', payload='exec XP_CMDSHELL xp_cmdshell xp_cmdshell'),
+            AttackLog(ip='10.4.0.3', payload='benign', user_agent='scanner/xp_cmdshell-probe'),
+            AttackLog(ip='10.4.0.4', payload='nothing here'),
+        ])
+        db.session.commit()
+
+    logs = _search(client, 'xp_cmdshell')
+    assert {l['ip'] for l in logs} >= {'10.4.0.1', '10.4.0.2', '10.4.0.3'}
+    assert '10.4.0.4' not in {l['ip'] for l in logs}
+    assert logs[0]['ip'] == '10.4.0.2'  # 命中次数最多，相关度最高
+    # 少于 3 个字符时退回 ILIKE
+    assert _search(client, 'xp', ip='10.4.0.1')[0]['ip'] == '10.4.0.1'
+
+    with app.app_context():
+        AttackLog.query.filter_by(ip='10.4.0.2').delete()
+        db.session.commit()
+    assert '10.4.0.2' not in {l['ip'] for l in _search(client, 'xp_cmdshell', order='time')}
+
+
+def test_disabled_index_falls_back_to_ilike(client):
+    app = client.application
+    disabled = LogSearchIndex(app, enabled=False)
+    disabled.setup()
+    try:
+        assert disabled.matches('xp_cmdshell') is None
+        app.extensions['log_search'].available = False
+        with app.app_context():
+            db.session.add(AttackLog(ip='10.4.0.5', payload='union select fallback'))
+            db.session.commit()
+        assert [l['ip'] for l in _search(client, 'select%20fallback')] == ['10.4.0.5']
+    finally:
+        app.extensions['log_search'].setup()
@@ -4,4 +4,142 @@ def test_middleware_blocks_xss(client):
     # 若防御开启，应被拦截（400）；若关闭，返回 200（两种情况都可接受）
     assert rv.status_code in (400, 200)
     if rv.status_code == 400:
-        assert 'XSS' in rv.get_data(as_text=True) or 'blocked' in rv.get_data(as_text=True)
\ No newline at end of file
+        assert 'XSS' in rv.get_data(as_text=True) or 'blocked' in rv.get_data(as_text=True)
+
+def _inspect(body, **options):
+    from io import BytesIO
+    from app.xss_security import BodyInspector, XSSDetector
+    inspector = BodyInspector(XSSDetector.detect_xss_patterns, **options)
+    environ = {'CONTENT_LENGTH': str(len(body)), 'CONTENT_TYPE': 'application/json', 'wsgi.input': BytesIO(body)}
+    return inspector, inspector.inspect(environ), environ
+
+
+def test_body_inspector_matches_across_chunks_and_replays():
+    body = b'{"input": "' + b'a' * 100 + b'<script>alert(1)</script>"}'
+    _, result, _ = _inspect(body, chunk_size=16, overlap=64)
+    assert result.blocked is True
+
+    clean = ('{"input": "' + 'é' * 5000 + '"}').encode('utf-8')
+    inspector, result, environ = _inspect(clean, chunk_size=1000, overlap=64, max_scan_bytes=4000, spool_bytes=512)
+    assert result.blocked is False and result.truncated is True and result.scanned_bytes == 4000
+    assert environ['wsgi.input'].read() == clean
+    assert inspector.get_stats()['truncated'] == 1
+
+
+def test_body_inspector_stops_early():
+    body = b'<script>alert(1)</script>' + b'x' * 10000
+    _, result, environ = _inspect(body, chunk_size=100)
+    assert result.blocked is True and result.scanned_bytes == 100
+
+
+def test_unscanned_content_types_pass_through():
+    from io import BytesIO
+    from app.xss_security import BodyInspector, XSSDetector
+    inspector = BodyInspector(XSSDetector.detect_xss_patterns)
+    stream = BytesIO(b'\x89PNG' + b'<script>' * 100)
+    environ = {'CONTENT_LENGTH': '804', 'CONTENT_TYPE': 'image/png', 'wsgi.input': stream}
+    result = inspector.inspect(environ)
+    assert result.blocked is False and result.scanned_bytes == 0
+    assert environ['wsgi.input'] is stream and stream.tell() == 0
+    assert inspector.get_stats()['passed_through'] == 1
+
+
+def test_large_clean_json_reaches_route(client):
+    payload = {'input': 'hello ' * 50000}
+    rv = client.post('/test_xss', json=payload)
+    assert rv.status_code == 200
+    assert rv.get_json()['message'] == '已接收: ' + payload['input']
+
+
+def _verdicts(client, *args, **kwargs):
+    from werkzeug.test import EnvironBuilder
+    environ = EnvironBuilder(*args, **kwargs).get_environ()
+    verdicts, _ = client.application.wsgi_app.inspect_request(environ, block=False)
+    return verdicts, environ
+
+
+def test_request_inspection_covers_query_form_multipart_and_headers(client):
+    from io import BytesIO
+    verdicts, _ = _verdicts(client, '/console', query_string={'tab': 'x'},
+                            headers={'Referer': 'javascript:alert(1)'})
+    # 请求头命中只记录不拦截
+    assert verdicts.blocked is False and verdicts.log_only == [('header:Referer', 'javascript:alert(1)')]
+    assert verdicts.get('query', 'tab')['detected'] is False
+    assert verdicts.get('header', 'Referer')['attacks'][0]['type'] == 'xss'
+
+    verdicts, _ = _verdicts(client, '/login', method='POST', data={'username': '<svg onload=alert(1)>', 'password': 'x'})
+    assert verdicts.get('form', 'username')['attacks'][0]['type'] == 'xss'
+    assert verdicts.get('form', 'password')['detected'] is False
+
+    verdicts, environ = _verdicts(client, '/upload_mascot', method='POST', data={
+        'note': 'my mascot',
+        'mascot': (BytesIO(b'<script>alert(1)</script>' * 10), 'a.png'),
+    })
+    assert verdicts.get('multipart', 'note')['detected'] is False
+    assert verdicts.get('multipart', 'mascot') is None
+    assert verdicts.blocked is False
+    assert b'a.png' in environ['wsgi.input'].read()
+
+
+def test_headers_are_log_only(client):
+    from app.models import AttackLog
+    client.post('/login', data={'username': 'admin', 'password': 'admin'}, follow_redirects=True)
+    client.post('/toggle_defense', json={'enabled': True})
+    client.get('/logout')
+    assert client.get('/login', headers={'Referer': 'http://localhost/console?online=1'}).status_code == 200
+    assert client.get('/login', headers={'User-Agent': '<script>alert(1)</script>'}).status_code == 200
+    client.application.extensions['attack_log_writer'].flush()
+    with client.application.app_context():
+        log = AttackLog.query.filter_by(payload='<script>alert(1)</script>').order_by(AttackLog.id.desc()).first()
+        assert log is not None and log.blocked is False
+
+
+def test_endpoint_policy_limits_detectors_and_fields(client):
+    verdicts, _ = _verdicts(client, '/attack/sqli/search', method='POST',
+                            json={'query': "' OR '1'='1; cat /etc/passwd", 'note': '<script>alert(1)</script>'},
+                            headers={'User-Agent': '<script>alert(1)</script>'})
+    assert verdicts.endpoint == 'sqli_search'
+    assert [a['type'] for a in verdicts.get('json', 'query')['attacks']] == ['sqli']
+    assert set(verdicts.fields) == {'json:query'}
+    # 日志模式只记录结论，由路由决定是否拦截
+    assert verdicts.blocked is False and verdicts.detected is True
+
+    assert verdicts.json['note'] == '<script>alert(1)</script>'  # 路由复用已解析的请求体
+
+    verdicts, _ = _verdicts(client, '/api/attack/logs', query_string={'q': '<script>'})
+    assert verdicts.fields == {} and verdicts.blocked is False
+
+
+def test_reflected_query_blocked_when_defense_enabled(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'}, follow_redirects=True)
+    client.post('/toggle_defense', json={'enabled': True})
+    assert client.get('/xss/reflected', query_string={'q': '<script>alert(1)</script>'}).status_code == 400
+    assert client.get('/xss/reflected', query_string={'q': 'hello'}).status_code == 200
+    client.post('/toggle_defense', json={'enabled': False})
+    assert client.get('/xss/reflected', query_string={'q': '<script>alert(1)</script>'}).status_code == 200
+    client.post('/toggle_defense', json={'enabled': True})
+
+
+def test_uninspected_body_is_rejected_when_blocking(client, monkeypatch):
+    from io import BytesIO
+    client.post('/login', data={'username': 'admin', 'password': 'admin'}, follow_redirects=True)
+    client.post('/toggle_defense', json={'enabled': True})
+    monkeypatch.setattr(client.application.wsgi_app.inspector, 'max_scan_bytes', 4096)
+    padded = {'content': 'x' * 8192 + '<script>alert(1)</script>', 'author': 'a'}
+    assert client.post('/xss/stored', json=padded).status_code == 413
+    assert client.post('/xss/stored', json={'content': '<script>alert(1)</script>'}).status_code == 400
+
+    # multipart 不受扫描上限限制，大文件之后的文本字段同样被检测
+    verdicts, _ = _verdicts(client, '/upload_mascot', method='POST', data={
+        'mascot': (BytesIO(b'\x89PNG' + b'x' * 200000), 'a.png'),
+        'note': '<script>alert(1)</script>',
+    })
+    assert verdicts.oversized is False and verdicts.get('multipart', 'note')['detected'] is True
+
+
+def test_truncated_fields_are_not_offered_for_reuse(client):
+    cap = client.application.config['INSPECT_FIELD_MAX_CHARS']
+    verdicts, _ = _verdicts(client, '/xss/stored', method='POST',
+                            json={'query': 'a' * (cap + 1), 'short': 'ok'})
+    assert verdicts.get('json', 'query') is None and 'json:query' in verdicts.partial
+    assert verdicts.get('json', 'short')['detected'] is False
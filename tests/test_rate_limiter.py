@@ -0,0 +1,68 @@
+from app import db
+from app.attack_detectors import RateLimitDetector
+from app.attack_log_writer import get_attack_log_writer
+from app.models import AttackLog
+
+
+class FakeClock:
+    def __init__(self, now=600.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_sliding_window_counts_and_reports_first_violation(client):
+    clock = FakeClock()
+    limiter = RateLimitDetector(client.application, db, clock=clock)
+    decisions = [limiter.check('10.46.0.1', '/login') for _ in range(7)]
+    assert [d.exceeded for d in decisions] == [False] * 5 + [True, True]
+    assert [d.first_violation for d in decisions] == [False] * 5 + [True, False]
+    assert decisions[5].attack_type == 'brute_force' and decisions[5].retry_after == 60
+    # 打开登录页与其他 ip 各自计数
+    assert not limiter.check('10.46.0.1', '/login', 'GET').exceeded
+    assert not limiter.check('10.46.0.2', '/login').exceeded
+
+    # 下一窗口过半：上一窗口的 7 次按一半计入
+    clock.now += 90
+    assert limiter.check('10.46.0.1', '/login').count == 4
+    assert limiter.check('10.46.0.1', '/login').count == 5
+    d = limiter.check('10.46.0.1', '/login')
+    assert d.exceeded and d.first_violation and d.retry_after == 30
+    clock.now += 120
+    assert limiter.check('10.46.0.1', '/login').count == 1
+    assert limiter.check_rate_limit('10.46.0.3', '/api/x') == (False, '', 1)
+
+
+def test_memory_is_bounded_and_idle_keys_are_evicted(client):
+    clock = FakeClock()
+    client.application.config['RATE_LIMIT_MAX_KEYS'] = 3
+    limiter = RateLimitDetector(client.application, db, clock=clock)
+    for i in range(5):
+        limiter.check(f'10.47.0.{i}', '/page')
+    stats = limiter.get_stats()
+    assert stats['keys'] == 3 and stats['evicted_lru'] == 2
+    clock.now += 1000
+    limiter.check('10.47.1.1', '/page')
+    stats = limiter.get_stats()
+    assert stats['keys'] == 1 and stats['evicted_idle'] == 3
+
+
+def test_middleware_rejects_flood_before_inspection_and_logs_once(client):
+    env = {'REMOTE_ADDR': '10.48.0.1'}
+    for _ in range(10):
+        assert client.get('/login', environ_base=env).status_code != 429
+    codes = [client.post('/login', data={'username': 'nobody', 'password': 'x'}, environ_base=env).status_code
+             for _ in range(8)]
+    assert 429 not in codes[:5] and codes[5:] == [429, 429, 429]
+    rv = client.post('/login', data={'username': 'nobody', 'password': 'x'}, environ_base=env)
+    assert rv.status_code == 429 and int(rv.headers['Retry-After']) >= 1
+
+    app = client.application
+    get_attack_log_writer(app).flush()
+    with app.app_context():
+        logs = AttackLog.query.filter(AttackLog.ip == '10.48.0.1',
+                                      AttackLog.payload.like('rate limit exceeded%')).all()
+        assert [(l.attack_type, l.blocked, l.target_url) for l in logs] == [('brute_force', True, '/login')]
+    stats = app.extensions['detector_manager'].rate_limiter.get_stats()
+    assert stats['violations_logged'] == 1 and stats['thresholds']['api']['requests'] == 120
@@ -0,0 +1,56 @@
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import AttackLog, AuthLoginAttempt, RateLimitLog
+from app.retention import RetentionJob, RetentionPolicy
+
+
+def test_retention_archives_by_day_then_deletes_in_batches(client, tmp_path):
+    app = client.application
+    # 远早于其他测试数据的时间段，清理不会影响共享数据库中的其他记录
+    base = datetime(2001, 3, 1, 12, 0)
+    with app.app_context():
+        db.session.add_all([AttackLog(ip='10.44.0.9', payload=f'old{i}', attack_type='sqli',
+                                      timestamp=base + timedelta(days=i % 2)) for i in range(7)]
+                           + [AttackLog(ip='10.44.0.9', payload='recent', timestamp=base + timedelta(days=20))]
+                           + [AuthLoginAttempt(ip='10.44.0.9', username='u', success=False, timestamp=base)]
+                           + [RateLimitLog(ip='10.44.0.9', endpoint='/login', timestamp=base)])
+        db.session.commit()
+
+    job = RetentionJob(app, [
+        RetentionPolicy('attack_log', AttackLog, timedelta(days=10)),
+        RetentionPolicy('auth_login_attempt', AuthLoginAttempt, timedelta(days=10)),
+        RetentionPolicy('rate_limit_log', RateLimitLog, timedelta(minutes=60), archive=False),
+        RetentionPolicy('disabled', AttackLog, timedelta(0)),
+    ], archive_dir=str(tmp_path), batch_size=3, batch_pause_ms=0)
+    run = job.run_once(now=base + timedelta(days=15))
+
+    assert run['tables']['attack_log']['deleted'] == 7
+    assert run['tables']['attack_log']['batches'] == 3
+    assert run['tables']['auth_login_attempt']['archived'] == 1
+    assert run['tables']['rate_limit_log'] == {**run['tables']['rate_limit_log'], 'deleted': 1, 'archived': 0}
+    assert 'disabled' not in run['tables']
+
+    day1 = tmp_path / 'attack_log' / '2001-03-01'
+    day2 = tmp_path / 'attack_log' / '2001-03-02'
+    rows = [json.loads(line) for d in (day1, day2) for f in os.listdir(d) if f.endswith('.ndjson.gz')
+            for line in gzip.open(d / f, 'rt', encoding='utf-8')]
+    assert sorted(r['payload'] for r in rows) == sorted(f'old{i}' for i in range(7))
+    assert all(r['timestamp'].startswith('2001-03-0') and r['ip'] == '10.44.0.9' for r in rows)
+    assert not (tmp_path / 'rate_limit_log').exists()
+
+    with app.app_context():
+        assert [l.payload for l in AttackLog.query.filter_by(ip='10.44.0.9')] == ['recent']
+        assert AuthLoginAttempt.query.filter_by(ip='10.44.0.9').count() == 0
+
+    # 租约已释放，下一轮可以立即执行且无事可做
+    again = job.run_once(now=base + timedelta(days=15))
+    assert again['tables']['attack_log']['deleted'] == 0
+    assert job.get_stats()['totals']['attack_log']['deleted'] == 7
+
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    stats = client.get('/api/retention/stats').get_json()
+    assert stats['policies']['rate_limit_log'] == {'ttl_s': 3600, 'archive': False}
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from app.stats_cache import StatsCache
+
+
+def test_stats_cache_ttl_and_single_flight():
+    cache = StatsCache(ttl_ms=60000)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', compute)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [1] * 8 and len(calls) == 1
+    assert cache.get_or_compute('k', compute) == 1
+    stats = cache.get_stats()
+    assert stats['misses'] == 1 and stats['coalesced'] == 7 and stats['hits'] == 1
+
+    cache.invalidate('k')
+    assert cache.get_or_compute('k', compute) == 2
+
+
+def test_dashboard_stats_served_from_cache(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    client.application.extensions['stats_cache'].invalidate()
+    first = client.get('/api/dashboard/stats').get_json()
+    second = client.get('/api/dashboard/stats').get_json()
+    assert first == second
+    assert set(first['details']) == {'sqli', 'xss', 'cmdi', 'path'}
+    stats = client.get('/api/stats/cache').get_json()
+    assert stats['hits'] >= 1 and stats['misses'] >= 1
+
+
+def test_stats_cache_entries_follow_data_version():
+    cache = StatsCache(ttl_ms=60000)
+    assert cache.get_or_compute('k', lambda: 'v1', version=1) == 'v1'
+    assert cache.get_or_compute('k', lambda: 'x', version=1) == 'v1'
+    # 版本变化后即使未过期也重新计算，旧值不会配上新版本返回
+    assert cache.get_or_compute('k', lambda: 'v2', version=2) == 'v2'
+
+
+def test_dashboard_stats_revalidation_sees_new_logs(client):
+    from app import db
+    from app.models import AttackLog
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    first = client.get('/api/dashboard/stats')
+    with client.application.app_context():
+        db.session.add(AttackLog(ip='10.7.0.9', payload='p', attack_type='sqli'))
+        db.session.commit()
+    second = client.get('/api/dashboard/stats', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200 and second.headers['ETag'] != first.headers['ETag']
+    assert second.get_json()['total_attacks'] == first.get_json()['total_attacks'] + 1
+    third = client.get('/api/dashboard/stats', headers={'If-None-Match': second.headers['ETag']})
+    assert third.status_code == 304
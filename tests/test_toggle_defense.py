@@ -11,4 +11,37 @@ def test_toggle_defense_api(client):
     assert j['enabled'] is False
     with client.application.app_context():
         s = Setting.query.filter_by(key='xss_defense_enabled').first()
-        assert s is not None and s.value == '0'
\ No newline at end of file
+        assert s is not None and s.value == '0'
+
+def test_settings_snapshot_serves_reads_from_memory(client):
+    from app.settings_service import get_settings
+    login(client)
+    settings = get_settings(client.application)
+    client.post('/toggle_defense', json={'enabled': False})
+    # 写入后本进程立即生效
+    assert settings.get('xss_defense_enabled') == '0'
+    version = settings.version
+    polls = settings.get_stats()['polls']
+    for _ in range(20):
+        settings.get_bool('auth_security_enabled')
+    assert settings.get_stats()['polls'] == polls
+    client.post('/toggle_defense', json={'enabled': True})
+    assert int(settings.version) == int(version) + 1
+    assert settings.get('xss_defense_enabled') == '1'
+
+
+def test_settings_snapshot_picks_up_external_version_bump(client):
+    from app import db
+    from app.settings_service import SettingsService, bump_version
+    service = SettingsService(client.application, poll_ms=0)
+    with client.application.app_context():
+        assert service.get('demo_flag') is None
+        db.session.add(Setting(key='demo_flag', value='on'))
+        db.session.commit()
+        # 未递增版本号的直接写入不会触发重新加载
+        assert service.get('demo_flag') is None
+        bump_version()
+        db.session.commit()
+        assert service.get_bool('demo_flag', False) is True
+        Setting.query.filter_by(key='demo_flag').delete()
+        db.session.commit()
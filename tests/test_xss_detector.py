@@ -10,4 +10,14 @@ def test_detect_javascript_uri():
     assert XSSDetector.detect_xss_patterns('javascript:alert(1)') is True
 
 def test_no_false_positive():
-    assert XSSDetector.detect_xss_patterns('hello world') is False
\ No newline at end of file
+    assert XSSDetector.detect_xss_patterns('hello world') is False
+
+def test_detect_encoded_script_tag():
+    assert XSSDetector.detect_xss_patterns('%3Cscript%3Ealert(1)%3C/script%3E') is True
+    assert XSSDetector.detect_xss_patterns('&#60;script&#62;alert(1)&#60;/script&#62;') is True
+
+def test_event_handler_requires_tag_context():
+    assert XSSDetector.detect_xss_patterns('<img src=x onerror=alert(1)>') is True
+    assert XSSDetector.detect_xss_patterns('<svg/onload = alert(1)>') is True
+    assert XSSDetector.detect_xss_patterns('http://localhost/console?online=1') is False
+    assert XSSDetector.detect_xss_patterns('{"action": "toggle", "one": 1, "only=": 2}') is False